@@ -0,0 +1,243 @@
+"""
+desc: Headless benchmarks of the hot paths: simulation, tracking, pivot fitting and likelihood evaluation.
+
+Every benchmark runs on synthetic inputs (simulated trajectories, a video drawn with OpenCV in a temporary
+directory), so that the suite needs neither a display nor the data directory. Each one reports a rate, in units
+per second, the best of a few repeats, and is compared to the rate stored for it in the baselines file: a rate
+below (1 - tolerance) times its baseline is reported as a regression, and makes the run exit with an error.
+Baselines are specific to a machine, store them again with --save after a deliberate change or on a new machine.
+
+USAGE (from the src directory)
+python -m benchmarks
+python -m benchmarks --quick --filter likelihood
+python -m benchmarks --save
+"""
+from __future__ import division, print_function
+
+import argparse
+import contextlib
+import io
+import json
+import os
+import shutil
+import sys
+import tempfile
+import timeit
+from collections import OrderedDict
+
+import numpy as np
+
+from pendulum_sim.core import (SimplePendulumPhysics, gen_doublependulum_physics_RK4,
+                               gen_doublependulum_physics_Steomer_Verlet)
+from pendulum_sim.inverse_physics_engine import (batch_log_likelihood, double_log_likelihood, simulate_double_measures,
+                                                 simulate_measures)
+from pendulum_sim.trajectory import save_trajectory
+from video_processing.ball_tracking import track_video
+from video_processing.find_center import find_pivot
+from video_processing.synthetic import write_pendulum_video
+
+BASELINES = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'benchmark_baselines.json')
+
+# name -> (unit, function of the size scale returning (run, units per run, cleanup or None))
+BENCHMARKS = OrderedDict()
+
+
+def benchmark(name, unit):
+    """Registers a benchmark. The decorated function sets up its inputs, scaled by its argument, and returns a
+    callable running the timed code, the number of units it processes, and a cleanup callable or None."""
+
+    def register(setup):
+        BENCHMARKS[name] = (unit, setup)
+        return setup
+
+    return register
+
+
+def _consume(generator, n_steps):
+    for _ in range(n_steps):
+        next(generator)
+
+
+@benchmark('simple_simulate', 'steps')
+def _simple_simulate(scale):
+    n_steps = int(20000 * scale)
+    return (lambda: _consume(SimplePendulumPhysics(1, 300, theta0=1.0).simulate(), n_steps)), n_steps, None
+
+
+@benchmark('simple_simulate_walls', 'steps')
+def _simple_simulate_walls(scale):
+    n_steps = int(20000 * scale)
+    # (x_min, y_min, x_max, y_max): the bob starts inside, at x = 252, and bounces on x_min = -200 every swing
+    walls = (-200, -400, 260, 400)
+    pendulum = SimplePendulumPhysics(1, 300, theta0=1.0, walls=walls)
+    assert pendulum.can_collide()
+    return (lambda: _consume(pendulum.simulate(), n_steps)), n_steps, None
+
+
+@benchmark('simple_simulate_verlet', 'steps')
+def _simple_simulate_verlet(scale):
+    n_steps = int(20000 * scale)
+    return ((lambda: _consume(SimplePendulumPhysics(1, 300, theta0=1.0, integrator='verlet').simulate(), n_steps)),
+            n_steps, None)
+
+
+def _double_args():
+    return 0.01, 2.0, 2.5, 0.0, 0.0, 1.0, 0.5, 0.2, 0.1, 9.8
+
+
+@benchmark('double_rk4', 'steps')
+def _double_rk4(scale):
+    n_steps = int(10000 * scale)
+    return (lambda: _consume(gen_doublependulum_physics_RK4(*_double_args()), n_steps)), n_steps, None
+
+
+@benchmark('double_verlet', 'steps')
+def _double_verlet(scale):
+    n_steps = int(10000 * scale)
+    return (lambda: _consume(gen_doublependulum_physics_Steomer_Verlet(*_double_args()), n_steps)), n_steps, None
+
+
+def _tracking(scale, incremental=False, chunk_size=None):
+    n_frames = max(int(120 * scale), 10)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'pendulum.avi')
+    write_pendulum_video(path, n_frames)
+    return ((lambda: track_video(path, width=640, incremental=incremental, chunk_size=chunk_size)), n_frames,
+            (lambda: shutil.rmtree(directory)))
+
+
+@benchmark('tracking', 'frames')
+def _track(scale):
+    return _tracking(scale)
+
+
+@benchmark('tracking_incremental', 'frames')
+def _track_incremental(scale):
+    return _tracking(scale, incremental=True)
+
+
+@benchmark('tracking_chunked', 'frames')
+def _track_chunked(scale):
+    return _tracking(scale, chunk_size=16)
+
+
+def _pivot(scale, n_points):
+    n_points = max(int(n_points * scale), 10)
+    rng = np.random.RandomState(0)
+    theta = 0.6 * np.cos(0.05 * np.arange(n_points))
+    centers = np.stack((320 + 300 * np.sin(theta), 100 + 300 * np.cos(theta)), axis=1)
+    centers += rng.normal(0, 1, centers.shape)
+    directory = tempfile.mkdtemp()
+    path = os.path.join(directory, 'centers.traj')
+    save_trajectory(path, centers, units='px')
+
+    def run():
+        # find_pivot prints its fit
+        with contextlib.redirect_stdout(io.StringIO()):
+            find_pivot(path)
+
+    return run, 1, (lambda: shutil.rmtree(directory))
+
+
+# latency of find_pivot against the length of the track
+for _n_points in (100, 1000, 10000, 100000):
+    benchmark('find_pivot_{}'.format(_n_points), 'calls')(lambda scale, n_points=_n_points: _pivot(scale, n_points))
+
+
+@benchmark('likelihood', 'evaluations')
+def _likelihood(scale):
+    pivot = (400, 400)
+    measures = simulate_measures((300, 0.6, 1.0), pivot, 200)[0]
+    rng = np.random.RandomState(0)
+    params = (300, 0.6, 1.0) + rng.normal(0, 1, (int(64 * scale) or 1, 3)) * (1, 0.01, 0.01)
+    return (lambda: batch_log_likelihood(measures, params, pivot)), params.shape[0], None
+
+
+@benchmark('double_likelihood', 'evaluations')
+def _double_likelihood(scale):
+    pivot = (400, 400)
+    # (m1, m2, l1, l2, theta1_0, theta2_0, theta1_dot0, theta2_dot0)
+    truth = np.array((1.0, 0.5, 200, 100, 2.0, 2.5, 0.0, 0.0))
+    measures = simulate_double_measures(truth, pivot, 200)[0]
+    rng = np.random.RandomState(0)
+    params = truth + rng.normal(0, 1, (int(16 * scale) or 1, truth.shape[0])) * (0, 0, 0.5, 0.5, 0, 0, 0, 0)
+    return (lambda: double_log_likelihood(measures, params, pivot)), params.shape[0], None
+
+
+def run_benchmark(name, scale=1.0, repeats=5):
+    """Best rate, in units per second, of repeats timings of the benchmark name"""
+    unit, setup = BENCHMARKS[name]
+    run, n_units, cleanup = setup(scale)
+    try:
+        timer = timeit.Timer(run)
+        # also warms up caches and lazy initializations: each timing runs for at least 0.2s
+        number = timer.autorange()[0]
+        best = min(timer.repeat(repeats, number)) / number
+    finally:
+        if cleanup is not None:
+            cleanup()
+    return n_units / best
+
+
+def load_baselines(path=BASELINES):
+    if not os.path.exists(path):
+        return {}
+    with open(path) as f:
+        return json.load(f)
+
+
+def save_baselines(results, path=BASELINES):
+    """Stores the rates of results, keeping the baselines of the benchmarks that were not run"""
+    baselines = load_baselines(path)
+    baselines.update(results)
+    with open(path, 'w') as f:
+        json.dump(OrderedDict(sorted(baselines.items())), f, indent=2)
+        f.write('\n')
+
+
+def compare(results, baselines, tolerance=0.3):
+    """Names of the benchmarks of results slower than (1 - tolerance) times their baseline"""
+    return [name for name, rate in results.items() if name in baselines and rate < (1 - tolerance) * baselines[name]]
+
+
+def run_suite(names=None, scale=1.0, repeats=5, baselines=None, tolerance=0.3, out=None):
+    """Runs the benchmarks names (all by default), prints their rates against the baselines, returns the rates and
+    the names of the regressions"""
+    baselines = {} if baselines is None else baselines
+    out = sys.stdout if out is None else out
+    results = OrderedDict()
+    for name in BENCHMARKS if names is None else names:
+        results[name] = run_benchmark(name, scale, repeats)
+        line = "{:<24} {:>12.1f} {:<14}".format(name, results[name], BENCHMARKS[name][0] + '/s')
+        if name in baselines:
+            ratio = results[name] / baselines[name]
+            line += " {:6.2f}x baseline{}".format(ratio, "  REGRESSION" if ratio < 1 - tolerance else "")
+        print(line, file=out)
+    return results, compare(results, baselines, tolerance)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-f", "--filter", help="only run the benchmarks whose name contains this string")
+    ap.add_argument("-q", "--quick", action="store_true", help="smaller inputs, for a smoke test")
+    ap.add_argument("-r", "--repeats", type=int, default=5, help="timed runs per benchmark, the best one counts")
+    ap.add_argument("-t", "--tolerance", type=float, default=0.3,
+                    help="relative slowdown against the baseline reported as a regression")
+    ap.add_argument("-b", "--baselines", default=BASELINES, help="path of the baselines file")
+    ap.add_argument("-s", "--save", action="store_true", help="store the rates as the new baselines")
+    args = ap.parse_args()
+
+    names = [name for name in BENCHMARKS if args.filter is None or args.filter in name]
+    # the rates of quick runs are not comparable to the baselines
+    baselines = {} if args.quick else load_baselines(args.baselines)
+    results, regressions = run_suite(names, 0.1 if args.quick else 1.0, args.repeats, baselines, args.tolerance)
+    if args.save:
+        save_baselines(results, args.baselines)
+    elif regressions:
+        print("Regressions : {}".format(", ".join(regressions)))
+        return 1
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
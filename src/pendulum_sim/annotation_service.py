@@ -0,0 +1,455 @@
+"""
+desc: Local annotation service: videos in, tracked centers, pivot and inferred parameters out.
+
+A long running HTTP server takes the paths of pendulum videos and annotates each one in a persistent pool of
+worker processes, which keep their imports, and the optional surrogate table, loaded from one job to the next.
+A job runs the whole pipeline: ball tracking, pivot fit on the centers, then Metropolis-Hastings inference of the
+simple pendulum seeded by guess_state, sampled in chunks so that the workers report their progress as they go.
+The progress events of every job are streamed as JSON lines, and everything a job produces is written to a
+results store, one directory per job: job.json, centers.traj, samples.npy and result.json. Jobs are identified
+by the path, size and modification time of the video and by their options, so that a video already annotated
+with the same options is answered from the store, also after a restart of the service.
+
+USAGE (from the src directory)
+python -m pendulum_sim.annotation_service serve --store ../data/annotations --processes 4
+python -m pendulum_sim.annotation_service submit ball_tracking_example.mp4 --option n_samples=2000
+
+HTTP API
+POST /jobs                {"video": path, "options": {...}}, returns the job
+GET  /jobs                all the jobs of this run
+GET  /jobs/<id>           the job, with its result once done
+GET  /jobs/<id>/events    the progress events of the job as JSON lines, until it is done or failed
+"""
+from __future__ import division, print_function
+
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import re
+import threading
+import time
+
+try:
+    from http.server import BaseHTTPRequestHandler, HTTPServer
+    from socketserver import ThreadingMixIn
+    from urllib.request import Request, urlopen
+except ImportError:
+    from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+    from SocketServer import ThreadingMixIn
+    from urllib2 import Request, urlopen
+
+try:
+    from queue import Empty
+except ImportError:
+    from Queue import Empty
+
+import cv2
+import numpy as np
+
+from pendulum_sim.inverse_physics_engine import PARAM_NAMES, estimate_state, guess_state, metropolis_hastings
+from pendulum_sim.surrogate import PendulumTable
+from pendulum_sim.trajectory import save_trajectory
+from video_processing.ball_tracking import track_video
+from video_processing.find_center import fit_circle, ransac_circle
+
+# Options of a job, and their defaults. dt defaults to the frame period of the video.
+DEFAULT_OPTIONS = {'width': 600, 'chunk_size': 16, 'ransac': False, 'n_samples': 1000, 'n_walkers': 32,
+                   'sigma': 2.0, 'dt': None, 'seed': 0, 'period_prior': False}
+# Progress events sent while sampling
+N_PROGRESS_EVENTS = 10
+FINISHED = ('done', 'failed')
+# Seconds between the checks of the running jobs for dead or stalled workers
+POLL_INTERVAL = 0.5
+
+# State of the worker processes, set by _init_worker
+_progress = None
+_table = None
+
+
+def job_id(video, options):
+    """Identifier of the annotation of the video file with the options"""
+    stat = os.stat(video)
+    key = json.dumps([os.path.abspath(video), stat.st_size, stat.st_mtime, sorted(options.items())])
+    return hashlib.sha1(key.encode('utf-8')).hexdigest()[:16]
+
+
+def _write_json(path, obj):
+    # write then rename, so that a job interrupted while writing is not taken for done
+    with open(path + '.tmp', 'w') as f:
+        json.dump(obj, f, indent=1)
+    os.rename(path + '.tmp', path)
+
+
+class ResultStore(object):
+    """Directory holding one subdirectory of files per job"""
+
+    def __init__(self, root):
+        self.root = root
+        if not os.path.isdir(root):
+            os.makedirs(root)
+
+    def job_dir(self, job_id):
+        path = os.path.join(self.root, job_id)
+        if not os.path.isdir(path):
+            os.makedirs(path)
+        return path
+
+    def result(self, job_id):
+        """Result of the job, None if it is not done"""
+        path = os.path.join(self.root, job_id, 'result.json')
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return json.load(f)
+
+
+def _init_worker(progress, table_path):
+    global _progress, _table
+    _progress = progress
+    if table_path is not None:
+        _table = PendulumTable.load(table_path)
+
+
+def _emit(job, event, **info):
+    _progress.put((job, dict(info, event=event, time=time.time())))
+
+
+def annotate(job, video, options, job_dir):
+    """Runs the pipeline on the video in a worker, the outcome is sent as the 'done' or 'failed' event"""
+    try:
+        _emit(job, 'done', result=_annotate(job, video, options, job_dir))
+    except Exception as e:
+        _emit(job, 'failed', error='{}: {}'.format(type(e).__name__, e))
+
+
+def _annotate(job, video, options, job_dir):
+    timings = {}
+    start = time.time()
+    _emit(job, 'tracking', pid=os.getpid())
+    camera = cv2.VideoCapture(video)
+    fps = camera.get(cv2.CAP_PROP_FPS) or None
+    camera.release()
+    centers = track_video(video, width=options['width'], chunk_size=options['chunk_size'])
+    if len(centers) < 10:
+        raise ValueError("the ball was found in {} frames of {}".format(len(centers), video))
+    save_trajectory(os.path.join(job_dir, 'centers.traj'), centers, fps=fps, units='px', source_video=video,
+                    frame_width=options['width'], pivot=None)
+    timings['tracking'] = time.time() - start
+    _emit(job, 'tracked', n_centers=len(centers))
+
+    start = time.time()
+    if options['ransac']:
+        x, y, length, _ = ransac_circle(centers)
+    else:
+        x, y, length = fit_circle(centers)
+    pivot = (x, y)
+    timings['pivot_fit'] = time.time() - start
+    _emit(job, 'pivot', pivot=pivot, length=length)
+
+    start = time.time()
+    dt = options['dt'] or (1.0 / fps if fps else 0.01)
+    guess = guess_state(centers, pivot, length, dt)
+    length_prior = None
+    if options['period_prior']:
+        state = estimate_state(centers, pivot, dt, guess.lab.g)
+        if np.isfinite(state.length):
+            length_prior = (state.length, state.length_std)
+    rng = np.random.RandomState(options['seed'])
+    n_samples = options['n_samples']
+    step = max(n_samples // N_PROGRESS_EVENTS, 1)
+    current = (guess.l, guess.theta, guess.theta_dot)
+    chunks = []
+    n_accepted = 0
+    for done in range(0, n_samples, step):
+        # the walkers of each chunk start where the last one left them
+        chunk = metropolis_hastings(centers, pivot, current, n_samples=min(step, n_samples - done),
+                                    n_walkers=options['n_walkers'], sigma=options['sigma'], dt=dt, g=guess.lab.g,
+                                    seed=rng.randint(2 ** 31), table=_table, length_prior=length_prior)
+        current = chunk.samples[-1]
+        chunks.append(chunk.samples)
+        n_accepted += chunk.acceptance_rate * chunk.samples[:, :, 0].size
+        _emit(job, 'sampling', done=done + len(chunk.samples), total=n_samples,
+              acceptance_rate=n_accepted / sum(c[:, :, 0].size for c in chunks))
+    samples = np.concatenate(chunks)
+    np.save(os.path.join(job_dir, 'samples.npy'), samples)
+    timings['inference'] = time.time() - start
+
+    burnt = samples[n_samples // 2:].reshape(-1, len(PARAM_NAMES))
+    result = {'video': video, 'n_centers': len(centers), 'fps': fps, 'dt': dt, 'pivot': pivot,
+              'length_fit': length, 'acceptance_rate': n_accepted / samples[:, :, 0].size,
+              'mean': dict(zip(PARAM_NAMES, burnt.mean(axis=0))), 'std': dict(zip(PARAM_NAMES, burnt.std(axis=0))),
+              'timings': timings, 'pid': os.getpid()}
+    result = json.loads(json.dumps(result, default=float))
+    _write_json(os.path.join(job_dir, 'result.json'), result)
+    return result
+
+
+class AnnotationService(object):
+    """Queue of annotation jobs run by a pool of processes (as many as CPUs by default), stored in store_dir.
+    With table_path, a surrogate.PendulumTable saved there is loaded once by each worker and used by inference.
+
+    The pool replaces a worker that dies, an OpenCV crash or an out of memory kill, but its job would never finish:
+    a running job is marked failed when its worker is gone, or when it sent no event for stall_timeout seconds.
+    """
+
+    def __init__(self, store_dir, processes=None, table_path=None, stall_timeout=1800):
+        self.store = ResultStore(store_dir)
+        self.stall_timeout = stall_timeout
+        self.jobs = {}
+        # AsyncResult of the unfinished jobs
+        self._results = {}
+        self._changed = threading.Condition()
+        self._progress = multiprocessing.Queue()
+        self.pool = multiprocessing.Pool(processes, _init_worker, (self._progress, table_path))
+        self._listener = threading.Thread(target=self._listen)
+        self._listener.daemon = True
+        self._listener.start()
+
+    def submit(self, video, options=None):
+        """Queues the annotation of the video, unless it is running or stored, returns the job"""
+        unknown = set(options or {}) - set(DEFAULT_OPTIONS)
+        if unknown:
+            raise ValueError("unknown options {}".format(", ".join(sorted(unknown))))
+        if not os.path.isfile(video):
+            raise ValueError("no video at {}".format(video))
+        options = dict(DEFAULT_OPTIONS, **(options or {}))
+        job = job_id(video, options)
+        with self._changed:
+            if job in self.jobs and self.jobs[job]['state'] != 'failed':
+                return self.status(job)
+            self.jobs[job] = {'id': job, 'video': video, 'options': options, 'state': 'queued', 'events': [],
+                              'submitted': time.time(), 'result': self.store.result(job)}
+            if self.jobs[job]['result'] is not None:
+                self.jobs[job]['state'] = 'done'
+                self.jobs[job]['events'].append({'event': 'done', 'stored': True, 'time': time.time()})
+                return self.status(job)
+        job_dir = self.store.job_dir(job)
+        _write_json(os.path.join(job_dir, 'job.json'), {'video': video, 'options': options})
+        with self._changed:
+            self._results[job] = self.pool.apply_async(annotate, (job, video, options, job_dir))
+        return self.status(job)
+
+    def _listen(self):
+        checked = time.time()
+        while True:
+            if time.time() - checked > POLL_INTERVAL:
+                self._check_jobs()
+                checked = time.time()
+            try:
+                message = self._progress.get(timeout=POLL_INTERVAL)
+            except Empty:
+                continue
+            if message is None:
+                return
+            job, event = message
+            with self._changed:
+                state = self.jobs[job]
+                if state['state'] in FINISHED:
+                    # late event of a job marked failed
+                    continue
+                state['events'].append(event)
+                if 'pid' in event:
+                    state['pid'] = event['pid']
+                if event['event'] in FINISHED:
+                    self._finish(job, event)
+                else:
+                    state['state'] = 'running'
+                self._changed.notify_all()
+
+    def _finish(self, job, event):
+        state = self.jobs[job]
+        state['state'] = event['event']
+        state['result'] = event.get('result')
+        self._results.pop(job, None)
+
+    def _fail(self, job, error):
+        event = {'event': 'failed', 'error': error, 'time': time.time()}
+        self.jobs[job]['events'].append(event)
+        self._finish(job, event)
+        self._changed.notify_all()
+
+    def _check_jobs(self):
+        """Marks failed the jobs whose worker died or raised, and the running jobs stalled for stall_timeout"""
+        alive = set(process.pid for process in multiprocessing.active_children())
+        with self._changed:
+            for job, result in list(self._results.items()):
+                state = self.jobs[job]
+                if result.ready():
+                    # the done or failed event is on its way, unless annotate itself raised
+                    if not result.successful():
+                        try:
+                            result.get()
+                        except Exception as e:
+                            self._fail(job, '{}: {}'.format(type(e).__name__, e))
+                elif state.get('pid') is not None and state['pid'] not in alive:
+                    self._fail(job, "the worker process {} died".format(state['pid']))
+                elif (state['state'] == 'running' and self.stall_timeout is not None
+                      and time.time() - state['events'][-1]['time'] > self.stall_timeout):
+                    self._fail(job, "no progress for {} s".format(self.stall_timeout))
+
+    def status(self, job):
+        """Summary of the job: its state, last event and result. KeyError for unknown jobs."""
+        with self._changed:
+            state = self.jobs[job]
+            return {'id': job, 'video': state['video'], 'options': state['options'], 'state': state['state'],
+                    'n_events': len(state['events']), 'last_event': state['events'][-1] if state['events'] else None,
+                    'result': state['result']}
+
+    def events(self, job, timeout=None):
+        """Generator of the progress events of the job, past and future, until it is finished, or until it sent no
+        event for timeout seconds"""
+        n_seen = 0
+        last = time.time()
+        while True:
+            with self._changed:
+                state = self.jobs[job]
+                if len(state['events']) == n_seen and state['state'] not in FINISHED:
+                    self._changed.wait(POLL_INTERVAL)
+                new = state['events'][n_seen:]
+                finished = state['state'] in FINISHED
+            for event in new:
+                yield event
+            n_seen += len(new)
+            if finished and not new:
+                return
+            if new:
+                last = time.time()
+            elif timeout is not None and time.time() - last > timeout:
+                return
+
+    def wait(self, job, timeout=None):
+        for _ in self.events(job, timeout):
+            pass
+        return self.status(job)
+
+    def close(self):
+        """Lets the queued jobs finish, then stops the workers"""
+        self.pool.close()
+        # the pool would wait forever for the results of the jobs lost with a dead worker
+        with self._changed:
+            while self._results:
+                self._changed.wait(POLL_INTERVAL)
+        self.pool.terminate()
+        self.pool.join()
+        self._progress.put(None)
+        self._listener.join()
+
+
+class _ThreadingHTTPServer(ThreadingMixIn, HTTPServer):
+    """HTTP server handling each request in a thread, as http.server.ThreadingHTTPServer of Python 3.7+"""
+    daemon_threads = True
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """JSON API of the AnnotationService of the server"""
+
+    def _send_json(self, code, obj):
+        body = json.dumps(obj).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        if self.path.rstrip('/') != '/jobs':
+            return self._send_json(404, {'error': 'not found'})
+        try:
+            request = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))).decode('utf-8'))
+            self._send_json(202, self.server.service.submit(request['video'], request.get('options')))
+        except (ValueError, KeyError, TypeError) as e:
+            self._send_json(400, {'error': '{}: {}'.format(type(e).__name__, e)})
+
+    def do_GET(self):
+        service = self.server.service
+        match = re.match(r'^/jobs(?:/(\w+)(/events)?)?/?$', self.path)
+        if match is None:
+            return self._send_json(404, {'error': 'not found'})
+        job, stream = match.groups()
+        if job is None:
+            return self._send_json(200, [service.status(job) for job in sorted(service.jobs)])
+        if job not in service.jobs:
+            return self._send_json(404, {'error': 'unknown job {}'.format(job)})
+        if stream is None:
+            return self._send_json(200, service.status(job))
+        # one JSON event per line, the response ends with the job
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/x-ndjson')
+        self.end_headers()
+        for event in service.events(job):
+            self.wfile.write((json.dumps(event) + '\n').encode('utf-8'))
+            self.wfile.flush()
+
+    def log_message(self, format, *args):
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+def make_server(service, host='127.0.0.1', port=8765, verbose=False):
+    """HTTP server of the service, port 0 picks a free port"""
+    server = _ThreadingHTTPServer((host, port), _Handler)
+    server.service = service
+    server.verbose = verbose
+    return server
+
+
+def submit(url, video, options=None):
+    """Submits the video to the service at url, then generates the progress events of its job"""
+    request = Request(url.rstrip('/') + '/jobs', json.dumps({'video': video, 'options': options or {}}).encode(),
+                      {'Content-Type': 'application/json'})
+    job = json.loads(urlopen(request).read().decode('utf-8'))
+    response = urlopen('{}/jobs/{}/events'.format(url.rstrip('/'), job['id']))
+    try:
+        for line in response:
+            yield dict(json.loads(line.decode('utf-8')), job=job['id'])
+    finally:
+        response.close()
+
+
+def _parse_option(text):
+    name, value = text.split('=', 1)
+    return name, json.loads(value)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    commands = ap.add_subparsers(dest='command')
+    serve = commands.add_parser('serve', help="run the service")
+    serve.add_argument("-s", "--store", default='../data/annotations', help="directory of the results store")
+    serve.add_argument("-p", "--processes", type=int, help="number of worker processes, the CPUs by default")
+    serve.add_argument("-t", "--table", help="surrogate table (.npz) the workers load for inference")
+    serve.add_argument("--stall-timeout", type=float, default=1800,
+                       help="seconds without progress after which a running job is marked failed")
+    serve.add_argument("--host", default='127.0.0.1')
+    serve.add_argument("--port", type=int, default=8765)
+    serve.add_argument("-v", "--verbose", action="store_true", help="log the requests")
+    client = commands.add_parser('submit', help="annotate videos with a running service, printing the progress")
+    client.add_argument("videos", nargs='+')
+    client.add_argument("-u", "--url", default='http://127.0.0.1:8765')
+    client.add_argument("-o", "--option", action='append', type=_parse_option, default=[],
+                        help="job option as name=JSON value, e.g. n_samples=2000, repeatable")
+    args = ap.parse_args()
+
+    if args.command == 'submit':
+        for video in args.videos:
+            for event in submit(args.url, os.path.abspath(video), dict(args.option)):
+                print(json.dumps(event))
+        return
+    if args.command != 'serve':
+        ap.error("a command, serve or submit, is required")
+    service = AnnotationService(args.store, args.processes, args.table, args.stall_timeout)
+    server = make_server(service, args.host, args.port, args.verbose)
+    print("Annotation service on http://{}:{}, results in {}".format(args.host, server.server_port, args.store))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        service.close()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,202 @@
+"""
+desc: Vectorized simulation of ensembles of simple pendula, used to evaluate many candidate parameter sets at once,
+      and batched simulation of double pendula with the compiled kernels of kernels.py
+"""
+from __future__ import division, print_function
+
+import time
+
+import numpy as np
+
+from pendulum_sim.core import LENGTH_SCALE, SimplePendulumPhysics, gen_doublependulum_physics_RK4
+from pendulum_sim.kernels import default_backend, doublependulum_trajectories
+
+
+def _batch_constants(m, l, theta0, theta_dot0, g):
+    """Constants a and b of the Hamiltonian of SimplePendulum.simulate, and the initial generalized coordinates"""
+    m, l, theta0, theta_dot0 = np.broadcast_arrays(*(np.asarray(x, dtype=float).ravel()
+                                                     for x in (m, l, theta0, theta_dot0)))
+    l = l / LENGTH_SCALE
+    # agregate the physical constants
+    a = 1.0 / (m * l * l)
+    b = -m * g * l
+    # initialize generalized coordinates
+    return a, b, theta0.copy(), theta_dot0 / a
+
+
+def _rk4_steps(q, p, a, b, n_steps, dt, thetas=None):
+    """Integrates the generalized coordinates q and p in place, storing the angle after each step in thetas"""
+    # Integrate using Runge-Kutta 4th Order Method, one step for all the pendula at once
+    for i in range(n_steps):
+        k1 = dt * (a * p)
+        h1 = dt * (b * np.sin(q))
+        k2 = dt * (a * (p + h1 / 2.0))
+        h2 = dt * (b * np.sin(q + k1 / 2.0))
+        k3 = dt * (a * (p + h2 / 2.0))
+        h3 = dt * (b * np.sin(q + k2 / 2.0))
+        k4 = dt * (a * (p + h3))
+        h4 = dt * (b * np.sin(q + k3))
+        q += ((k1 + k4) / 2.0 + k2 + k3) / 3.0
+        p += ((h1 + h4) / 2.0 + h2 + h3) / 3.0
+        if thetas is not None:
+            thetas[:, i] = q
+
+
+def simulate_batch(m, l, theta0, theta_dot0, n_steps, dt=0.01, g=9.8):
+    """Integrates a whole ensemble of simple pendula with the RK4 scheme of SimplePendulum.simulate.
+
+    m, l, theta0 and theta_dot0 are scalars or arrays broadcast against each other, l is in the same units as
+    SimplePendulum.l. Returns an (n_candidates, n_steps) array holding the angle after each step, i.e. the
+    successive angles yielded by the generator.
+    """
+    a, b, q, p = _batch_constants(m, l, theta0, theta_dot0, g)
+    thetas = np.empty((q.shape[0], n_steps))
+    _rk4_steps(q, p, a, b, n_steps, dt, thetas)
+    return thetas
+
+
+def advance_batch(m, l, theta, theta_dot, n_steps=1, dt=0.01, g=9.8):
+    """Angles and angle speeds (n_candidates,) of an ensemble of simple pendula after n_steps steps of
+    simulate_batch, which only keeps the current state"""
+    a, b, q, p = _batch_constants(m, l, theta, theta_dot, g)
+    _rk4_steps(q, p, a, b, n_steps, dt)
+    return q, a * p
+
+
+def simulate_batch_sensitivities(m, l, theta0, theta_dot0, n_steps, dt=0.01, g=9.8):
+    """simulate_batch propagating, next to the angles, their derivatives with respect to (l, theta0, theta_dot0).
+
+    The derivatives are the forward sensitivities of the discrete RK4 map, so they are the exact gradients of the
+    simulated angles, to rounding. Returns the (n_candidates, n_steps) angles, identical to the ones of
+    simulate_batch, and their (n_candidates, n_steps, 3) derivatives, l in the units of SimplePendulum.l.
+    """
+    m, l, theta0, theta_dot0 = np.broadcast_arrays(*(np.asarray(x, dtype=float).ravel()
+                                                     for x in (m, l, theta0, theta_dot0)))
+    l_px = l
+    l = l / LENGTH_SCALE
+    # agregate the physical constants
+    a = 1.0 / (m * l * l)
+    b = -m * g * l
+    # and their derivatives with respect to the parameters, as (n_candidates, 3) arrays
+    zeros = np.zeros_like(a)
+    da = np.stack((-2 * a / l_px, zeros, zeros), axis=-1)
+    db = np.stack((b / l_px, zeros, zeros), axis=-1)
+    a_, b_ = a[:, np.newaxis], b[:, np.newaxis]
+    # initialize generalized coordinates and their tangents
+    q = theta0.copy()
+    p = theta_dot0 / a
+    dq = np.stack((zeros, np.ones_like(a), zeros), axis=-1)
+    dp = np.stack((2 * theta_dot0 / (a * l_px), zeros, 1 / a), axis=-1)
+    thetas = np.empty((q.shape[0], n_steps))
+    dthetas = np.empty((q.shape[0], n_steps, 3))
+
+    def stage(q_arg, p_arg, dq_arg, dp_arg):
+        """Increments of one RK4 stage and their tangents"""
+        sin_q = np.sin(q_arg)
+        return (dt * (a * p_arg), dt * (b * sin_q), dt * (da * p_arg[:, np.newaxis] + a_ * dp_arg),
+                dt * (db * sin_q[:, np.newaxis] + (b * np.cos(q_arg))[:, np.newaxis] * dq_arg))
+
+    # Integrate using Runge-Kutta 4th Order Method, differentiated stage by stage
+    for i in range(n_steps):
+        k1, h1, dk1, dh1 = stage(q, p, dq, dp)
+        k2, h2, dk2, dh2 = stage(q + k1 / 2.0, p + h1 / 2.0, dq + dk1 / 2.0, dp + dh1 / 2.0)
+        k3, h3, dk3, dh3 = stage(q + k2 / 2.0, p + h2 / 2.0, dq + dk2 / 2.0, dp + dh2 / 2.0)
+        k4, h4, dk4, dh4 = stage(q + k3, p + h3, dq + dk3, dp + dh3)
+        q += ((k1 + k4) / 2.0 + k2 + k3) / 3.0
+        p += ((h1 + h4) / 2.0 + h2 + h3) / 3.0
+        dq += ((dk1 + dk4) / 2.0 + dk2 + dk3) / 3.0
+        dp += ((dh1 + dh4) / 2.0 + dh2 + dh3) / 3.0
+        thetas[:, i] = q
+        dthetas[:, i] = dq
+    return thetas, dthetas
+
+
+def simulate_loop(m, l, theta0, theta_dot0, n_steps, dt=0.01):
+    """Reference implementation: loops over SimplePendulumPhysics.simulate for each parameter set"""
+    m, l, theta0, theta_dot0 = np.broadcast_arrays(*(np.asarray(x, dtype=float).ravel()
+                                                     for x in (m, l, theta0, theta_dot0)))
+    thetas = np.empty((m.shape[0], n_steps))
+    for j in range(m.shape[0]):
+        simulator = SimplePendulumPhysics(m[j], l[j], theta0=theta0[j], theta_dot0=theta_dot0[j], dt=dt).simulate()
+        for i in range(n_steps):
+            thetas[j, i] = next(simulator)[0]
+    return thetas
+
+
+def simulate_double_batch(m1, m2, l1, l2, theta1_0, theta2_0, theta1_dot0, theta2_dot0, n_steps, dt=0.01, g=9.8,
+                          backend=None):
+    """Integrates an ensemble of double pendula with the RK4 scheme of gen_doublependulum_physics_RK4.
+
+    The arguments are scalars or arrays broadcast against each other, lengths in the units of
+    DoublePendulumPhysics.l. Returns an (n_candidates, n_steps, 2) array of the angles after each step.
+    """
+    return doublependulum_trajectories(theta1_0, theta2_0, theta1_dot0, theta2_dot0, m1, m2,
+                                       np.asarray(l1, dtype=float) / LENGTH_SCALE,
+                                       np.asarray(l2, dtype=float) / LENGTH_SCALE, g, dt, n_steps, backend)
+
+
+def simulate_double_loop(m1, m2, l1, l2, theta1_0, theta2_0, theta1_dot0, theta2_dot0, n_steps, dt=0.01, g=9.8):
+    """Reference implementation: loops over gen_doublependulum_physics_RK4 for each parameter set"""
+    params = np.broadcast_arrays(*(np.asarray(x, dtype=float).ravel()
+                                   for x in (m1, m2, l1, l2, theta1_0, theta2_0, theta1_dot0, theta2_dot0)))
+    angles = np.empty((params[0].shape[0], n_steps, 2))
+    for j, (m1_j, m2_j, l1_j, l2_j, q1_j, q2_j, w1_j, w2_j) in enumerate(zip(*params)):
+        simulator = gen_doublependulum_physics_RK4(dt, q1_j, q2_j, w1_j, w2_j, m1_j, m2_j, l1_j / LENGTH_SCALE,
+                                                   l2_j / LENGTH_SCALE, g)
+        for i in range(n_steps):
+            angles[j, i] = next(simulator)
+    return angles
+
+
+def benchmark(n_candidates=1000, n_steps=500, seed=0):
+    rng = np.random.RandomState(seed)
+    m = rng.uniform(0.1, 10, n_candidates)
+    l = rng.uniform(100, 400, n_candidates)
+    theta0 = rng.uniform(-np.pi / 2, np.pi / 2, n_candidates)
+    theta_dot0 = rng.uniform(-5, 5, n_candidates)
+
+    start = time.time()
+    reference = simulate_loop(m, l, theta0, theta_dot0, n_steps)
+    loop_time = time.time() - start
+    start = time.time()
+    thetas = simulate_batch(m, l, theta0, theta_dot0, n_steps)
+    batch_time = time.time() - start
+
+    print("{} pendula, {} steps".format(n_candidates, n_steps))
+    print("Generator loop : {:.3f}s".format(loop_time))
+    print("Batch engine : {:.3f}s".format(batch_time))
+    print("Speedup : {:.1f}x".format(loop_time / batch_time))
+    print("Max abs difference : {}".format(np.max(np.abs(thetas - reference))))
+    return loop_time, batch_time
+
+
+def benchmark_double(n_candidates=100, n_steps=1000, seed=0, backend=None):
+    rng = np.random.RandomState(seed)
+    m1, m2 = rng.uniform(0.5, 2, (2, n_candidates))
+    l1, l2 = rng.uniform(150, 300, (2, n_candidates))
+    # chaotic initial conditions
+    theta1_0, theta2_0 = rng.uniform(np.pi / 2, np.pi, (2, n_candidates))
+    theta1_dot0, theta2_dot0 = rng.uniform(-2, 2, (2, n_candidates))
+    args = (m1, m2, l1, l2, theta1_0, theta2_0, theta1_dot0, theta2_dot0, n_steps)
+    backend = default_backend(n_candidates) if backend is None else backend
+
+    start = time.time()
+    reference = simulate_double_loop(*args)
+    loop_time = time.time() - start
+    # compile outside of the timing
+    simulate_double_batch(*(args[:-1] + (1,)), backend=backend)
+    start = time.time()
+    angles = simulate_double_batch(*args, backend=backend)
+    batch_time = time.time() - start
+
+    print("{} double pendula, {} steps".format(n_candidates, n_steps))
+    print("Generator loop : {:.3f}s".format(loop_time))
+    print("{} kernels : {:.3f}s".format(backend, batch_time))
+    print("Speedup : {:.1f}x".format(loop_time / batch_time))
+    print("Max abs difference : {}".format(np.max(np.abs(angles - reference))))
+    return loop_time, batch_time
+
+
+if __name__ == '__main__':
+    benchmark()
+    benchmark_double()
@@ -0,0 +1,107 @@
+"""
+desc: Bounded LRU cache of simulated trajectories, keyed on (model, quantized parameters, dt, n_steps).
+
+The parameters are snapped to a grid of step resolution before being simulated, so that proposals closer than the
+resolution share a simulation and a cached result does not depend on the order of the requests. Entries evicted
+from memory can be spilled to a directory as .npy files, which are memory mapped when requested again, also by
+later runs on the same directory (flush() spills the entries still in memory).
+"""
+from __future__ import division, print_function
+
+import hashlib
+import os
+from collections import OrderedDict
+
+import numpy as np
+
+
+class SimulationCache(object):
+    """LRU cache of at most maxsize simulations in memory, optionally spilled to spill_dir"""
+
+    def __init__(self, maxsize=10000, resolution=1e-6, spill_dir=None):
+        self.maxsize = maxsize
+        self.resolution = resolution
+        self.spill_dir = spill_dir
+        if spill_dir is not None and not os.path.isdir(spill_dir):
+            os.makedirs(spill_dir)
+        self._entries = OrderedDict()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def quantize(self, params):
+        """Integer grid coordinates of the rows of params"""
+        return np.round(np.atleast_2d(params) / self.resolution).astype(np.int64)
+
+    def _spill_path(self, key):
+        return os.path.join(self.spill_dir, hashlib.sha1(repr(key).encode()).hexdigest() + '.npy')
+
+    def _get(self, key):
+        value = self._entries.pop(key, None)
+        if value is not None:
+            self.hits += 1
+        elif self.spill_dir is not None and os.path.exists(self._spill_path(key)):
+            value = np.load(self._spill_path(key), mmap_mode='r')
+            self.disk_hits += 1
+        else:
+            return None
+        # most recently used last
+        self._entries[key] = value
+        return value
+
+    def _spill(self, key, value):
+        path = self._spill_path(key)
+        if not os.path.exists(path):
+            # write then rename, so that concurrent runs never read a partial file
+            tmp_path = '{}.{}.tmp'.format(path, os.getpid())
+            with open(tmp_path, 'wb') as f:
+                np.save(f, np.asarray(value))
+            os.rename(tmp_path, path)
+
+    def _put(self, key, value):
+        self._entries[key] = value
+        while len(self._entries) > self.maxsize:
+            old_key, old_value = self._entries.popitem(last=False)
+            self.evictions += 1
+            if self.spill_dir is not None:
+                self._spill(old_key, old_value)
+
+    def lookup(self, model, params, dt, n_steps, simulate):
+        """Simulations of the rows of params, stacked in an array.
+
+        model is any hashable identifying the simulator and its constants. simulate(params) returns the stacked
+        simulations of the rows of the (n, n_params) params it gets, here the quantized missing rows, in one call.
+        """
+        grid = self.quantize(params)
+        keys = [(model, tuple(row), float(dt), int(n_steps)) for row in grid]
+        values = [self._get(key) for key in keys]
+        missing = [i for i, value in enumerate(values) if value is None]
+        if missing:
+            self.misses += len(missing)
+            # several missing rows may share a key
+            first = OrderedDict((keys[i], i) for i in missing)
+            simulated = dict(zip(first, simulate(grid[list(first.values())] * self.resolution)))
+            for key, value in simulated.items():
+                self._put(key, value)
+            for i in missing:
+                values[i] = simulated[keys[i]]
+        return np.stack(values)
+
+    def flush(self):
+        """Spills the entries in memory to spill_dir"""
+        if self.spill_dir is not None:
+            for key, value in self._entries.items():
+                self._spill(key, value)
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self):
+        """Counters of the cache, requests of rows served from memory, from disk, and simulated"""
+        requests = self.hits + self.disk_hits + self.misses
+        return {'hits': self.hits, 'disk_hits': self.disk_hits, 'misses': self.misses, 'evictions': self.evictions,
+                'size': len(self), 'hit_rate': (self.hits + self.disk_hits) / requests if requests else 0.0}
@@ -0,0 +1,393 @@
+###############################################################################
+"""
+desc: Pygame-free physics of the simple and double pendula: parameters, state, integration and trajectories.
+      The sprites of physics_engine.py and double_pendulum.py wrap these classes, the inference code uses them
+      directly so that it runs without a display.
+"""
+###############################################################################
+from __future__ import division, print_function
+
+from functools import partial
+from math import cos, sin
+
+import numpy as np
+
+from pendulum_sim.integrators import INTEGRATORS, STEPS, SYMPLECTIC, _hermite, integrate, rk4_step
+from pendulum_sim.kernels import doublependulum_trajectories
+
+SCREEN_WIDTH = 800
+SCREEN_HEIGHT = SCREEN_WIDTH
+SCREEN_DIM = (SCREEN_WIDTH, SCREEN_HEIGHT)
+SCREEN_CENTER = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
+
+# Pendulum lengths are given in pixels (millimetres), the physics runs in metres
+LENGTH_SCALE = 1000.0
+
+# Wall collisions: relative energy margin of the free swing range, interpolated samples per step searched for an
+# impact, bisections of the impact time, and impacts per step after which the bob rests on the wall
+_ENERGY_MARGIN = 1e-3
+_EVENT_SAMPLES = 8
+_BISECTIONS = 40
+_MAX_EVENTS = 8
+
+
+class Lab(object):
+    def __init__(self, g=9.8, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
+        self.g = g
+        self.width = width
+        self.height = height
+
+
+class SimplePendulumPhysics(object):
+    """Parameters and state of a simple pendulum, integrated with RK4 or another method of integrators.py.
+
+    The bob optionally bounces on walls, given as the (x_min, y_min, x_max, y_max) box allowed to its center, in
+    pixels relative to the pivot (y axis pointing down). Impacts are located inside the time steps and reverse the
+    angle speed, scaled by the restitution coefficient.
+    """
+
+    def __init__(self, m, l, theta0=np.pi / 2, theta_dot0=0, lab=Lab(), dt=0.01, integrator='rk4', walls=None,
+                 restitution=1):
+        if integrator not in INTEGRATORS:
+            raise ValueError("Unknown integrator {}".format(integrator))
+        self.m = m
+        self.l = l
+        self.theta = theta0
+        self.theta_dot = theta_dot0
+        self.lab = lab
+        self.dt = dt
+        self.integrator = integrator
+        self.walls = walls
+        self.restitution = restitution
+        self.simulator = self.simulate()
+
+    def simulate(self):
+        """Returns a generator of next angular position, at current angle and angle speed"""
+        if self.walls is not None:
+            return self._simulate_with_walls()
+        return self._simulate_free()
+
+    def _simulate_free(self):
+        l = self.l / LENGTH_SCALE
+        dt = self.dt
+        m = self.m
+        # agregate the physical constants
+        a = 1.0 / (m * l * l)
+        b = float(-m * self.lab.g * l)
+        # initialize generalized coordinates
+        q = self.theta
+        p = self.theta_dot / a
+        # this is the physics! ... Hamiltonian style
+        q_dot = lambda p_arg: a * p_arg
+        p_dot = lambda q_arg: b * np.sin(q_arg)
+        if self.integrator != 'rk4':
+            for q, p in integrate(lambda q_arg, p_arg: (q_dot(p_arg), p_dot(q_arg)), q, p, dt, self.integrator,
+                                  separable=True):
+                yield (q, q_dot(p))
+        # Integrate using Runge-Kutta 4th Order Method
+        while True:
+            k1 = dt * q_dot(p)
+            h1 = dt * p_dot(q)
+            k2 = dt * q_dot(p + h1 / 2.0)
+            h2 = dt * p_dot(q + k1 / 2.0)
+            k3 = dt * q_dot(p + h2 / 2.0)
+            h3 = dt * p_dot(q + k2 / 2.0)
+            k4 = dt * q_dot(p + h3)
+            h4 = dt * p_dot(q + k3)
+            q += ((k1 + k4) / 2.0 + k2 + k3) / 3.0
+            p += ((h1 + h4) / 2.0 + h2 + h3) / 3.0
+            yield (q, q_dot(p))
+
+    def free_swing_range(self, theta=None, theta_dot=None):
+        """Largest |angle| reached by the pendulum from the (current) state by energy conservation, pi if it loops"""
+        theta = self.theta if theta is None else theta
+        theta_dot = self.theta_dot if theta_dot is None else theta_dot
+        omega2 = self.lab.g * LENGTH_SCALE / self.l
+        # relative margin on the energy for the drift of the integrator
+        energy = theta_dot * theta_dot / 2.0 - omega2 * np.cos(theta) + _ENERGY_MARGIN * omega2
+        if energy >= omega2:
+            return np.pi
+        return np.arccos(-energy / omega2)
+
+    def can_collide(self, theta=None, theta_dot=None):
+        """Whether the free swing from the (current) state reaches the walls"""
+        if self.walls is None:
+            return False
+        x_min, y_min, x_max, y_max = self.walls
+        theta_max = self.free_swing_range(theta, theta_dot)
+        x = self.l * (np.sin(theta_max) if theta_max < np.pi / 2 else 1.0)
+        return -x < x_min or x > x_max or self.l * np.cos(theta_max) < y_min or self.l > y_max
+
+    def wall_distances(self, theta):
+        """(4,) + shape(theta) signed distances of the bob center to the walls, negative outside of the box"""
+        x_min, y_min, x_max, y_max = self.walls
+        x, y = self.l * np.sin(theta), self.l * np.cos(theta)
+        return np.array([x - x_min, y - y_min, x_max - x, y_max - y])
+
+    def _impact_time(self, q0, v0, q1, v1, h):
+        """Time of the first impact on a wall in a step of length h from angle q0 and speed v0 to q1, v1, or None.
+
+        The angle is interpolated within the step, walls the bob is already beyond at the start are ignored.
+        """
+        tol = 1e-9 * self.l
+        ts = np.linspace(0, h, _EVENT_SAMPLES + 1)
+        distances = self.wall_distances(_hermite(ts, 0, q0, v0, h, q1, v1))
+        outside = (distances < -tol) & (distances[:, :1] >= -tol)
+        if not outside.any():
+            return None
+        i = np.argmax(outside.any(axis=0))
+        t_impact = h
+        for k in np.flatnonzero(outside[:, i]):
+            lo, hi = ts[i - 1], ts[i]
+            if distances[k, i - 1] > 0:
+                for _ in range(_BISECTIONS):
+                    mid = (lo + hi) / 2
+                    if self.wall_distances(_hermite(mid, 0, q0, v0, h, q1, v1))[k] >= 0:
+                        lo = mid
+                    else:
+                        hi = mid
+            t_impact = min(t_impact, lo)
+        return t_impact
+
+    def _simulate_with_walls(self):
+        """Generator of the integration with the impacts, which happen at their exact time within the steps.
+
+        While the free swing range stays inside the walls no impact is searched for, that is until the next impact
+        or reset. The adaptive 'rk45' integrator is replaced by fixed 'rk4' steps here.
+        """
+        l = self.l / LENGTH_SCALE
+        m = self.m
+        a = 1.0 / (m * l * l)
+        b = float(-m * self.lab.g * l)
+        f = lambda q_arg, p_arg: (a * p_arg, b * np.sin(q_arg))
+        step = STEPS.get(self.integrator, rk4_step)
+        if self.integrator in SYMPLECTIC:
+            # the Hamiltonian of the simple pendulum is separable
+            step = partial(step, separable=True)
+        q = float(self.theta)
+        p = self.theta_dot / a
+        free = not self.can_collide(q, a * p)
+        while True:
+            remaining = self.dt
+            n_events = 0
+            while True:
+                q_new, p_new = step(f, q, p, remaining)
+                if free:
+                    break
+                if n_events == _MAX_EVENTS:
+                    # resting contact, stay on the wall
+                    q_new, p_new = q, 0.0
+                    break
+                t_impact = self._impact_time(q, a * p, float(q_new), a * float(p_new), remaining)
+                if t_impact is None:
+                    break
+                if t_impact > 0:
+                    q, p = (float(x) for x in step(f, q, p, t_impact))
+                p = -self.restitution * p
+                remaining -= t_impact
+                n_events += 1
+                free = not self.can_collide(q, a * p)
+            q, p = float(q_new), float(p_new)
+            yield (q, a * p)
+
+    def reset(self, theta, theta_dot):
+        """Sets a new state and restarts the integration from it"""
+        self.theta = theta
+        self.theta_dot = theta_dot
+        self.simulator = self.simulate()
+
+    def step(self):
+        """Advances the pendulum of one time step, returns the new (theta, theta_dot)"""
+        self.theta, self.theta_dot = next(self.simulator)
+        return self.theta, self.theta_dot
+
+    def trajectory(self, n_steps):
+        """Angles of the next n_steps steps from the current state, without advancing the pendulum"""
+        simulator = self.simulate()
+        return np.array([next(simulator)[0] for _ in range(n_steps)])
+
+    def position(self, pivot=(0, 0), theta=None):
+        """Position of the bob, in pixels, for a pivot given in pixels (y axis pointing down)"""
+        theta = self.theta if theta is None else theta
+        return np.stack((pivot[0] + self.l * np.sin(theta), pivot[1] + self.l * np.cos(theta)), axis=-1)
+
+
+def gen_doublependulum_physics_RK4(dt, theta1_0, theta2_0, theta1_dot0, theta2_dot0, m1, m2, l1, l2, g,
+                                   velocities=False):
+    """Generator of the next (theta1, theta2), and (theta1_dot, theta2_dot) after them with velocities"""
+    eom = doublependulum_eom(m1, m2, l1, l2, g) if velocities else None
+    # aggregate some constants
+    M = float(m1 + m2)
+    L1L2 = float(l1 * l2)
+    L1sqr = float(l1 * l1)
+    L2sqr = float(l2 * l2)
+    L1M = float(l1 * M)
+    L2M2 = float(l2 * m2)
+    GL1M = float(g * L1M)
+    GM2L2 = float(g * m2 * l2)
+    L2sqrM2 = float(L2sqr * m2)
+    L1sqrM = float(L1sqr * M)
+    L1L2M2 = float(L1L2 * m2)
+    # initialize generalized coordinates
+    q1 = theta1_0
+    q2 = theta2_0
+    p1 = L1sqrM * theta1_dot0 + L1L2M2 * theta2_dot0 * cos(theta1_0 - theta2_0)
+    p2 = L2sqrM2 * theta2_dot0 + L1L2M2 * theta1_dot0 * cos(theta1_0 - theta2_0)
+
+    # the Equations of Motion
+    def EOM(q1, q2, p1, p2):
+        # compute common parts
+        delta_q = q1 - q2
+        sin_delq = sin(delta_q)
+        cos_delq = cos(delta_q)
+        A = L1L2 * (m1 + m2 * sin_delq * sin_delq)
+        B = p1 * p2 * sin_delq / A
+        C = (sin(2 * delta_q) * (L2sqrM2 * p1 * p1 + L1sqrM * p2 * p2 - 2 * L1L2M2 * p1 * p2 * cos_delq)
+             / (2 * A * A))
+        # equations of motion
+        q1_dot = (l2 * p1 - l1 * p2 * cos_delq) / (l1 * A)
+        q2_dot = (L1M * p2 - L2M2 * p1 * cos_delq) / (L2M2 * A)
+        p1_dot = -GL1M * sin(q1) - B + C
+        p2_dot = -GM2L2 * sin(q2) + B - C
+        return (dt * q1_dot, dt * q2_dot, dt * p1_dot, dt * p2_dot)
+
+    # loop forever
+    while True:
+        # integrate using Runge-Kutta 4th order
+        k1_1, k2_1, n1_1, n2_1 = EOM(q1, q2, p1, p2)
+        k1_2, k2_2, n1_2, n2_2 = EOM(q1 + k1_1 / 2.0, q2 + k2_1 / 2.0, p1 + n1_1 / 2.0, p2 + n2_1 / 2.0)
+        k1_3, k2_3, n1_3, n2_3 = EOM(q1 + k1_2 / 2.0, q2 + k2_2 / 2.0, p1 + n1_2 / 2.0, p2 + n2_2 / 2.0)
+        k1_4, k2_4, n1_4, n2_4 = EOM(q1 + k1_3, q2 + k2_3, p1 + n1_3, p2 + n2_3)
+        q1 += ((k1_1 + k1_4) / 2.0 + k1_2 + k1_3) / 3.0
+        q2 += ((k2_1 + k2_4) / 2.0 + k2_2 + k2_3) / 3.0
+        p1 += ((n1_1 + n1_4) / 2.0 + n1_2 + n1_3) / 3.0
+        p2 += ((n2_1 + n2_4) / 2.0 + n2_2 + n2_3) / 3.0
+        if velocities:
+            q_dot = eom((q1, q2), (p1, p2))[0]
+            yield (q1, q2, float(q_dot[0]), float(q_dot[1]))
+        else:
+            yield (q1, q2)
+
+
+def doublependulum_eom(m1, m2, l1, l2, g):
+    """Hamiltonian equations of motion of the double pendulum, as f(q, p) -> (dq/dt, dp/dt) on 2-arrays"""
+    # aggregate some constants
+    M = float(m1 + m2)
+    L1L2 = float(l1 * l2)
+    L1sqr = float(l1 * l1)
+    L2sqr = float(l2 * l2)
+    L1M = float(l1 * M)
+    L2M2 = float(l2 * m2)
+    GL1M = float(g * L1M)
+    GM2L2 = float(g * m2 * l2)
+    L2sqrM2 = float(L2sqr * m2)
+    L1sqrM = float(L1sqr * M)
+    L1L2M2 = float(L1L2 * m2)
+
+    def EOM(q, p):
+        q1, q2 = q
+        p1, p2 = p
+        # compute common parts
+        delta_q = q1 - q2
+        sin_delq = sin(delta_q)
+        cos_delq = cos(delta_q)
+        A = L1L2 * (m1 + m2 * sin_delq * sin_delq)
+        B = p1 * p2 * sin_delq / A
+        C = (sin(2 * delta_q) * (L2sqrM2 * p1 * p1 + L1sqrM * p2 * p2 - 2 * L1L2M2 * p1 * p2 * cos_delq)
+             / (2 * A * A))
+        # equations of motion
+        q1_dot = (l2 * p1 - l1 * p2 * cos_delq) / (l1 * A)
+        q2_dot = (L1M * p2 - L2M2 * p1 * cos_delq) / (L2M2 * A)
+        p1_dot = -GL1M * sin(q1) - B + C
+        p2_dot = -GM2L2 * sin(q2) + B - C
+        return np.array((q1_dot, q2_dot)), np.array((p1_dot, p2_dot))
+
+    return EOM
+
+
+def doublependulum_momenta(theta1_0, theta2_0, theta1_dot0, theta2_dot0, m1, m2, l1, l2):
+    """Generalized momenta of the double pendulum for the given angles and angular speeds"""
+    L1L2M2 = float(l1 * l2 * m2)
+    p1 = float(l1 * l1 * (m1 + m2)) * theta1_dot0 + L1L2M2 * theta2_dot0 * cos(theta1_0 - theta2_0)
+    p2 = float(l2 * l2 * m2) * theta2_dot0 + L1L2M2 * theta1_dot0 * cos(theta1_0 - theta2_0)
+    return p1, p2
+
+
+def gen_doublependulum_physics(dt, theta1_0, theta2_0, theta1_dot0, theta2_dot0, m1, m2, l1, l2, g,
+                               integrator='verlet', velocities=False, **options):
+    """Generator of the next (theta1, theta2), and (theta1_dot, theta2_dot) after them with velocities, integrated
+    with one of the methods of integrators.py"""
+    eom = doublependulum_eom(m1, m2, l1, l2, g)
+    q = np.array((theta1_0, theta2_0), dtype=float)
+    p = np.array(doublependulum_momenta(theta1_0, theta2_0, theta1_dot0, theta2_dot0, m1, m2, l1, l2))
+    for q, p in integrate(eom, q, p, dt, integrator, **options):
+        if velocities:
+            q_dot = eom(q, p)[0]
+            yield (q[0], q[1], q_dot[0], q_dot[1])
+        else:
+            yield (q[0], q[1])
+
+
+def gen_doublependulum_physics_Steomer_Verlet(dt,
+                                              theta1_0,
+                                              theta2_0,
+                                              theta1_dot0,
+                                              theta2_dot0,
+                                              m1, m2, l1, l2, g,
+                                              velocities=False):
+    """Stormer-Verlet integration, symplectic: the energy does not drift. The Hamiltonian of the double pendulum
+    is not separable, its implicit stages make it about 50 times slower than gen_doublependulum_physics_RK4."""
+    return gen_doublependulum_physics(dt, theta1_0, theta2_0, theta1_dot0, theta2_dot0, m1, m2, l1, l2, g,
+                                      integrator='verlet', velocities=velocities)
+
+
+class DoublePendulumPhysics(object):
+    """Parameters and state of a fixed pivot double pendulum, integrated by one of the methods of integrators.py
+    or by a generator with the signature of the ones above, velocities keyword included. The default 'rk4' is the
+    fastest, 'verlet' does not drift in energy but solves implicit stages, about 50 times slower."""
+
+    def __init__(self, m1=1, m2=0.5, l1=200, l2=100, theta1_0=np.pi / 4, theta2_0=np.pi / 4,
+                 theta1_dot0=0, theta2_dot0=0, g=9.8, dt=0.01, integrator='rk4'):
+        self.m = (m1, m2)
+        self.l = (l1, l2)
+        self.angle0 = (theta1_0, theta2_0)
+        self.angle_dot0 = (theta1_dot0, theta2_dot0)
+        self.angle = self.angle0
+        self.angle_dot = self.angle_dot0
+        self.g = g
+        self.dt = dt
+        if integrator == 'rk4':
+            integrator = gen_doublependulum_physics_RK4
+        elif integrator in INTEGRATORS:
+            integrator = partial(gen_doublependulum_physics, integrator=integrator)
+        elif not callable(integrator):
+            raise ValueError("Unknown integrator {}".format(integrator))
+        self.generator = integrator
+        self.simulator = self.simulate(velocities=True)
+
+    def simulate(self, velocities=False):
+        """Returns a generator of the next (theta1, theta2), and (theta1_dot, theta2_dot) after them with
+        velocities, at current angles and angle speeds"""
+        m1, m2 = self.m
+        l1, l2 = self.l
+        return self.generator(self.dt, self.angle[0], self.angle[1], self.angle_dot[0], self.angle_dot[1],
+                              m1, m2, l1 / LENGTH_SCALE, l2 / LENGTH_SCALE, self.g, velocities=velocities)
+
+    def step(self):
+        """Advances the pendulum of one time step, returns the new (theta1, theta2)"""
+        state = next(self.simulator)
+        self.angle, self.angle_dot = tuple(state[:2]), tuple(state[2:])
+        return self.angle
+
+    def trajectory(self, n_steps):
+        """(n_steps, 2) array of the angles of the next n_steps steps from the current state, without advancing
+        the pendulum"""
+        if self.generator is gen_doublependulum_physics_RK4:
+            # same steps, in a compiled loop
+            m1, m2 = self.m
+            l1, l2 = self.l
+            return doublependulum_trajectories(self.angle[0], self.angle[1], self.angle_dot[0], self.angle_dot[1],
+                                               m1, m2, l1 / LENGTH_SCALE, l2 / LENGTH_SCALE, self.g, self.dt,
+                                               n_steps)[0]
+        simulator = self.simulate()
+        return np.array([next(simulator) for _ in range(n_steps)])
@@ -0,0 +1,198 @@
+"""
+desc: Generation of labelled synthetic pendulum clips from parameter grids and random distributions.
+
+Each clip is written as clip_<index>.avi along with clip_<index>.traj, a trajectory file holding the per frame bob
+positions (screen pixels) and angles, with the ground truth parameters in its metadata. For double pendula the
+positions are the ones of the second bob, the 'bobs' array holds the positions of both. The parameters of every
+clip are drawn from the seed and the clip index only, so a dataset is reproducible and can be sharded across
+processes in any order. A clip whose trajectory file exists is done: generating again the same dataset resumes it.
+
+USAGE (from the src directory)
+python -m pendulum_sim.dataset --out ../data/synthetic --config sweep.json --n-samples 1000 --processes 32
+with sweep.json like {"model": "simple", "grid": {"l": [200, 300]}, "distributions": {"theta0": ["uniform", -1, 1]}}
+"""
+from __future__ import division, print_function
+
+import argparse
+import itertools
+import json
+import os
+from multiprocessing import Pool
+
+import numpy as np
+
+from pendulum_sim.core import Lab
+from pendulum_sim.trajectory import save_trajectory
+
+DEFAULT_PARAMETERS = {
+    'simple': {'m': 1.0, 'l': 300.0, 'theta0': np.pi / 5, 'theta_dot0': 0.0, 'radius': 20, 'restitution': 1.0,
+               'g': 9.8},
+    'double': {'m1': 1.0, 'm2': 0.5, 'l1': 200.0, 'l2': 100.0, 'theta1_0': np.pi / 4, 'theta2_0': np.pi / 4,
+               'theta1_dot0': 0.0, 'theta2_dot0': 0.0, 'g': 9.8},
+}
+
+DISTRIBUTIONS = {
+    'uniform': lambda rng, low, high: rng.uniform(low, high),
+    'normal': lambda rng, mean, std: rng.normal(mean, std),
+    'loguniform': lambda rng, low, high: np.exp(rng.uniform(np.log(low), np.log(high))),
+    'choice': lambda rng, *values: values[rng.randint(len(values))],
+}
+# Parameters that must be positive, drawn again when a distribution gives a non positive value
+POSITIVE_PARAMETERS = ('m', 'l', 'radius', 'g', 'm1', 'm2', 'l1', 'l2')
+MAX_DRAWS = 100
+
+
+def sample_parameters(grid=None, distributions=None, n_samples=1, seed=0):
+    """List of parameter dicts: n_samples draws of the distributions for every point of the grid.
+
+    grid maps parameter names to lists of values, distributions maps them to (name, args...) specs of DISTRIBUTIONS.
+    The draws of the i-th parameter set only depend on (seed, i). The POSITIVE_PARAMETERS are drawn from their
+    distribution truncated to positive values, e.g. a 'normal' length is drawn again until it is positive, and a
+    ValueError is raised for non positive grid values or after MAX_DRAWS non positive draws.
+    """
+    grid = grid or {}
+    distributions = distributions or {}
+    names = sorted(grid)
+    parameters = []
+    for name in names:
+        if name in POSITIVE_PARAMETERS and min(grid[name]) <= 0:
+            raise ValueError("the grid of {} has non positive values".format(name))
+    for values in itertools.product(*(grid[name] for name in names)):
+        for _ in range(n_samples):
+            rng = np.random.RandomState([seed, len(parameters)])
+            params = dict(zip(names, values))
+            for name in sorted(distributions):
+                params[name] = _draw(rng, name, distributions[name])
+            parameters.append(params)
+    return parameters
+
+
+def _draw(rng, name, spec):
+    for _ in range(MAX_DRAWS if name in POSITIVE_PARAMETERS else 1):
+        value = DISTRIBUTIONS[spec[0]](rng, *spec[1:])
+        if name not in POSITIVE_PARAMETERS or value > 0:
+            return value
+    raise ValueError("{} draws of {} from {} are not positive".format(MAX_DRAWS, name, spec))
+
+
+def build_sprite(model, params, dt=0.01, size=(800, 800)):
+    """Pendulum sprite of the given model ('simple' or 'double'), pivot at the center of a frame of size"""
+    params = dict(DEFAULT_PARAMETERS[model], **params)
+    pivot = (size[0] // 2, size[1] // 2)
+    if model == 'simple':
+        from pendulum_sim.physics_engine import SimplePendulum
+        return SimplePendulum(params['m'], params['l'], pivot_pos=pivot, theta0=params['theta0'],
+                              radius=int(params['radius']), theta_dot0=params['theta_dot0'],
+                              restitution=params['restitution'], lab=Lab(g=params['g'], width=size[0],
+                                                                          height=size[1]), dt=dt)
+    from pendulum_sim.double_pendulum import DoublePendulum
+    return DoublePendulum(pivot_vect=pivot, length1=params['l1'], length2=params['l2'],
+                          bob_mass1=params['m1'], bob_mass2=params['m2'],
+                          init_angle1=params['theta1_0'], init_angularspeed1=params['theta1_dot0'],
+                          init_angle2=params['theta2_0'], init_angularspeed2=params['theta2_dot0'],
+                          gravity=params['g'], dt=dt)
+
+
+def _bob_state(model, sprite):
+    """Screen positions of the bobs and angles of the sprite"""
+    left, top = sprite.swing_rect.topleft
+    if model == 'simple':
+        return ((left + sprite.m_X, top + sprite.m_Y),), (sprite.theta,)
+    return ((left + sprite.bob1_X, top + sprite.bob1_Y), (left + sprite.bob2_X, top + sprite.bob2_Y)), \
+        tuple(sprite.angle)
+
+
+def clip_path(out_dir, index, extension):
+    return os.path.join(out_dir, 'clip_{:06d}{}'.format(index, extension))
+
+
+def generate_clip(task):
+    """Renders one clip and writes its video and trajectory files, unless they already exist"""
+    index, model, params, out_dir, n_frames, fps, dt, size = task
+    traj_path = clip_path(out_dir, index, '.traj')
+    if os.path.exists(traj_path):
+        return index, False
+    from pendulum_sim.render import frame_stride, render_offline
+
+    sprite = build_sprite(model, params, dt=dt, size=size)
+    n_bobs = 1 if model == 'simple' else 2
+    bobs = np.empty((n_frames, n_bobs, 2))
+    angles = np.empty((n_frames, n_bobs))
+
+    def record(i, sprites):
+        bobs[i], angles[i] = _bob_state(model, sprite)
+
+    stride = frame_stride(dt, fps)
+    video_path = clip_path(out_dir, index, '.avi')
+    # write to temporary files then rename, so that an interrupted clip is generated again
+    tmp_video_path = clip_path(out_dir, index, '.tmp.avi')
+    tmp_traj_path = clip_path(out_dir, index, '.tmp.traj')
+    render_offline([sprite], n_frames, stride=stride, size=size, video_path=tmp_video_path, fps=fps,
+                   on_frame=record)
+    os.rename(tmp_video_path, video_path)
+    arrays = {'angles': angles} if model == 'simple' else {'angles': angles, 'bobs': bobs}
+    save_trajectory(tmp_traj_path, bobs[:, -1], arrays=arrays, fps=fps, units='px',
+                    source_video=os.path.basename(video_path), pivot=(size[0] // 2, size[1] // 2), model=model,
+                    parameters=dict(DEFAULT_PARAMETERS[model], **params), dt=dt, stride=stride)
+    os.rename(tmp_traj_path, traj_path)
+    return index, True
+
+
+def generate_dataset(out_dir, model='simple', grid=None, distributions=None, n_samples=1, n_frames=300, fps=30,
+                     dt=0.01, size=(800, 800), processes=None, seed=0):
+    """Generates the clips of sample_parameters(grid, distributions, n_samples, seed) on a pool of processes.
+
+    The configuration is stored in out_dir/manifest.json, generating again into the same directory resumes the
+    dataset and refuses a different configuration. Returns the number of clips generated by this call.
+    """
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    config = {'model': model, 'grid': grid or {}, 'distributions': distributions or {}, 'n_samples': n_samples,
+              'n_frames': n_frames, 'fps': fps, 'dt': dt, 'size': list(size), 'seed': seed}
+    manifest_path = os.path.join(out_dir, 'manifest.json')
+    parameters = sample_parameters(grid, distributions, n_samples, seed)
+    if os.path.exists(manifest_path):
+        with open(manifest_path) as f:
+            if json.load(f)['config'] != json.loads(json.dumps(config)):
+                raise ValueError("{} holds a dataset with another configuration".format(out_dir))
+    else:
+        with open(manifest_path, 'w') as f:
+            json.dump({'config': config, 'parameters': parameters}, f, indent=1)
+
+    tasks = [(i, model, params, out_dir, n_frames, fps, dt, tuple(size)) for i, params in enumerate(parameters)
+             if not os.path.exists(clip_path(out_dir, i, '.traj'))]
+    print("{} clips, {} to generate".format(len(parameters), len(tasks)))
+    pool = Pool(processes)
+    n_generated = 0
+    try:
+        for index, generated in pool.imap_unordered(generate_clip, tasks):
+            n_generated += generated
+    finally:
+        pool.close()
+        pool.join()
+    return n_generated
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-o", "--out", required=True, help="output directory")
+    ap.add_argument("-c", "--config", help="JSON file with the model, grid and distributions of the parameters")
+    ap.add_argument("-n", "--n-samples", type=int, default=1, help="random draws per grid point")
+    ap.add_argument("--frames", type=int, default=300, help="frames per clip")
+    ap.add_argument("--fps", type=float, default=30, help="frame rate of the clips")
+    ap.add_argument("-p", "--processes", type=int, help="number of rendering processes")
+    ap.add_argument("-s", "--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    config = {}
+    if args.config:
+        with open(args.config) as f:
+            config = json.load(f)
+    n_generated = generate_dataset(args.out, model=config.get('model', 'simple'), grid=config.get('grid'),
+                                   distributions=config.get('distributions'), n_samples=args.n_samples,
+                                   n_frames=args.frames, fps=args.fps, processes=args.processes, seed=args.seed)
+    print("{} clips generated".format(n_generated))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+"""
+desc: Interactive rendering of the pendulum sprites, by full redraws or dirty rectangles, with a frame time readout.
+
+A full redraw blits the whole background and the whole swing surface of every sprite, then updates the whole
+display, each frame. The dirty rectangles mode paints the static parts of the sprites on the background once, puts
+the sprites in partial mode, where they only cover their moving parts, and draws them with a LayeredDirty group:
+each frame, only the rectangles the sprites left or moved to are restored from the background, redrawn and updated
+on the display.
+"""
+from __future__ import division, print_function
+
+import timeit
+from collections import deque
+
+import pygame
+
+from pendulum_sim.instrumentation import stage
+from pendulum_sim.physics_engine import COLOR
+
+_clock = timeit.default_timer
+
+
+class FrameTimeReadout(pygame.sprite.DirtySprite):
+    """Text sprite of the mean and worst time spent per frame, clock waits excluded, over the last frames, and of the
+    frame rate of clock. The text is rendered again every `every` frames."""
+
+    def __init__(self, clock, position=(10, 10), every=30, color=COLOR['green'], size=24):
+        pygame.sprite.DirtySprite.__init__(self)
+        self.clock = clock
+        self.position = position
+        self.every = every
+        self.color = color
+        self.font = pygame.font.Font(None, size)
+        self.frame_times = deque(maxlen=every)
+        self.start = None
+        self._layer = 1
+        self._set_text("frame time: -")
+
+    def _set_text(self, text):
+        self.text = text
+        self.image = self.font.render(text, True, self.color, COLOR['black'])
+        self.rect = self.image.get_rect(topleft=self.position)
+        self.dirty = 1
+
+    def start_frame(self):
+        self.start = _clock()
+
+    def end_frame(self):
+        """Records the time since start_frame, and updates the text every `every` frames"""
+        self.frame_times.append(_clock() - self.start)
+        if len(self.frame_times) == self.every:
+            self._set_text("frame time: {:.2f} ms mean, {:.2f} ms max, {:.0f} fps".format(
+                1e3 * sum(self.frame_times) / self.every, 1e3 * max(self.frame_times), self.clock.get_fps()))
+            self.frame_times.clear()
+
+
+class Renderer(object):
+    """Draws the sprites, and the optional readout, on screen over background, by dirty rectangles or full redraws.
+    draw() returns the rectangles of the screen to update on the display."""
+
+    def __init__(self, screen, background, sprites, dirty=True, readout=None):
+        self.screen = screen
+        self.dirty = dirty
+        sprites = list(sprites) + ([] if readout is None else [readout])
+        if dirty:
+            self.background = background.copy()
+            for sprite in sprites:
+                if hasattr(sprite, 'set_partial'):
+                    sprite.draw_static(self.background)
+                    sprite.set_partial(True)
+            self.group = pygame.sprite.LayeredDirty(sprites)
+            self.group.clear(screen, self.background)
+        else:
+            self.background = background
+            self.group = pygame.sprite.RenderPlain(sprites)
+        screen.blit(self.background, (0, 0))
+
+    def draw(self):
+        with stage('draw'):
+            if self.dirty:
+                return self.group.draw(self.screen)
+            self.screen.blit(self.background, (0, 0))
+            self.group.draw(self.screen)
+            return [self.screen.get_rect()]
@@ -0,0 +1,194 @@
+"""
+desc: Gradient based fitting of the simple pendulum to a trajectory: Gauss-Newton and L-BFGS point estimates and
+      Hamiltonian Monte Carlo sampling. The gradients are exact, given by the forward sensitivities of the RK4
+      simulator (batch.simulate_batch_sensitivities), so that a fit takes tens of simulations where the random walk
+      of inverse_physics_engine takes tens of thousands.
+"""
+from __future__ import division, print_function
+
+import time
+from collections import namedtuple
+
+import numpy as np
+from scipy.optimize import minimize
+
+from pendulum_sim.batch import simulate_batch_sensitivities
+from pendulum_sim.inverse_physics_engine import PARAM_NAMES, MCMCResult, guess_state
+from video_processing.find_center import find_pivot
+
+FitResult = namedtuple('FitResult', ['params', 'cost', 'n_simulations', 'converged'])
+
+
+def simulate_measures_jacobian(params, pivot, n_frames, dt=0.01, g=9.8):
+    """Bob positions (n_candidates, n_frames, 2) of the (l, theta0, theta_dot0) rows of params, as
+    inverse_physics_engine.simulate_measures, and their (n_candidates, n_frames, 2, 3) derivatives"""
+    params = np.atleast_2d(params)
+    l, theta0, theta_dot0 = params.T
+    thetas = np.empty((params.shape[0], n_frames))
+    dthetas = np.zeros((params.shape[0], n_frames, 3))
+    thetas[:, 0] = theta0
+    dthetas[:, 0, 1] = 1
+    thetas[:, 1:], dthetas[:, 1:] = simulate_batch_sensitivities(1, l, theta0, theta_dot0, n_frames - 1, dt=dt, g=g)
+    l = l[:, np.newaxis]
+    sin, cos = np.sin(thetas), np.cos(thetas)
+    positions = np.stack((pivot[0] + l * sin, pivot[1] + l * cos), axis=-1)
+    # chain rule, l also enters the positions directly
+    jacobian = np.stack(((l * cos)[..., np.newaxis] * dthetas, (-l * sin)[..., np.newaxis] * dthetas), axis=-2)
+    jacobian[..., 0, 0] += sin
+    jacobian[..., 1, 0] += cos
+    return positions, jacobian
+
+
+def residuals_jacobian(measures, params, pivot, dt=0.01, g=9.8):
+    """Residuals (n_candidates, 2 n_frames) of the simulated positions against the measures, and their
+    (n_candidates, 2 n_frames, 3) Jacobian"""
+    measures = np.asarray(measures, dtype=float)
+    positions, jacobian = simulate_measures_jacobian(params, pivot, measures.shape[0], dt, g)
+    n = positions.shape[0]
+    return (positions - measures).reshape(n, -1), jacobian.reshape(n, -1, len(PARAM_NAMES))
+
+
+def cost_gradient(measures, params, pivot, dt=0.01, g=9.8):
+    """inverse_physics_engine.cost of each row of params, and its gradient (n_candidates, 3)"""
+    residuals, jacobian = residuals_jacobian(measures, params, pivot, dt, g)
+    cost = np.sqrt(np.sum(residuals ** 2, axis=1))
+    return cost, np.einsum('ni,nij->nj', residuals, jacobian) / cost[:, np.newaxis]
+
+
+def log_likelihood_gradient(measures, params, pivot, sigma=2.0, dt=0.01, g=9.8):
+    """inverse_physics_engine.batch_log_likelihood of each row of params, and its gradient (n_candidates, 3).
+    Proposals with a non positive length get -inf and a zero gradient."""
+    params = np.atleast_2d(params)
+    log_liks = np.full(params.shape[0], -np.inf)
+    gradients = np.zeros(params.shape)
+    valid = params[:, 0] > 0
+    if np.any(valid):
+        residuals, jacobian = residuals_jacobian(measures, params[valid], pivot, dt, g)
+        log_liks[valid] = -0.5 * np.sum(residuals ** 2, axis=1) / sigma ** 2
+        gradients[valid] = -np.einsum('ni,nij->nj', residuals, jacobian) / sigma ** 2
+    return log_liks, gradients
+
+
+def gauss_newton(measures, pivot, start, n_iter=50, tol=1e-10, damping=1e-3, dt=0.01, g=9.8):
+    """Least squares fit of (l, theta0, theta_dot0) from start, by Gauss-Newton steps damped a la
+    Levenberg-Marquardt. Returns a FitResult, whose cost is the one of inverse_physics_engine.cost."""
+    params = np.array(start, dtype=float)
+    residuals, jacobian = residuals_jacobian(measures, params, pivot, dt, g)
+    residuals, jacobian = residuals[0], jacobian[0]
+    sq_cost = residuals.dot(residuals)
+    n_simulations = 1
+    converged = False
+    for _ in range(n_iter):
+        jtj = jacobian.T.dot(jacobian)
+        step = -np.linalg.solve(jtj + damping * np.diag(np.diag(jtj)), jacobian.T.dot(residuals))
+        new_params = params + step
+        if new_params[0] <= 0:
+            damping *= 10
+            continue
+        new_residuals, new_jacobian = residuals_jacobian(measures, new_params, pivot, dt, g)
+        n_simulations += 1
+        new_sq_cost = new_residuals[0].dot(new_residuals[0])
+        if new_sq_cost >= sq_cost:
+            damping *= 10
+            continue
+        decrease = (sq_cost - new_sq_cost) / sq_cost
+        params, residuals, jacobian, sq_cost = new_params, new_residuals[0], new_jacobian[0], new_sq_cost
+        damping /= 10
+        if decrease < tol:
+            converged = True
+            break
+    return FitResult(params, np.sqrt(sq_cost), n_simulations, converged)
+
+
+def fit_lbfgs(measures, pivot, start, tol=1e-10, dt=0.01, g=9.8):
+    """Least squares fit of (l, theta0, theta_dot0) from start with L-BFGS-B, l bounded away from 0.
+    Returns a FitResult, whose cost is the one of inverse_physics_engine.cost."""
+    start = np.asarray(start, dtype=float)
+    # the parameters are scaled by their starting magnitude for the quasi-Newton approximation
+    scale = np.maximum(np.abs(start), 1.0)
+    n_simulations = [0]
+
+    def objective(x):
+        n_simulations[0] += 1
+        residuals, jacobian = residuals_jacobian(measures, x * scale, pivot, dt, g)
+        return 0.5 * residuals[0].dot(residuals[0]), residuals[0].dot(jacobian[0]) * scale
+
+    result = minimize(objective, start / scale, jac=True, method='L-BFGS-B',
+                      bounds=[(1e-6, None), (None, None), (None, None)], options={'ftol': tol, 'gtol': 1e-12})
+    return FitResult(result.x * scale, np.sqrt(2 * result.fun), n_simulations[0], result.success)
+
+
+def hamiltonian_monte_carlo(measures, pivot, start, n_samples=200, n_walkers=8, step_size=0.5, n_leapfrog=4,
+                            sigma=2.0, dt=0.01, g=9.8, mass=None, seed=None):
+    """Runs n_walkers Hamiltonian Monte Carlo chains in lockstep, from start or the rows of an (n_walkers, 3) start.
+
+    mass is the (3, 3) mass matrix of the momenta, by default the Fisher information of the likelihood at the
+    (first) start, which makes the posterior nearly isotropic so that a single step_size fits all the parameters.
+    The gradients of all the walkers are computed in a single simulation at each leapfrog step. Returns an
+    MCMCResult as metropolis_hastings, with samples (n_samples, n_walkers, 3).
+    """
+    rng = np.random.RandomState(seed)
+    measures = np.asarray(measures, dtype=float)
+    current = np.array(np.broadcast_to(start, (n_walkers, len(PARAM_NAMES))) if np.ndim(start) == 1 else start,
+                       dtype=float)
+    n_walkers = current.shape[0]
+    if mass is None:
+        _, jacobian = residuals_jacobian(measures, current[0], pivot, dt, g)
+        mass = jacobian[0].T.dot(jacobian[0]) / sigma ** 2
+        mass += 1e-9 * np.trace(mass) * np.eye(len(PARAM_NAMES))
+    chol = np.linalg.cholesky(mass)
+    inv_mass = np.linalg.inv(mass)
+    current_log_liks, current_grads = log_likelihood_gradient(measures, current, pivot, sigma, dt, g)
+    samples = np.empty((n_samples, n_walkers, len(PARAM_NAMES)))
+    log_liks = np.empty((n_samples, n_walkers))
+    n_accepted = 0
+
+    start_time = time.time()
+    for i in range(n_samples):
+        momenta = rng.standard_normal(current.shape).dot(chol.T)
+        kinetic = 0.5 * np.einsum('ni,ij,nj->n', momenta, inv_mass, momenta)
+        params, log_lik, grad = current.copy(), current_log_liks, current_grads
+        # leapfrog integration of the Hamiltonian dynamics
+        momenta = momenta + step_size / 2 * grad
+        for j in range(n_leapfrog):
+            params = params + step_size * momenta.dot(inv_mass)
+            log_lik, grad = log_likelihood_gradient(measures, params, pivot, sigma, dt, g)
+            momenta = momenta + (step_size if j < n_leapfrog - 1 else step_size / 2) * grad
+        new_kinetic = 0.5 * np.einsum('ni,ij,nj->n', momenta, inv_mass, momenta)
+        with np.errstate(invalid='ignore'):
+            log_ratio = log_lik - new_kinetic - current_log_liks + kinetic
+        # diverged trajectories and invalid lengths are rejected
+        accepted = np.log(rng.uniform(size=n_walkers)) < np.where(np.isnan(log_ratio), -np.inf, log_ratio)
+        current[accepted] = params[accepted]
+        current_log_liks[accepted] = log_lik[accepted]
+        current_grads[accepted] = grad[accepted]
+        n_accepted += np.count_nonzero(accepted)
+        samples[i] = current
+        log_liks[i] = current_log_liks
+    elapsed = time.time() - start_time
+
+    n_proposals = n_samples * n_walkers
+    return MCMCResult(samples, log_liks, n_accepted / n_proposals, n_proposals / max(elapsed, 1e-12))
+
+
+def run_gradient_inference(f='../../data/m_hist.traj', n_samples=200, n_walkers=8, sigma=2.0, dt=0.01, seed=None):
+    """Fits a simple pendulum to the trajectory stored in f by Gauss-Newton from initial_guess, then samples the
+    posterior around the fit with Hamiltonian Monte Carlo"""
+    guessed_len, guessed_pivot, m_pos_hist = find_pivot(f)
+    guess = guess_state(m_pos_hist, guessed_pivot, guessed_len, dt=dt)
+    fit = gauss_newton(m_pos_hist, guessed_pivot, (guess.l, guess.theta, guess.theta_dot), dt=dt, g=guess.lab.g)
+    print("Gauss-Newton : {} simulations, cost {}".format(fit.n_simulations, fit.cost))
+    for name, value in zip(PARAM_NAMES, fit.params):
+        print("{} : {}".format(name, value))
+    result = hamiltonian_monte_carlo(m_pos_hist, guessed_pivot, fit.params, n_samples=n_samples,
+                                     n_walkers=n_walkers, sigma=sigma, dt=dt, g=guess.lab.g, seed=seed)
+    print("Acceptance rate : {:.3f}".format(result.acceptance_rate))
+    print("Samples per second : {:.0f}".format(result.samples_per_sec))
+    burnt = result.samples[n_samples // 2:].reshape(-1, len(PARAM_NAMES))
+    for name, mean, std in zip(PARAM_NAMES, burnt.mean(axis=0), burnt.std(axis=0)):
+        print("{} : {} +/- {}".format(name, mean, std))
+    return fit, result
+
+
+if __name__ == '__main__':
+    run_gradient_inference()
@@ -0,0 +1,201 @@
+"""
+desc: Opt-in instrumentation of the pipeline: named stage timers, counters and histograms.
+
+The tracking, pivot fitting and simulation code is instrumented with stage(), count() and observe() calls, which
+do nothing but check a global when the instrumentation is disabled, the default. enable() starts recording into a
+Recorder, whose report() gives, per stage, the number of calls and the total, mean and quantile durations, the
+counters, and summaries of the observed values. With trace=True the recorder also keeps every stage span, and
+dump_trace writes them in the Chrome trace event format, which chrome://tracing and Perfetto show as a flame graph.
+profiled() runs a block under cProfile and dumps the .prof file that pstats, snakeviz or flameprof read.
+
+USAGE
+with instrumentation.session(report='report.json', trace='trace.json', profile='run.prof'):
+    track_video(path)
+"""
+from __future__ import division, print_function
+
+import cProfile
+import json
+import os
+import threading
+import timeit
+from collections import defaultdict
+from contextlib import contextmanager
+
+import numpy as np
+
+_clock = timeit.default_timer
+
+# Recorder of the enabled instrumentation, None when disabled
+_recorder = None
+
+
+class _NullStage(object):
+    """Context manager of the stages while the instrumentation is disabled"""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_STAGE = _NullStage()
+
+
+class _Stage(object):
+
+    def __init__(self, recorder, name):
+        self.recorder = recorder
+        self.name = name
+
+    def __enter__(self):
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        self.recorder.add_span(self.name, self.start, _clock())
+        return False
+
+
+def _summary(values):
+    values = np.asarray(values, dtype=float)
+    return {'count': int(values.size), 'total': float(values.sum()), 'mean': float(values.mean()),
+            'min': float(values.min()), 'p50': float(np.percentile(values, 50)),
+            'p95': float(np.percentile(values, 95)), 'max': float(values.max())}
+
+
+class Recorder(object):
+    """Stage durations, counters and observed values of a run. Appends to lists are atomic, so that the decoding
+    thread of ball_tracking.read_frames and the main thread can record concurrently."""
+
+    def __init__(self, trace=False):
+        self.durations = defaultdict(list)
+        self.counters = defaultdict(int)
+        self.values = defaultdict(list)
+        self.trace = trace
+        # (name, start, end, thread id) of the stages, when tracing
+        self.spans = []
+        self.start = _clock()
+        self._lock = threading.Lock()
+
+    def add_span(self, name, start, end):
+        self.durations[name].append(end - start)
+        if self.trace:
+            self.spans.append((name, start, end, threading.current_thread().ident))
+
+    def count(self, name, n=1):
+        with self._lock:
+            self.counters[name] += n
+
+    def observe(self, name, value):
+        self.values[name].append(value)
+
+    def report(self):
+        """JSON serializable summary of the run, durations in seconds"""
+        histograms = {}
+        for name, values in sorted(self.values.items()):
+            bins, edges = np.histogram(values, bins=10)
+            histograms[name] = dict(_summary(values), bins=bins.tolist(), edges=edges.tolist())
+        return {'wall_time': _clock() - self.start,
+                'stages': {name: _summary(d) for name, d in sorted(self.durations.items())},
+                'counters': dict(sorted(self.counters.items())), 'histograms': histograms}
+
+    def trace_events(self):
+        """Stage spans as Chrome trace complete events, times in microseconds since the start of the run"""
+        pid = os.getpid()
+        return [{'name': name, 'ph': 'X', 'ts': 1e6 * (start - self.start), 'dur': 1e6 * (end - start),
+                 'pid': pid, 'tid': tid} for name, start, end, tid in self.spans]
+
+
+def enable(trace=False):
+    """Starts recording into a new Recorder, which is returned"""
+    global _recorder
+    _recorder = Recorder(trace)
+    return _recorder
+
+
+def disable():
+    """Stops recording, returns the Recorder of the run or None"""
+    global _recorder
+    recorder, _recorder = _recorder, None
+    return recorder
+
+
+def recorder():
+    return _recorder
+
+
+def stage(name):
+    """Context manager timing the enclosed block as the stage name"""
+    if _recorder is None:
+        return _NULL_STAGE
+    return _Stage(_recorder, name)
+
+
+def timed(name):
+    """Decorator timing each call of the function as the stage name"""
+
+    def decorate(f):
+        def wrapper(*args, **kwargs):
+            if _recorder is None:
+                return f(*args, **kwargs)
+            with _Stage(_recorder, name):
+                return f(*args, **kwargs)
+
+        wrapper.__name__, wrapper.__doc__ = f.__name__, f.__doc__
+        return wrapper
+
+    return decorate
+
+
+def count(name, n=1):
+    if _recorder is not None:
+        _recorder.count(name, n)
+
+
+def observe(name, value):
+    """Adds value to the histogram name"""
+    if _recorder is not None:
+        _recorder.observe(name, value)
+
+
+def dump_report(path, recorder=None):
+    with open(path, 'w') as f:
+        json.dump((recorder or _recorder).report(), f, indent=2)
+
+
+def dump_trace(path, recorder=None):
+    with open(path, 'w') as f:
+        json.dump({'traceEvents': (recorder or _recorder).trace_events(), 'displayTimeUnit': 'ms'}, f)
+
+
+@contextmanager
+def profiled(path):
+    """Runs the block under cProfile, dumping the statistics to path"""
+    profile = cProfile.Profile()
+    profile.enable()
+    try:
+        yield profile
+    finally:
+        profile.disable()
+        profile.dump_stats(path)
+
+
+@contextmanager
+def session(report=None, trace=None, profile=None):
+    """Records the block, then writes the JSON report and the trace to the given paths, optionally under cProfile.
+    Yields the Recorder."""
+    rec = enable(trace=trace is not None)
+    try:
+        if profile is None:
+            yield rec
+        else:
+            with profiled(profile):
+                yield rec
+    finally:
+        disable()
+        if report is not None:
+            dump_report(report, rec)
+        if trace is not None:
+            dump_trace(trace, rec)
@@ -0,0 +1,183 @@
+"""
+desc: Integrators for Hamiltonian systems dq/dt, dp/dt = f(q, p), selectable by name in the pendulum models.
+
+'rk4' is the classical fixed step Runge-Kutta, 'symplectic_euler' and 'verlet' (Stormer-Verlet, that is leapfrog or
+velocity Verlet when the Hamiltonian is separable) are symplectic and do not drift in energy, even with large time
+steps, and 'rk45' is the adaptive Dormand-Prince scheme with error control. The symplectic schemes are implicit for
+non separable Hamiltonians such as the double pendulum one: their implicit stages are solved by Newton iterations
+with finite difference Jacobians, about 18 evaluations of f per Verlet step on the double pendulum, against 4 for
+RK4. With separable=True, for Hamiltonians H(q, p) = T(p) + V(q) such as the simple pendulum one, where dq/dt only
+depends on p and dp/dt only on q, they are explicit: symplectic Euler costs 2 evaluations of f per step, and
+Verlet is the kick-drift-kick leapfrog, 2 evaluations per step when integrate reuses the last kick.
+"""
+from __future__ import division, print_function
+
+import numpy as np
+
+INTEGRATORS = ('rk4', 'symplectic_euler', 'verlet', 'rk45')
+
+# Newton iterations of the implicit stages
+_MAX_ITER = 20
+_TOL = 1e-13
+
+
+def rk4_step(f, q, p, dt):
+    k1, h1 = f(q, p)
+    k2, h2 = f(q + dt / 2.0 * k1, p + dt / 2.0 * h1)
+    k3, h3 = f(q + dt / 2.0 * k2, p + dt / 2.0 * h2)
+    k4, h4 = f(q + dt * k3, p + dt * h3)
+    return q + dt * ((k1 + k4) / 2.0 + k2 + k3) / 3.0, p + dt * ((h1 + h4) / 2.0 + h2 + h3) / 3.0
+
+
+def _fixed_point(g, x):
+    """Solves x = g(x) by Newton iterations with a finite difference Jacobian, starting from g(x).
+
+    When g does not depend on x, as in the implicit stages of separable Hamiltonians, this costs two evaluations.
+    """
+    shape = np.shape(x)
+    G = lambda y: np.ravel(g(y.reshape(shape)))
+    x = np.array(np.ravel(g(x)), dtype=float)
+    for _ in range(_MAX_ITER):
+        gx = G(x)
+        r = gx - x
+        if np.max(np.abs(r)) <= _TOL * (1 + np.max(np.abs(gx))):
+            return gx.reshape(shape)
+        jac = np.empty((x.size, x.size))
+        for j in range(x.size):
+            h = 1e-7 * (1 + abs(x[j]))
+            x_h = x.copy()
+            x_h[j] += h
+            jac[:, j] = (G(x_h) - gx) / h
+        x = x - np.linalg.solve(jac - np.eye(x.size), r)
+    return x.reshape(shape)
+
+
+def symplectic_euler_step(f, q, p, dt, separable=False):
+    """p_{n+1} = p_n + dt dp/dt(q_n, p_{n+1}), then q_{n+1} = q_n + dt dq/dt(q_n, p_{n+1})"""
+    if separable:
+        p_new = p + dt * f(q, p)[1]
+    else:
+        p_new = _fixed_point(lambda p_arg: p + dt * f(q, p_arg)[1], p)
+    return q + dt * f(q, p_new)[0], p_new
+
+
+def verlet_step(f, q, p, dt, separable=False):
+    """Stormer-Verlet: half kick, drift, half kick"""
+    if separable:
+        p_half = p + dt / 2.0 * f(q, p)[1]
+        q_new = q + dt * f(q, p_half)[0]
+    else:
+        p_half = _fixed_point(lambda p_arg: p + dt / 2.0 * f(q, p_arg)[1], p)
+        q_dot = f(q, p_half)[0]
+        q_new = _fixed_point(lambda q_arg: q + dt / 2.0 * (q_dot + f(q_arg, p_half)[0]), q)
+    return q_new, p_half + dt / 2.0 * f(q_new, p_half)[1]
+
+
+def _leapfrog(f, q, p, dt):
+    """Generator of the separable Verlet steps, the closing kick of a step also giving the opening one of the next"""
+    p_dot = f(q, p)[1]
+    while True:
+        p_half = p + dt / 2.0 * p_dot
+        q = q + dt * f(q, p_half)[0]
+        p_dot = f(q, p_half)[1]
+        p = p_half + dt / 2.0 * p_dot
+        yield q, p
+
+
+STEPS = {'rk4': rk4_step, 'symplectic_euler': symplectic_euler_step, 'verlet': verlet_step}
+SYMPLECTIC = ('symplectic_euler', 'verlet')
+
+# Dormand-Prince 5(4) tableau
+_A = ((),
+      (1 / 5,),
+      (3 / 40, 9 / 40),
+      (44 / 45, -56 / 15, 32 / 9),
+      (19372 / 6561, -25360 / 2187, 64448 / 6561, -212 / 729),
+      (9017 / 3168, -355 / 33, 46732 / 5247, 49 / 176, -5103 / 18656))
+_B = (35 / 384, 0, 500 / 1113, 125 / 192, -2187 / 6784, 11 / 84)
+# difference between the 5th and 4th order solutions, the last coefficient applies to the FSAL stage
+_E = (71 / 57600, 0, -71 / 16695, 71 / 1920, -17253 / 339200, 22 / 525, -1 / 40)
+
+
+def _rk45_step(F, y, Fy, dt):
+    """One Dormand-Prince step of the packed system, returns the new state, its derivative and the error"""
+    ks = [Fy]
+    for a in _A[1:]:
+        ks.append(F(y + dt * sum(a_j * k for a_j, k in zip(a, ks))))
+    y_new = y + dt * sum(b * k for b, k in zip(_B, ks))
+    F_new = F(y_new)
+    ks.append(F_new)
+    return y_new, F_new, dt * sum(e * k for e, k in zip(_E, ks))
+
+
+def _hermite(t, t0, y0, f0, t1, y1, f1):
+    """Cubic Hermite interpolation between two steps, third order accurate"""
+    h = t1 - t0
+    s = (t - t0) / h
+    return ((1 + 2 * s) * (1 - s) ** 2 * y0 + s * (1 - s) ** 2 * h * f0 + s * s * (3 - 2 * s) * y1
+            + s * s * (s - 1) * h * f1)
+
+
+def integrate_rk45(f, q, p, dt, rtol=1e-8, atol=1e-10, first_step=None, max_step=np.inf, stats=None):
+    """Generator of (q, p) at times dt, 2 dt, ... The internal steps are chosen by error control, independently of
+    the output interval dt, and the outputs are interpolated between them. If given, the dict stats counts the
+    'accepted' and 'rejected' steps."""
+    shape = np.shape(q)
+    n = int(np.prod(shape))
+
+    def F(y):
+        q_dot, p_dot = f(y[:n].reshape(shape), y[n:].reshape(shape))
+        return np.concatenate((np.ravel(q_dot), np.ravel(p_dot)))
+
+    stats = {} if stats is None else stats
+    stats.setdefault('accepted', 0)
+    stats.setdefault('rejected', 0)
+    y = np.concatenate((np.ravel(q), np.ravel(p))).astype(float)
+    Fy = F(y)
+    t = 0.0
+    h = min(dt if first_step is None else first_step, max_step)
+    n_out = 1
+    while True:
+        y_new, F_new, err = _rk45_step(F, y, Fy, h)
+        scale = atol + rtol * np.maximum(np.abs(y), np.abs(y_new))
+        err_norm = np.sqrt(np.mean((err / scale) ** 2))
+        if err_norm > 1:
+            stats['rejected'] += 1
+            h *= max(0.2, 0.9 * err_norm ** -0.2)
+            continue
+        stats['accepted'] += 1
+        t_new = t + h
+        while n_out * dt <= t_new:
+            y_out = _hermite(n_out * dt, t, y, Fy, t_new, y_new, F_new)
+            n_out += 1
+            yield y_out[:n].reshape(shape)[()], y_out[n:].reshape(shape)[()]
+        t, y, Fy = t_new, y_new, F_new
+        h = min(h * min(5.0, 0.9 * err_norm ** -0.2 if err_norm > 0 else 5.0), max_step)
+
+
+def integrate(f, q, p, dt, method='rk4', separable=False, **options):
+    """Generator of (q, p) at times dt, 2 dt, ... for dq/dt, dp/dt = f(q, p), with the integrator method.
+
+    q and p are scalars or arrays, f returns a (dq/dt, dp/dt) pair of the same shapes. With separable, dq/dt only
+    depends on p and dp/dt only on q, and the symplectic methods are explicit. The options are passed to
+    integrate_rk45 for the adaptive method.
+    """
+    if method == 'rk45':
+        for state in integrate_rk45(f, q, p, dt, **options):
+            yield state
+        return
+    scalar = np.ndim(q) == 0
+    q, p = np.asarray(q, dtype=float), np.asarray(p, dtype=float)
+    if method == 'verlet' and separable:
+        steps = _leapfrog(f, q, p, dt)
+    else:
+        steps = _steps(STEPS[method], f, q, p, dt, separable)
+    for q, p in steps:
+        yield (float(q), float(p)) if scalar else (q, p)
+
+
+def _steps(step, f, q, p, dt, separable):
+    options = {'separable': True} if separable and step is not rk4_step else {}
+    while True:
+        q, p = step(f, q, p, dt, **options)
+        yield q, p
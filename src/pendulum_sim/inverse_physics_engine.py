@@ -1,34 +1,336 @@
 """Using MCMC to find the physics of a video - after object recognition"""
+from __future__ import division, print_function
+
+import time
+from collections import namedtuple
 
 import numpy as np
-from numpy.lib.scimath import arccos
-from scipy.spatial.distance import euclidean
+from scipy.signal import savgol_filter
+from scipy.special import ellipk
 
-from pendulum_sim.physics_engine import SimplePendulum
+from pendulum_sim.batch import simulate_batch, simulate_double_batch
+from pendulum_sim.core import LENGTH_SCALE, SimplePendulumPhysics
+from pendulum_sim.instrumentation import count, stage
+from pendulum_sim.trajectory import load_trajectory
 from video_processing.find_center import find_pivot
 
+# Parameters explored by the sampler, the mass drops out of the dynamics of the simple pendulum
+PARAM_NAMES = ('l', 'theta0', 'theta_dot0')
+# Standard deviation of the random walk proposal, for each parameter
+STEP_SIZE = (0.5, 0.002, 0.01)
+
+# Parameters of the double pendulum, only the ratio of the masses matters to its dynamics
+DOUBLE_PARAM_NAMES = ('m1', 'm2', 'l1', 'l2', 'theta1_0', 'theta2_0', 'theta1_dot0', 'theta2_dot0')
+DOUBLE_STEP_SIZE = (0.01, 0.01, 0.5, 0.5, 0.002, 0.002, 0.01, 0.01)
+# Frames simulated from each observed state by the multiple shooting likelihood
+WINDOW = 10
+
+MCMCResult = namedtuple('MCMCResult', ['samples', 'log_likelihoods', 'acceptance_rate', 'samples_per_sec'])
+StateEstimate = namedtuple('StateEstimate', ['angles', 'rates', 'amplitude', 'period', 'length', 'length_std'])
+
+
+def simulate_angles(params, n_frames, dt=0.01, g=9.8, table=None):
+    """Angles (n_candidates, n_frames) of the pendula given by the (l, theta0, theta_dot0) rows of params,
+    simulated with RK4 or read in a surrogate.PendulumTable"""
+    l, theta0, theta_dot0 = np.atleast_2d(params).T
+    simulate = simulate_batch if table is None else table.simulate
+    thetas = np.empty((l.shape[0], n_frames))
+    thetas[:, 0] = theta0
+    count('simulations', l.shape[0])
+    with stage('simulation'):
+        thetas[:, 1:] = simulate(1, l, theta0, theta_dot0, n_frames - 1, dt=dt, g=g)
+    return thetas
+
+
+def simulate_measures(params, pivot, n_frames, dt=0.01, g=9.8, cache=None, table=None):
+    """Bob positions (n_candidates, n_frames, 2) of the pendula given by the (l, theta0, theta_dot0) rows of params.
+    With a SimulationCache, the angles of parameters already simulated are reused. With a surrogate.PendulumTable,
+    the angles are read in the table instead of simulated."""
+    params = np.atleast_2d(params)
+    if cache is None:
+        thetas = simulate_angles(params, n_frames, dt, g, table)
+    else:
+        thetas = cache.lookup(('simple' if table is None else 'table', float(g)), params, dt, n_frames,
+                              lambda missing: simulate_angles(missing, n_frames, dt, g, table))
+    l = params[:, 0, np.newaxis]
+    return np.stack((pivot[0] + l * np.sin(thetas), pivot[1] + l * np.cos(thetas)), axis=-1)
+
 
 def cost(measures, simulated_measures):
-    return euclidean(measures, simulated_measures)
+    """Euclidean distance between the measured trajectory and each of the simulated ones"""
+    return np.sqrt(np.sum((simulated_measures - measures) ** 2, axis=(-2, -1)))
+
+
+def log_likelihood(measures, simulated_measures, sigma=2.0):
+    """Gaussian log-likelihood, up to a constant, of the measures for a tracking noise of sigma pixels"""
+    return -0.5 * np.sum((simulated_measures - measures) ** 2, axis=(-2, -1)) / sigma ** 2
+
+
+def likelihood(measures, simulated_measures, sigma=2.0):
+    return np.exp(log_likelihood(measures, simulated_measures, sigma))
+
+
+def batch_log_likelihood(measures, params, pivot, sigma=2.0, dt=0.01, g=9.8, cache=None, table=None,
+                         length_prior=None):
+    """Log-likelihoods of a batch of (l, theta0, theta_dot0) proposals, simulated in one vectorized call, or looked
+    up in the SimulationCache cache or the surrogate.PendulumTable table.
+
+    Proposals with a non positive length get -inf, which amounts to a flat prior on l > 0. With a (mean, std)
+    length_prior, e.g. the length and length_std of estimate_state, the log-density of a Gaussian prior on l is
+    added, up to a constant.
+    """
+    params = np.atleast_2d(params)
+    count('likelihood_evaluations', params.shape[0])
+    log_liks = np.full(params.shape[0], -np.inf)
+    valid = params[:, 0] > 0
+    if np.any(valid):
+        simulated_measures = simulate_measures(params[valid], pivot, measures.shape[0], dt=dt, g=g, cache=cache,
+                                              table=table)
+        log_liks[valid] = log_likelihood(measures, simulated_measures, sigma)
+        if length_prior is not None:
+            log_liks[valid] -= 0.5 * ((params[valid, 0] - length_prior[0]) / length_prior[1]) ** 2
+    return log_liks
+
+
+def double_positions(angles, l1, l2, pivot):
+    """Positions (..., 2, 2) of the two bobs for the (..., 2) angles, lengths broadcast against angles[..., 0]"""
+    bob1 = np.stack((pivot[0] + l1 * np.sin(angles[..., 0]), pivot[1] + l1 * np.cos(angles[..., 0])), axis=-1)
+    bob2 = bob1 + np.stack((l2 * np.sin(angles[..., 1]), l2 * np.cos(angles[..., 1])), axis=-1)
+    return np.stack((bob1, bob2), axis=-2)
+
+
+def observed_double_states(measures, pivot, dt=0.01, half_width=2):
+    """Angles and angle speeds (n_frames, 2) read on the (n_frames, 2, 2) measured positions of the two bobs.
+
+    The speeds are the slopes of least squares lines through the 2 * half_width + 1 nearest angles, which
+    averages out the tracking noise that a finite difference would amplify.
+    """
+    measures = np.asarray(measures, dtype=float)
+    rel_pos = np.stack((measures[:, 0] - pivot, measures[:, 1] - measures[:, 0]), axis=1)
+    angles = np.unwrap(np.arctan2(rel_pos[..., 0], rel_pos[..., 1]), axis=0)
+    rates = np.gradient(angles, dt, axis=0)
+    k = np.arange(-half_width, half_width + 1)
+    if angles.shape[0] > 2 * half_width:
+        # correlation with k, the edges keep the finite differences
+        for j in range(angles.shape[1]):
+            rates[half_width:-half_width, j] = np.correlate(angles[:, j], k, 'valid') / (dt * np.sum(k * k))
+    return angles, rates
+
+
+def simulate_double_measures(params, pivot, n_frames, dt=0.01, g=9.8, stride=1):
+    """Bob positions (n_candidates, n_frames, 2, 2) of the double pendula given by the rows of params, ordered as
+    DOUBLE_PARAM_NAMES, with stride steps of dt between two frames"""
+    params = np.atleast_2d(params)
+    m1, m2, l1, l2, theta1_0, theta2_0, theta1_dot0, theta2_dot0 = params.T
+    angles = np.empty((params.shape[0], n_frames, 2))
+    angles[:, 0] = params[:, 4:6]
+    angles[:, 1:] = simulate_double_batch(m1, m2, l1, l2, theta1_0, theta2_0, theta1_dot0, theta2_dot0,
+                                          (n_frames - 1) * stride, dt=dt, g=g)[:, stride - 1::stride]
+    return double_positions(angles, l1[:, np.newaxis], l2[:, np.newaxis], pivot)
+
+
+def double_log_likelihood(measures, params, pivot, sigma=2.0, dt=0.01, g=9.8, window=WINDOW, stride=1):
+    """Multiple shooting log-likelihoods of a batch of double pendulum proposals, rows ordered as DOUBLE_PARAM_NAMES.
 
+    The measures are the (n_frames, 2, 2) positions of the two bobs. The simulation restarts every window frames
+    from the state observed on the measures, so that the divergence of nearby trajectories of the chaotic double
+    pendulum does not flatten the likelihood after a few swings. The first window starts from the proposed initial
+    state. The windows of all the proposals are simulated in one batch. Non positive masses or lengths get -inf.
+    """
+    params = np.atleast_2d(params)
+    count('likelihood_evaluations', params.shape[0])
+    measures = np.asarray(measures, dtype=float)
+    n_frames = measures.shape[0]
+    starts = np.arange(0, n_frames, window)
+    log_liks = np.full(params.shape[0], -np.inf)
+    valid = np.all(params[:, :4] > 0, axis=1)
+    if not np.any(valid):
+        return log_liks
+    m1, m2, l1, l2 = (x[:, np.newaxis] for x in params[valid, :4].T)
+    # initial state of each (proposal, window) segment
+    observed_angles, observed_rates = observed_double_states(measures, pivot, dt * stride)
+    angles0 = np.repeat(observed_angles[np.newaxis, starts], valid.sum(), axis=0)
+    rates0 = np.repeat(observed_rates[np.newaxis, starts], valid.sum(), axis=0)
+    angles0[:, 0] = params[valid, 4:6]
+    rates0[:, 0] = params[valid, 6:8]
+    count('simulations', angles0.shape[0] * angles0.shape[1])
+    with stage('simulation'):
+        segments = simulate_double_batch(m1, m2, l1, l2, angles0[..., 0], angles0[..., 1], rates0[..., 0],
+                                         rates0[..., 1], (window - 1) * stride, dt=dt, g=g)[:, stride - 1::stride]
+    angles = np.concatenate((angles0.reshape(-1, 1, 2), segments), axis=1)
+    angles = angles.reshape(len(m1), -1, 2)[:, :n_frames]
+    simulated_measures = double_positions(angles, l1, l2, pivot)
+    with np.errstate(invalid='ignore', over='ignore'):
+        sq_err = np.sum((simulated_measures - measures) ** 2, axis=(-3, -2, -1))
+    # a proposal whose simulation blew up is rejected
+    log_liks[valid] = np.where(np.isfinite(sq_err), -0.5 * sq_err / sigma ** 2, -np.inf)
+    return log_liks
 
-def likelihood(measures, simulated_measures):
-    return np.exp(-cost(measures, simulated_measures))
 
+# batched log-likelihood and default proposal of each model
+MODELS = {'simple': (PARAM_NAMES, batch_log_likelihood, STEP_SIZE),
+          'double': (DOUBLE_PARAM_NAMES, double_log_likelihood, DOUBLE_STEP_SIZE)}
 
-def initial_guess(f='../../data/m_hist.csv'):
+
+def estimate_state(m_pos_hist, pivot, dt=0.01, g=9.8, window=31):
+    """Angles and angle speeds (n_frames,) read on the measured positions, and the length given by their period.
+
+    The period is read on the peak of the spectrum of the unwrapped arctan2 angles of the positions relative to
+    the pivot, refined by parabolic interpolation, and corrected for the amplitude A (half the range of the angles)
+    with the exact period 4 K(sin(A / 2) ** 2) sqrt(l / g) of the pendulum. The length, in the units of
+    SimplePendulumPhysics.l, has a standard deviation length_std propagated from a twentieth of the frequency
+    resolution of the measures. Period and length are nan on measures shorter than one and a half swings.
+    The angles are smoothed by Savitzky-Golay cubic fits over window frames, at most a quarter of the period, and
+    the speeds are the derivatives of these fits, which average the tracking noise out.
+    """
+    rel_pos_hist = np.asarray(m_pos_hist, dtype=float) - pivot
+    angles = np.unwrap(np.arctan2(rel_pos_hist[:, 0], rel_pos_hist[:, 1]))
+    n = angles.shape[0]
+    amplitude = (angles.max() - angles.min()) / 2
+    period = length = length_std = np.nan
+    # zero padded spectrum of the windowed angles
+    n_fft = 1 << int(np.ceil(np.log2(8 * n)))
+    spectrum = np.abs(np.fft.rfft((angles - angles.mean()) * np.hanning(n), n_fft))
+    peak = np.argmax(spectrum[1:-1]) + 1
+    if n > 2 and spectrum[peak] > 0 and amplitude < np.pi:
+        left, center, right = np.log(spectrum[peak - 1:peak + 2] + 1e-300)
+        frequency = (peak + 0.5 * (left - right) / (left - 2 * center + right)) / (n_fft * dt)
+        if frequency * n * dt >= 1.5:
+            period = 1 / frequency
+            omega = 4 * ellipk(np.sin(amplitude / 2) ** 2) * frequency
+            length = LENGTH_SCALE * g / omega ** 2
+            length_std = 2 * length * 0.05 / (n * dt * frequency)
+            window = min(window, max(5, int(period / (4 * dt))))
+    # odd, and at most the number of frames
+    window = min(window - 1 + window % 2, n - 1 + n % 2)
+    rates = savgol_filter(angles, window, min(3, window - 1), deriv=1, delta=dt)
+    angles = savgol_filter(angles, window, min(3, window - 1))
+    return StateEstimate(angles, rates, amplitude, period, length, length_std)
+
+
+def guess_state(m_pos_hist, pivot, length, dt=0.01):
+    """SimplePendulumPhysics whose state is read on the first measured positions by estimate_state"""
+    state = estimate_state(m_pos_hist, pivot, dt)
+    # the mass drops out of the dynamics
+    return SimplePendulumPhysics(1, length, theta0=state.angles[0], theta_dot0=state.rates[0], dt=dt)
+
+
+def initial_guess(f='../../data/m_hist.traj', dt=0.01):
     # Need more than theta_0 and theta_dot ?
     guessed_len, guessed_pivot, m_pos_hist = find_pivot(f)
-    rel_pos_hist = m_pos_hist - guessed_pivot
-    guessed_theta = arccos(rel_pos_hist[:, 0], rel_pos_hist[:, 1])
-    guessed_theta_dot = guessed_theta[1] - guessed_theta[:-2]
-    guessed_restitution = 1
-    guessed_radius = 50
-    # guessed_radius = 20 ball_tracking.radius TODO: implement this - but no one cares
-    guessed_m = 50 # TODO : smarter guess than this
-    return SimplePendulum(guessed_m, guessed_len, guessed_radius, guessed_pivot, guessed_theta[0], guessed_theta_dot[0],
-                          guessed_restitution)
-
-
-def update_guess():
-    pass
\ No newline at end of file
+    return guess_state(m_pos_hist, guessed_pivot, guessed_len, dt=dt)
+
+
+def guess_double_state(measures, pivot, dt=0.01, m=(1.0, 0.5)):
+    """Double pendulum parameters, ordered as DOUBLE_PARAM_NAMES, read on the measured positions of the two bobs.
+
+    The lengths are the median distances between the pivot and the bobs, the state is read on the first frame.
+    The masses are not observable from the positions alone, only their ratio is, and are set to m.
+    """
+    measures = np.asarray(measures, dtype=float)
+    l1 = np.median(np.hypot(*(measures[:, 0] - pivot).T))
+    l2 = np.median(np.hypot(*(measures[:, 1] - measures[:, 0]).T))
+    angles, rates = observed_double_states(measures, pivot, dt)
+    return np.concatenate((m, (l1, l2), angles[0], rates[0]))
+
+
+def update_guess(params, step_size=STEP_SIZE, rng=np.random):
+    """Gaussian random walk proposal around each row of params"""
+    return params + np.asarray(step_size) * rng.standard_normal(params.shape)
+
+
+def metropolis_hastings(measures, pivot, start, n_samples=1000, n_walkers=32, step_size=None, sigma=2.0,
+                        dt=0.01, g=9.8, temperature=1.0, seed=None, model='simple', **options):
+    """Runs n_walkers independent random walk Metropolis-Hastings chains in lockstep.
+
+    The chains start around the parameter vector start, (l, theta0, theta_dot0) for the 'simple' model and
+    ordered as DOUBLE_PARAM_NAMES for the 'double' one, or exactly at the rows of an (n_walkers, n_params) start.
+    At each iteration the proposals of all the walkers are scored in a single call to the batched log-likelihood
+    of the model, which gets the options. The step size defaults to the one of the model. With a temperature above
+    1 the chains sample the likelihood raised to the power 1 / temperature. Returns an MCMCResult whose samples
+    are (n_samples, n_walkers, n_params) and log_likelihoods, untempered, (n_samples, n_walkers).
+    """
+    param_names, batch_log_likelihood, default_step_size = MODELS[model]
+    step_size = default_step_size if step_size is None else step_size
+    rng = np.random.RandomState(seed)
+    measures = np.asarray(measures, dtype=float)
+    if np.ndim(start) == 2:
+        current = np.array(start, dtype=float)
+        n_walkers = current.shape[0]
+    else:
+        current = np.tile(np.asarray(start, dtype=float), (n_walkers, 1))
+        current[1:] = update_guess(current[1:], step_size, rng)
+    current_log_liks = batch_log_likelihood(measures, current, pivot, sigma, dt, g, **options)
+    samples = np.empty((n_samples, n_walkers, len(param_names)))
+    log_liks = np.empty((n_samples, n_walkers))
+    n_accepted = 0
+
+    start_time = time.time()
+    for i in range(n_samples):
+        proposals = update_guess(current, step_size, rng)
+        proposal_log_liks = batch_log_likelihood(measures, proposals, pivot, sigma, dt, g, **options)
+        # compare in log space, exp of the log-likelihoods would underflow
+        accepted = np.log(rng.uniform(size=n_walkers)) < (proposal_log_liks - current_log_liks) / temperature
+        current[accepted] = proposals[accepted]
+        current_log_liks[accepted] = proposal_log_liks[accepted]
+        n_accepted += np.count_nonzero(accepted)
+        samples[i] = current
+        log_liks[i] = current_log_liks
+    elapsed = time.time() - start_time
+
+    n_proposals = n_samples * n_walkers
+    return MCMCResult(samples, log_liks, n_accepted / n_proposals, n_proposals / max(elapsed, 1e-12))
+
+
+def run_inference(f='../../data/m_hist.traj', n_samples=1000, n_walkers=32, sigma=2.0, dt=0.01, seed=None,
+                  cache=None, table=None, period_prior=False):
+    """Fits a simple pendulum to the trajectory stored in f, seeding the chains with initial_guess.
+
+    Runs sharing a SimulationCache, e.g. spilled to the same directory, reuse each other's simulations. With a
+    surrogate.PendulumTable, the trajectories are read in the table. With period_prior, the length is also given
+    the Gaussian prior of the length read on the period of the trajectory by estimate_state.
+    """
+    guessed_len, guessed_pivot, m_pos_hist = find_pivot(f)
+    guess = guess_state(m_pos_hist, guessed_pivot, guessed_len, dt=dt)
+    start = (guess.l, guess.theta, guess.theta_dot)
+    length_prior = None
+    if period_prior:
+        state = estimate_state(m_pos_hist, guessed_pivot, dt, guess.lab.g)
+        if np.isfinite(state.length):
+            length_prior = (state.length, state.length_std)
+    result = metropolis_hastings(m_pos_hist, guessed_pivot, start, n_samples=n_samples, n_walkers=n_walkers,
+                                 sigma=sigma, dt=dt, g=guess.lab.g, seed=seed, cache=cache, table=table,
+                                 length_prior=length_prior)
+    print("Acceptance rate : {:.3f}".format(result.acceptance_rate))
+    if cache is not None:
+        print("Simulation cache : {}".format(cache.stats()))
+    print("Samples per second : {:.0f}".format(result.samples_per_sec))
+    burnt = result.samples[n_samples // 2:].reshape(-1, len(PARAM_NAMES))
+    for name, mean, std in zip(PARAM_NAMES, burnt.mean(axis=0), burnt.std(axis=0)):
+        print("{} : {} +/- {}".format(name, mean, std))
+    return result
+
+
+def run_double_inference(f, n_samples=1000, n_walkers=32, sigma=2.0, window=WINDOW, seed=None):
+    """Fits a double pendulum to a trajectory file holding the positions of both bobs in its 'bobs' array, as
+    written by dataset.py, seeding the chains with guess_double_state"""
+    trajectory = load_trajectory(f)
+    metadata = trajectory.metadata
+    measures = np.array(trajectory.arrays['bobs'])
+    pivot = np.asarray(metadata['pivot'], dtype=float)
+    dt = metadata.get('dt', 1.0 / metadata['fps'])
+    stride = metadata.get('stride', 1)
+    g = metadata.get('parameters', {}).get('g', 9.8)
+    start = guess_double_state(measures, pivot, dt * stride)
+    result = metropolis_hastings(measures, pivot, start, n_samples=n_samples, n_walkers=n_walkers, sigma=sigma,
+                                 dt=dt, g=g, seed=seed, model='double', window=window, stride=stride)
+    print("Acceptance rate : {:.3f}".format(result.acceptance_rate))
+    print("Samples per second : {:.0f}".format(result.samples_per_sec))
+    burnt = result.samples[n_samples // 2:].reshape(-1, len(DOUBLE_PARAM_NAMES))
+    for name, mean, std in zip(DOUBLE_PARAM_NAMES, burnt.mean(axis=0), burnt.std(axis=0)):
+        print("{} : {} +/- {}".format(name, mean, std))
+    return result
+
+
+if __name__ == '__main__':
+    run_inference()
@@ -0,0 +1,125 @@
+"""
+desc: Compiled kernels of the double pendulum, integrating whole trajectories of batches of initial conditions with
+      the RK4 scheme of core.gen_doublependulum_physics_RK4, step for step.
+
+Three backends share the same code: 'numba' compiles it when Numba is installed, 'python' runs it as is, one
+pendulum after the other, and 'numpy' runs it on arrays, all the pendula of a batch at once. The default is 'numba'
+when available, else 'numpy' for large batches and 'python' for small ones.
+"""
+from __future__ import division, print_function
+
+from math import cos, sin
+
+import numpy as np
+
+try:
+    import numba
+except ImportError:
+    numba = None
+
+BACKENDS = ('numba', 'python', 'numpy')
+
+# batch size from which the numpy backend is faster than the python one
+_NUMPY_MIN_BATCH = 16
+
+
+def _make_kernels(sin, cos, jit):
+    """Kernels of the double pendulum built on the sin and cos functions, compiled with jit"""
+
+    def constants(m1, m2, l1, l2, g, dt):
+        # aggregate some constants, as the reference generator
+        M = m1 + m2
+        L1L2 = l1 * l2
+        L1M = l1 * M
+        return (m1, m2, l1, l2, L1L2, L1M, l2 * m2, g * L1M, g * m2 * l2, l2 * l2 * m2, l1 * l1 * M, L1L2 * m2, dt)
+
+    def momenta(theta1, theta2, theta1_dot, theta2_dot, c):
+        L1L2M2, L2sqrM2, L1sqrM = c[11], c[9], c[10]
+        return (L1sqrM * theta1_dot + L1L2M2 * theta2_dot * cos(theta1 - theta2),
+                L2sqrM2 * theta2_dot + L1L2M2 * theta1_dot * cos(theta1 - theta2))
+
+    def eom(q1, q2, p1, p2, c):
+        m1, m2, l1, l2, L1L2, L1M, L2M2, GL1M, GM2L2, L2sqrM2, L1sqrM, L1L2M2, dt = c
+        # compute common parts
+        delta_q = q1 - q2
+        sin_delq = sin(delta_q)
+        cos_delq = cos(delta_q)
+        A = L1L2 * (m1 + m2 * sin_delq * sin_delq)
+        B = p1 * p2 * sin_delq / A
+        C = (sin(2 * delta_q) * (L2sqrM2 * p1 * p1 + L1sqrM * p2 * p2 - 2 * L1L2M2 * p1 * p2 * cos_delq)
+             / (2 * A * A))
+        # equations of motion
+        q1_dot = (l2 * p1 - l1 * p2 * cos_delq) / (l1 * A)
+        q2_dot = (L1M * p2 - L2M2 * p1 * cos_delq) / (L2M2 * A)
+        p1_dot = -GL1M * sin(q1) - B + C
+        p2_dot = -GM2L2 * sin(q2) + B - C
+        return dt * q1_dot, dt * q2_dot, dt * p1_dot, dt * p2_dot
+
+    constants, momenta, eom = jit(constants), jit(momenta), jit(eom)
+
+    def rk4_step(q1, q2, p1, p2, c):
+        k1_1, k2_1, n1_1, n2_1 = eom(q1, q2, p1, p2, c)
+        k1_2, k2_2, n1_2, n2_2 = eom(q1 + k1_1 / 2.0, q2 + k2_1 / 2.0, p1 + n1_1 / 2.0, p2 + n2_1 / 2.0, c)
+        k1_3, k2_3, n1_3, n2_3 = eom(q1 + k1_2 / 2.0, q2 + k2_2 / 2.0, p1 + n1_2 / 2.0, p2 + n2_2 / 2.0, c)
+        k1_4, k2_4, n1_4, n2_4 = eom(q1 + k1_3, q2 + k2_3, p1 + n1_3, p2 + n2_3, c)
+        return (q1 + ((k1_1 + k1_4) / 2.0 + k1_2 + k1_3) / 3.0,
+                q2 + ((k2_1 + k2_4) / 2.0 + k2_2 + k2_3) / 3.0,
+                p1 + ((n1_1 + n1_4) / 2.0 + n1_2 + n1_3) / 3.0,
+                p2 + ((n2_1 + n2_4) / 2.0 + n2_2 + n2_3) / 3.0)
+
+    rk4_step = jit(rk4_step)
+
+    def trajectories(theta1, theta2, theta1_dot, theta2_dot, m1, m2, l1, l2, g, dt, out):
+        """Fills the (n, n_steps, 2) array out, one pendulum after the other"""
+        for j in range(out.shape[0]):
+            c = constants(m1[j], m2[j], l1[j], l2[j], g, dt)
+            q1, q2 = theta1[j], theta2[j]
+            p1, p2 = momenta(q1, q2, theta1_dot[j], theta2_dot[j], c)
+            for i in range(out.shape[1]):
+                q1, q2, p1, p2 = rk4_step(q1, q2, p1, p2, c)
+                out[j, i, 0] = q1
+                out[j, i, 1] = q2
+
+    def batch_trajectories(theta1, theta2, theta1_dot, theta2_dot, m1, m2, l1, l2, g, dt, out):
+        """Fills the (n, n_steps, 2) array out, one step for all the pendula at once"""
+        c = constants(m1, m2, l1, l2, g, dt)
+        q1, q2 = theta1, theta2
+        p1, p2 = momenta(q1, q2, theta1_dot, theta2_dot, c)
+        for i in range(out.shape[1]):
+            q1, q2, p1, p2 = rk4_step(q1, q2, p1, p2, c)
+            out[:, i, 0] = q1
+            out[:, i, 1] = q2
+
+    return jit(trajectories), batch_trajectories
+
+
+_KERNELS = {'python': _make_kernels(sin, cos, lambda f: f)[0],
+            'numpy': _make_kernels(np.sin, np.cos, lambda f: f)[1]}
+if numba is not None:
+    _KERNELS['numba'] = _make_kernels(sin, cos, numba.njit(error_model='numpy'))[0]
+
+
+def default_backend(n=1):
+    """Fastest available backend for a batch of n pendula"""
+    if 'numba' in _KERNELS:
+        return 'numba'
+    return 'numpy' if n >= _NUMPY_MIN_BATCH else 'python'
+
+
+def doublependulum_trajectories(theta1_0, theta2_0, theta1_dot0, theta2_dot0, m1, m2, l1, l2, g, dt, n_steps,
+                                backend=None):
+    """(n, n_steps, 2) array of the angles after each RK4 step of a batch of double pendula.
+
+    The initial conditions and parameters are scalars or arrays broadcast against each other, in the units of
+    gen_doublependulum_physics_RK4 (lengths in metres), whose successive yields are the rows of each trajectory.
+    """
+    arrays = [x.ravel() for x in np.broadcast_arrays(*(np.asarray(x, dtype=float) for x in
+                                                       (theta1_0, theta2_0, theta1_dot0, theta2_dot0, m1, m2, l1, l2)))]
+    backend = default_backend(arrays[0].shape[0]) if backend is None else backend
+    if backend not in BACKENDS:
+        raise ValueError("Unknown backend {}".format(backend))
+    if backend not in _KERNELS:
+        raise ValueError("The {} backend is not available".format(backend))
+    out = np.empty((arrays[0].shape[0], n_steps, 2))
+    _KERNELS[backend](*(tuple(np.ascontiguousarray(x) for x in arrays) + (float(g), float(dt), out)))
+    return out
@@ -1,10 +1,39 @@
+import argparse
+
 import pygame
 import numpy as np
-from physics_engine import *
+from pendulum_sim.display import FrameTimeReadout, Renderer
+from pendulum_sim.physics_engine import *
+from pendulum_sim.trajectory import save_trajectory
 from pygame.locals import QUIT, KEYDOWN, K_ESCAPE, MOUSEBUTTONDOWN, MOUSEBUTTONUP
 
 
+def save_history(pendulum, f="../../data/m_hist.traj"):
+    # positions are relative to the pendulum surface, so is the pivot
+    save_trajectory(f, pendulum.m_pos_hist, fps=1.0 / pendulum.dt, units='px', source_video=None,
+                    pivot=pendulum.pivot_center)
+
+
+def build_pendulums(n):
+    """One pendulum at the center of the screen, or n smaller ones side by side"""
+    if n == 1:
+        return [SimplePendulum(m=1, l=300, theta0=np.pi / 5, theta_dot0=10, radius=50, restitution=.9,
+                               pivot_pos=SCREEN_CENTER)]
+    swinglength = SCREEN_WIDTH // (2 * n)
+    radius = max(swinglength // 6, 2)
+    return [SimplePendulum(m=1, l=swinglength - radius, theta0=np.pi / 5 + 0.1 * i, theta_dot0=10, radius=radius,
+                           restitution=.9, pivot_pos=((2 * i + 1) * swinglength, SCREEN_CENTER[1]))
+            for i in range(n)]
+
+
 def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--pendulums", type=int, default=1, help="number of pendulums side by side")
+    ap.add_argument("--fps", type=int, default=60, help="target frame rate")
+    ap.add_argument("--full-redraw", action="store_true",
+                    help="redraw the whole screen each frame instead of the changed rectangles")
+    args = ap.parse_args()
+
     pygame.init()
     screen = pygame.display.set_mode(SCREEN_DIM)
     pygame.display.set_caption('Pendulum Simulation')
@@ -16,27 +45,30 @@ def main():
     background.fill(COLOR['black'])
     # Prepare Objects
     clock = pygame.time.Clock()
-    pendulum = SimplePendulum(m=1, l=300, theta0=np.pi / 5, theta_dot0=10, radius=50, restitution=.9, pivot_pos=SCREEN_CENTER)
-    free_group = pygame.sprite.RenderPlain((pendulum,))
+    pendulums = build_pendulums(args.pendulums)
+    pendulum = pendulums[0]
+    free_group = pygame.sprite.RenderPlain(pendulums)
     held_group = pygame.sprite.RenderPlain()
+    readout = FrameTimeReadout(clock)
+    renderer = Renderer(screen, background, pendulums, dirty=not args.full_redraw, readout=readout)
     # Display The Background
-    screen.blit(background, (0, 0))
     pygame.display.flip()
 
     while True:
-        clock.tick(60)
+        clock.tick(args.fps)
+        readout.start_frame()
         # Handle Input Events
         for event in pygame.event.get():
             if event.type == QUIT:
                 pygame.quit()
-                np.savetxt("../../data/m_hist.csv", pendulum.m_pos_hist)
+                save_history(pendulum)
                 return
             elif event.type == KEYDOWN and event.key == K_ESCAPE:
                 pygame.quit()
-                np.savetxt("../../data/m_hist.csv", pendulum.m_pos_hist)
+                save_history(pendulum)
                 return
             elif event.type == MOUSEBUTTONDOWN:
-                print "Mouse Button Down"
+                print("Mouse Button Down")
                 mouse_pos = pygame.mouse.get_pos()
                 for p in free_group:
                     if p.point_on_mass(mouse_pos):     # if user clicked on the mass grab it
@@ -48,8 +80,8 @@ def main():
                         p.grab_pivot(mouse_pos)
                         held_group.add(p)
                         free_group.remove(p)
-            elif event.type is MOUSEBUTTONUP:
-                print "Mouse Button Up"
+            elif event.type == MOUSEBUTTONUP:
+                print("Mouse Button Up")
                 for p in held_group:
                     p.release()
                     free_group.add(p)
@@ -59,11 +91,8 @@ def main():
         mouse_pos = pygame.mouse.get_pos()
         for p in held_group:
             p.update_held(mouse_pos)
-        screen.blit(background, (0, 0))
-        free_group.draw(screen)
-        held_group.draw(screen)
-        # pygame.draw.circle(screen, COLOR['blue'], SCREEN_CENTER, 50, 0)
-        pygame.display.flip()
+        pygame.display.update(renderer.draw())
+        readout.end_frame()
 
 
 if __name__ == '__main__':
@@ -0,0 +1,131 @@
+"""
+desc: Multi-core inference: independent or tempered Metropolis-Hastings chains run in a process pool, with
+      Gelman-Rubin convergence diagnostics
+"""
+from __future__ import division, print_function
+
+import multiprocessing
+import time
+from collections import namedtuple
+
+import numpy as np
+
+from pendulum_sim.inverse_physics_engine import PARAM_NAMES, STEP_SIZE, guess_state, metropolis_hastings
+from video_processing.find_center import find_pivot
+
+MultiChainResult = namedtuple('MultiChainResult', ['samples', 'log_likelihoods', 'r_hat', 'acceptance_rate',
+                                                   'swap_rate', 'samples_per_sec'])
+
+# Set in each worker by _init_worker: read-only view of the observed trajectory in shared memory
+_worker_data = {}
+
+
+def _init_worker(shared_measures, shape, pivot, sigma, dt, g):
+    measures = np.frombuffer(shared_measures).reshape(shape)
+    measures.flags.writeable = False
+    _worker_data.update(measures=measures, pivot=pivot, sigma=sigma, dt=dt, g=g)
+
+
+def _run_chain(task):
+    start, n_walkers, n_samples, step_size, temperature, seed = task
+    return metropolis_hastings(_worker_data['measures'], _worker_data['pivot'], start, n_samples=n_samples,
+                               n_walkers=n_walkers, step_size=step_size, sigma=_worker_data['sigma'],
+                               dt=_worker_data['dt'], g=_worker_data['g'], temperature=temperature, seed=seed)
+
+
+def temperature_ladder(n_chains, t_max=100.0):
+    """Geometric ladder of n_chains temperatures from 1 to t_max"""
+    return np.geomspace(1.0, t_max, n_chains) if n_chains > 1 else np.ones(1)
+
+
+def gelman_rubin(samples):
+    """Split R-hat of each parameter for samples of shape (n_samples, n_chains, n_params)"""
+    n = samples.shape[0] // 2
+    chains = np.concatenate((samples[:n], samples[n:2 * n]), axis=1)
+    within = np.mean(np.var(chains, axis=0, ddof=1), axis=0)
+    between = n * np.var(np.mean(chains, axis=0), axis=0, ddof=1)
+    var_hat = (n - 1) / n * within + between / n
+    return np.sqrt(var_hat / within)
+
+
+def parallel_tempering(measures, pivot, start, n_samples=1000, n_walkers=8, temperatures=None, n_chains=None,
+                       swap_every=100, step_size=STEP_SIZE, sigma=2.0, dt=0.01, g=9.8, processes=None, seed=None):
+    """Runs one chain of n_walkers walkers per temperature on a pool of processes.
+
+    The observed trajectory is copied once into shared memory and every worker reads it from there, so that the
+    tasks only carry the chain states. Chains run swap_every iterations per task, between tasks the states of
+    neighbouring temperatures are swapped with the parallel tempering acceptance rule. With temperatures=None,
+    n_chains independent chains run at temperature 1 (one per core by default).
+    Returns a MultiChainResult holding the samples (n_samples, n_cold_walkers, 3) of the chains at temperature 1,
+    their log-likelihoods and the R-hat of each parameter over the second half of these samples.
+    """
+    measures = np.ascontiguousarray(measures, dtype=float)
+    if temperatures is None:
+        temperatures = np.ones(n_chains or multiprocessing.cpu_count())
+    temperatures = np.asarray(temperatures, dtype=float)
+    rng = np.random.RandomState(seed)
+    states = [start] * len(temperatures)
+    state_log_liks = [None] * len(temperatures)
+    results = [[] for _ in temperatures]
+    n_accepted = n_swaps_accepted = n_swaps = 0
+
+    shared_measures = multiprocessing.RawArray('d', measures.size)
+    np.frombuffer(shared_measures)[:] = measures.ravel()
+    pool = multiprocessing.Pool(processes, initializer=_init_worker,
+                                initargs=(shared_measures, measures.shape, pivot, sigma, dt, g))
+    start_time = time.time()
+    try:
+        done = 0
+        while done < n_samples:
+            n_round = min(swap_every, n_samples - done)
+            tasks = [(state, n_walkers, n_round, step_size, t, rng.randint(2 ** 31))
+                     for state, t in zip(states, temperatures)]
+            for i, result in enumerate(pool.map(_run_chain, tasks)):
+                results[i].append(result)
+                states[i] = result.samples[-1].copy()
+                state_log_liks[i] = result.log_likelihoods[-1].copy()
+                n_accepted += result.acceptance_rate * result.log_likelihoods.size
+            done += n_round
+            # swap the walkers of neighbouring temperatures
+            for i in range(len(temperatures) - 1):
+                if temperatures[i] == temperatures[i + 1]:
+                    continue
+                log_liks_i, log_liks_j = state_log_liks[i], state_log_liks[i + 1]
+                log_ratio = (1 / temperatures[i] - 1 / temperatures[i + 1]) * (log_liks_j - log_liks_i)
+                swap = np.log(rng.uniform(size=log_ratio.shape)) < log_ratio
+                states[i][swap], states[i + 1][swap] = states[i + 1][swap], states[i][swap]
+                log_liks_i[swap], log_liks_j[swap] = log_liks_j[swap], log_liks_i[swap]
+                n_swaps += swap.size
+                n_swaps_accepted += np.count_nonzero(swap)
+    finally:
+        pool.close()
+        pool.join()
+    elapsed = time.time() - start_time
+
+    cold = np.flatnonzero(temperatures == 1)
+    samples = np.concatenate([np.concatenate([r.samples for r in results[i]]) for i in cold], axis=1)
+    log_liks = np.concatenate([np.concatenate([r.log_likelihoods for r in results[i]]) for i in cold], axis=1)
+    n_total = n_samples * sum(res[0].samples.shape[1] for res in results)
+    return MultiChainResult(samples, log_liks, gelman_rubin(samples[n_samples // 2:]), n_accepted / n_total,
+                            n_swaps_accepted / n_swaps if n_swaps else 0.0, n_total / max(elapsed, 1e-12))
+
+
+def run_parallel_inference(f='../../data/m_hist.traj', n_samples=1000, n_walkers=8, temperatures=None, sigma=2.0,
+                           dt=0.01, processes=None, seed=None):
+    """Same as inverse_physics_engine.run_inference, on all the cores"""
+    guessed_len, guessed_pivot, m_pos_hist = find_pivot(f)
+    guess = guess_state(m_pos_hist, guessed_pivot, guessed_len, dt=dt)
+    result = parallel_tempering(m_pos_hist, guessed_pivot, (guess.l, guess.theta, guess.theta_dot),
+                                n_samples=n_samples, n_walkers=n_walkers, temperatures=temperatures, sigma=sigma,
+                                dt=dt, g=guess.lab.g, processes=processes, seed=seed)
+    print("Acceptance rate : {:.3f}".format(result.acceptance_rate))
+    print("Swap rate : {:.3f}".format(result.swap_rate))
+    print("Samples per second : {:.0f}".format(result.samples_per_sec))
+    burnt = result.samples[n_samples // 2:].reshape(-1, len(PARAM_NAMES))
+    for name, mean, std, r_hat in zip(PARAM_NAMES, burnt.mean(axis=0), burnt.std(axis=0), result.r_hat):
+        print("{} : {} +/- {} (R-hat {:.3f})".format(name, mean, std, r_hat))
+    return result
+
+
+if __name__ == '__main__':
+    run_parallel_inference()
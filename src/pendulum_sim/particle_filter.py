@@ -0,0 +1,219 @@
+"""
+desc: Online inference of the simple pendulum by sequential Monte Carlo, on a live camera stream or a video.
+
+A particle filter holds weighted particles of the current state (l, theta, theta_dot) of the pendulum. When a
+tracked center arrives, all the particles are stepped to its frame at once with batch.advance_batch, reweighted
+by the Gaussian likelihood of the center, and, once the weights degenerate, resampled and rejuvenated: the length,
+a static parameter, is jittered with the shrinkage kernel of Liu and West, which keeps the mean and variance of its
+posterior, and the angle and angle speed get a small process noise. The work per frame is fixed by the number of
+particles, which a latency budget adjusts at each resampling, so that the filter keeps up with the stream
+where metropolis_hastings needs the whole recording.
+
+USAGE (from the src directory)
+python -m pendulum_sim.particle_filter --video ball_tracking_example.mp4
+python -m pendulum_sim.particle_filter --pivot 300 40 --latency 0.005
+"""
+from __future__ import division, print_function
+
+import argparse
+import time
+from collections import namedtuple
+
+import cv2
+import numpy as np
+
+from pendulum_sim.batch import advance_batch
+from pendulum_sim.instrumentation import stage
+from video_processing.ball_tracking import BallTracker, read_frames
+from video_processing.find_center import fit_circle
+
+# State of the particles, at the frame of the last update
+STATE_NAMES = ('l', 'theta', 'theta_dot')
+
+Estimate = namedtuple('Estimate', ['mean', 'std', 'ess', 'n_particles', 'latency'])
+
+
+def systematic_resample(weights, n, rng=np.random):
+    """Indices of n particles drawn by systematic resampling of the normalized weights"""
+    positions = (rng.uniform() + np.arange(n)) / n
+    return np.minimum(np.searchsorted(np.cumsum(weights), positions), len(weights) - 1)
+
+
+class ParticleFilter(object):
+    """Particle filter of the simple pendulum, started on the first center seen from pivot.
+
+    The initial particles spread the length around the distance of the center to the pivot (length_std pixels),
+    the angle by the tracking noise sigma, and the unknown angle speed by theta_dot_std. Frames are dt apart,
+    integrated in n_substeps RK4 steps. The particles are resampled when the effective sample size falls below
+    resample_threshold times their number. With max_latency, in seconds, the number of particles drawn at a
+    resampling is scaled by the ratio of max_latency to the duration of the last update, between min_particles
+    and n_particles.
+    """
+
+    def __init__(self, pivot, center, n_particles=2000, sigma=2.0, dt=0.01, g=9.8, n_substeps=1,
+                 length_std=20.0, theta_dot_std=3.0, shrinkage=0.98, state_noise=(1e-3, 1e-2),
+                 resample_threshold=0.5, max_latency=None, min_particles=100, seed=None):
+        self.pivot = np.asarray(pivot, dtype=float)
+        self.sigma = sigma
+        self.dt = dt
+        self.g = g
+        self.n_substeps = n_substeps
+        self.shrinkage = shrinkage
+        self.state_noise = np.asarray(state_noise, dtype=float)
+        self.resample_threshold = resample_threshold
+        self.max_latency = max_latency
+        self.min_particles = min_particles
+        self.max_particles = n_particles
+        self.rng = np.random.RandomState(seed)
+        x, y = np.asarray(center, dtype=float) - self.pivot
+        length = np.hypot(x, y)
+        self.particles = np.stack((length + length_std * self.rng.standard_normal(n_particles),
+                                   np.arctan2(x, y) + sigma / length * self.rng.standard_normal(n_particles),
+                                   theta_dot_std * self.rng.standard_normal(n_particles)), axis=1)
+        self.particles[:, 0] = np.abs(self.particles[:, 0])
+        self.log_weights = np.zeros(n_particles)
+        self.reweight(center)
+        self.latency = 0.0
+        self.n_frames = 1
+
+    @property
+    def n_particles(self):
+        return self.particles.shape[0]
+
+    def weights(self):
+        weights = np.exp(self.log_weights - self.log_weights.max())
+        return weights / weights.sum()
+
+    def ess(self):
+        """Effective sample size of the weighted particles"""
+        weights = self.weights()
+        return 1.0 / np.sum(weights * weights)
+
+    def predict(self):
+        """Steps all the particles to the next frame"""
+        l, theta, theta_dot = self.particles.T
+        with stage('simulation'):
+            theta, theta_dot = advance_batch(1, l, theta, theta_dot, self.n_substeps, self.dt / self.n_substeps,
+                                             self.g)
+        noise = self.state_noise[:, np.newaxis] * self.rng.standard_normal((2, self.n_particles))
+        self.particles[:, 1] = theta + noise[0]
+        self.particles[:, 2] = theta_dot + noise[1]
+
+    def reweight(self, center):
+        l, theta = self.particles[:, 0], self.particles[:, 1]
+        dx = self.pivot[0] + l * np.sin(theta) - center[0]
+        dy = self.pivot[1] + l * np.cos(theta) - center[1]
+        self.log_weights += -0.5 * (dx * dx + dy * dy) / self.sigma ** 2
+        self.log_weights -= self.log_weights.max()
+
+    def resample(self, n=None):
+        """Resamples n particles (as many as now by default), then rejuvenates them"""
+        n = self.n_particles if n is None else n
+        weights = self.weights()
+        mean = weights.dot(self.particles[:, 0])
+        std = np.sqrt(weights.dot((self.particles[:, 0] - mean) ** 2))
+        particles = self.particles[systematic_resample(weights, n, self.rng)]
+        # Liu-West shrinkage of the length towards its mean, with a jitter that keeps its variance
+        a = self.shrinkage
+        particles[:, 0] = np.abs(a * particles[:, 0] + (1 - a) * mean
+                                 + np.sqrt(1 - a * a) * std * self.rng.standard_normal(n))
+        particles[:, 1:] += self.state_noise * self.rng.standard_normal((n, 2))
+        self.particles = particles
+        self.log_weights = np.zeros(n)
+
+    def update(self, center=None):
+        """Advances the filter of one frame, whose tracked center (None if the ball was lost) reweights the
+        particles. Returns the Estimate of the state at this frame."""
+        start = time.time()
+        self.predict()
+        if center is not None:
+            self.reweight(center)
+        self.n_frames += 1
+        estimate = self.estimate()
+        if estimate.ess < self.resample_threshold * estimate.n_particles:
+            n = estimate.n_particles
+            if self.max_latency is not None and self.latency > 0:
+                n = int(np.clip(n * 0.9 * self.max_latency / self.latency, self.min_particles, self.max_particles))
+            with stage('resampling'):
+                self.resample(n)
+        self.latency = time.time() - start
+        return estimate._replace(latency=self.latency)
+
+    def estimate(self):
+        """Weighted mean and standard deviation of the state, ordered as STATE_NAMES"""
+        weights = self.weights()
+        mean = weights.dot(self.particles)
+        std = np.sqrt(weights.dot((self.particles - mean) ** 2))
+        return Estimate(mean, std, 1.0 / np.sum(weights * weights), self.n_particles, self.latency)
+
+
+def online_estimates(centers, pivot=None, warmup=50, **options):
+    """Generator of the Estimate of each frame of the stream of centers (None for the frames without ball).
+
+    Without a pivot, it is fitted on the first warmup centers, then the filter runs over them to catch up with
+    the stream. The filter starts on the first center, the frames before it get None instead of an Estimate, so
+    that there is one item per frame. The options are the ones of ParticleFilter.
+    """
+    buffered = []
+    n_seen = 0
+    particle_filter = None
+    for center in centers:
+        if particle_filter is not None:
+            yield particle_filter.update(center)
+            continue
+        buffered.append(center)
+        n_seen += center is not None
+        if n_seen == 0 or (pivot is None and n_seen < warmup):
+            continue
+        seen = [c for c in buffered if c is not None]
+        if pivot is None:
+            pivot = fit_circle(seen)[:2]
+        first = next(i for i, c in enumerate(buffered) if c is not None)
+        for _ in range(first):
+            yield None
+        particle_filter = ParticleFilter(pivot, seen[0], **options)
+        yield particle_filter.estimate()
+        for center in buffered[first + 1:]:
+            yield particle_filter.update(center)
+    if particle_filter is None:
+        # the stream ended before the filter could start
+        for _ in buffered:
+            yield None
+
+
+def camera_centers(camera, width=600, pivot=None):
+    """Generator of the centers tracked in the frames of camera with a BallTracker, None where the ball is lost"""
+    tracker = BallTracker(width=width, pivot=pivot)
+    for frame in read_frames(camera):
+        yield tracker.track(frame)
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-v", "--video", help="path to the (optional) video file, the webcam by default")
+    ap.add_argument("--pivot", type=float, nargs=2, help="pivot of the pendulum in the frames resized to width")
+    ap.add_argument("-w", "--width", type=int, default=600, help="width the frames are resized to")
+    ap.add_argument("-n", "--particles", type=int, default=2000, help="number of particles")
+    ap.add_argument("--warmup", type=int, default=50, help="centers the pivot is fitted on, without --pivot")
+    ap.add_argument("--fps", type=float, help="frame rate, read on the video by default")
+    ap.add_argument("--latency", type=float, help="budget of the update of each frame, in seconds")
+    ap.add_argument("--every", type=int, default=10, help="print the estimate every this many frames")
+    args = ap.parse_args()
+
+    camera = cv2.VideoCapture(args.video if args.video else 0)
+    fps = args.fps or camera.get(cv2.CAP_PROP_FPS) or 30.0
+    try:
+        estimates = online_estimates(camera_centers(camera, args.width, args.pivot), args.pivot, args.warmup,
+                                     n_particles=args.particles, dt=1.0 / fps, max_latency=args.latency)
+        for i, estimate in enumerate(estimates):
+            if estimate is not None and i % args.every == 0:
+                print("frame {} : ".format(i) + ", ".join("{} {:.3f} +/- {:.3f}".format(name, mean, std) for
+                                                           name, mean, std in zip(STATE_NAMES, estimate.mean,
+                                                                                  estimate.std))
+                      + " ({} particles, {:.1f} ms)".format(estimate.n_particles, 1e3 * estimate.latency))
+    finally:
+        camera.release()
+
+
+if __name__ == '__main__':
+    main()
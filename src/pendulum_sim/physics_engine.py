@@ -17,146 +17,165 @@ import numpy as np
 import pygame
 import pygame.surfarray
 
+from pendulum_sim.core import SCREEN_WIDTH, SCREEN_HEIGHT, SCREEN_DIM, SCREEN_CENTER, Lab, SimplePendulumPhysics
+from pendulum_sim.instrumentation import stage
+from pendulum_sim.trajectory import TrajectoryBuffer
+
 COLOR = {'black': (0, 0, 0),
          'red': (255, 0, 0),
          'green': (0, 255, 0),
          'blue': (0, 0, 255),
          'white': (255, 255, 255)}
 
-SCREEN_WIDTH = 800
-SCREEN_HEIGHT = SCREEN_WIDTH
-SCREEN_DIM = (SCREEN_WIDTH, SCREEN_HEIGHT)
-SCREEN_CENTER = (SCREEN_WIDTH // 2, SCREEN_HEIGHT // 2)
 
+def new_surface(size):
+    """Surface in the display pixel format when there is a display, so that sprites can also be built headless"""
+    surface = pygame.Surface(size)
+    if pygame.display.get_init() and pygame.display.get_surface() is not None:
+        surface = surface.convert()
+    return surface
+
+
+# (radius, color) -> pre-rendered bob image
+_BOB_IMAGES = {}
+
+
+def bob_image(radius, color):
+    """Disc of radius in color on a transparent black colorkey, rendered once per radius and color. Blitted at
+    (x - radius, y - radius), it covers the pixels pygame.draw.circle would at (x, y)."""
+    key = (radius, tuple(color))
+    if key not in _BOB_IMAGES:
+        image = new_surface((2 * radius, 2 * radius))
+        image.fill(COLOR['black'])
+        pygame.draw.circle(image, color, (radius, radius), radius, 0)
+        image.set_colorkey(COLOR['black'])
+        _BOB_IMAGES[key] = image
+    return _BOB_IMAGES[key]
+
+
+def moving_parts(rects, image):
+    """Union of the rects drawn on image, with a pixel margin for the anti-aliasing of the lines, clipped to it"""
+    drawn = rects[0].unionall(rects[1:])
+    return drawn.inflate(2, 2).clip(image.get_rect())
+
+
+def _physics_attribute(name):
+    """Exposes an attribute of the wrapped SimplePendulumPhysics on the sprite"""
+    return property(lambda self: getattr(self.physics, name),
+                    lambda self, value: setattr(self.physics, name, value))
 
-class Lab(object):
-    def __init__(self, g=9.8, width=SCREEN_WIDTH, height=SCREEN_HEIGHT):
-        self.g = g
-        self.width = width
-        self.height = height
 
+class SimplePendulum(pygame.sprite.DirtySprite):
+    """Renders a SimplePendulumPhysics and bounces it on the borders of its surface.
+
+    The image covers the whole swing, at swing_rect on the screen. Each _render only erases and redraws the
+    moving parts (tether, bob and pivot) of the last one. In partial mode the rect, and the source_rect, only
+    cover these parts, for a LayeredDirty group drawn over a background on which draw_static painted the rest.
+    """
+    m = _physics_attribute('m')
+    l = _physics_attribute('l')
+    theta = _physics_attribute('theta')
+    theta_dot = _physics_attribute('theta_dot')
+    lab = _physics_attribute('lab')
+    dt = _physics_attribute('dt')
+    simulator = _physics_attribute('simulator')
+    restitution = _physics_attribute('restitution')
 
-class SimplePendulum(pygame.sprite.Sprite):
     def __init__(self, m, l, pivot_pos=SCREEN_CENTER, theta0=np.pi / 2, radius=50, theta_dot0=0, restitution=1,
                  lab=Lab(),
-                 dt=0.01):
-        pygame.sprite.Sprite.__init__(self)
-        self.lab = lab
+                 dt=0.01, hist_maxlen=None, integrator='rk4'):
+        pygame.sprite.DirtySprite.__init__(self)
+        self.physics = SimplePendulumPhysics(m, l, theta0=theta0, theta_dot0=theta_dot0, lab=lab, dt=dt,
+                                             integrator=integrator, restitution=restitution)
         # Position from top-left of SCREEN to pendulum pivot
         self.pivot_pos = pivot_pos
-        self.m = m
-        self.l = l
         self.radius = radius
-        self.theta = theta0
-        self.theta_dot = theta_dot0
-        self.restitution = restitution
-        self.dt = dt
-        self.simulator = self.simulate()
         swinglength = self.l + self.radius
         # Create image the right size for the tether
-        self.image = pygame.Surface((swinglength * 2, swinglength * 2)).convert()
-        self.rect = self.image.get_rect()
-        self.rect.topleft = (pivot_pos[0] - swinglength, pivot_pos[1] - swinglength)
-        self.pivot_center = (self.rect.width // 2, self.rect.height // 2)
+        self.image = new_surface((swinglength * 2, swinglength * 2))
+        self.swing_rect = self.image.get_rect()
+        self.swing_rect.topleft = (pivot_pos[0] - swinglength, pivot_pos[1] - swinglength)
+        self.rect = self.swing_rect.copy()
+        self.partial = False
+        self.pivot_center = (self.swing_rect.width // 2, self.swing_rect.height // 2)
+        self.physics.walls = self.walls()
+        self.simulator = self.simulate()
         self.m_X = int(self.l * np.sin(theta0) + self.pivot_center[0])
         self.m_Y = int(self.l * np.cos(theta0) + self.pivot_center[1])
         self.m_rect = None
         self.pivot_rect = None
+        # moving parts drawn on the image by the last _render, None to clear the whole image
+        self.drawn_rect = None
 
-        self.m_pos_hist = np.zeros((0, 2))
+        self.m_pos_buffer = TrajectoryBuffer(2, maxlen=hist_maxlen)
         self.pivot_pos_hist = np.array(self.pivot_center)
 
         self._render()
 
+    @property
+    def m_pos_hist(self):
+        """(n, 2) history of the bob positions, a zero-copy view of m_pos_buffer"""
+        return self.m_pos_buffer.view()
+
     def _render(self):
-        # clear background
-        self.image.fill(COLOR['white'])
+        # clear the parts drawn by the last render
+        self.image.fill(COLOR['white'], self.drawn_rect)
         m_pos = (self.m_X, self.m_Y)
         # draw tether
-        pygame.draw.aaline(self.image, COLOR['black'], self.pivot_center, m_pos, True)
+        tether_rect = pygame.draw.aaline(self.image, COLOR['black'], self.pivot_center, m_pos, True)
         # draw the mass
-        # self.m_rect = pygame.draw.circle(self.image, COLOR['blue'], m_pos, self.radius, 0)
-        self.m_rect = pygame.draw.circle(self.image, COLOR['blue'], m_pos, self.radius, 0)
+        self.m_rect = self.image.blit(bob_image(self.radius, COLOR['blue']),
+                                      (self.m_X - self.radius, self.m_Y - self.radius))
         self.pivot_rect = pygame.draw.circle(self.image, COLOR['black'], self.pivot_center, 5, 0)
+        self.drawn_rect = moving_parts((tether_rect, self.m_rect, self.pivot_rect), self.image)
 
-        xm, ym = self.m_rect.topleft
-        xp, yp = self.pivot_rect.topleft
-        x2, y2 = self.rect.topleft
         # make the reference absolute
-        self.m_rect.topleft = (xm + x2, ym + y2)  # make the reference absolute
-        self.pivot_rect.topleft = (xp + x2, yp + y2)
+        self.m_rect.move_ip(self.swing_rect.topleft)
+        self.pivot_rect.move_ip(self.swing_rect.topleft)
+        self._track_drawn()
+
+    def _track_drawn(self):
+        self.dirty = 1
+        if self.partial:
+            self.source_rect = self.drawn_rect
+            self.rect = self.drawn_rect.move(self.swing_rect.topleft)
+
+    def set_partial(self, partial=True):
+        """Whether the sprite only covers its moving parts, to be drawn by a LayeredDirty group"""
+        self.partial = partial
+        self.source_rect = None
+        self.rect = self.swing_rect.copy()
+        self._track_drawn()
+
+    def draw_static(self, surface):
+        """Paints the parts of the sprite that do not move, the box of the swing, on surface"""
+        surface.fill(COLOR['white'], self.swing_rect)
+
+    def walls(self):
+        """Box allowed to the center of the bob, relative to the pivot: the borders of the surface minus the radius"""
+        x, y = self.pivot_center
+        return (self.radius - x, self.radius - y, self.swing_rect.width - x - self.radius,
+                self.swing_rect.height - y - self.radius)
 
     def simulate(self):
         """Returns a generator of next angular position, at current angle and angle speed"""
-        l = self.l / 1000.0
-        dt = self.dt
-        m = self.m
-        # agregate the physical constants
-        a = 1.0 / (m * l * l)
-        b = float(-m * self.lab.g * l)
-        # initialize generalized coordinates
-        q = self.theta
-        p = self.theta_dot / a
-        # this is the physics! ... Hamiltonian style
-        q_dot = lambda p_arg: a * p_arg
-        p_dot = lambda q_arg: b * np.sin(q_arg)
-        # Integrate using Runge-Kutta 4th Order Method
-        while True:
-            k1 = dt * q_dot(p)
-            h1 = dt * p_dot(q)
-            k2 = dt * q_dot(p + h1 / 2.0)
-            h2 = dt * p_dot(q + k1 / 2.0)
-            k3 = dt * q_dot(p + h2 / 2.0)
-            h3 = dt * p_dot(q + k2 / 2.0)
-            k4 = dt * q_dot(p + h3)
-            h4 = dt * p_dot(q + k3)
-            q += ((k1 + k4) / 2.0 + k2 + k3) / 3.0
-            p += ((h1 + h4) / 2.0 + h2 + h3) / 3.0
-            yield (q, q_dot(p))
-
-    def bounce(self, q, q_dot_val):
-        width = self.rect.width
-        height = self.rect.height
-        sg = np.sign(q_dot_val)
-        if self.pivot_center[0] + self.l * np.sin(self.theta) < self.radius:
-            # bounce left
-            self.theta = np.arcsin((self.radius - self.pivot_center[0]) / self.l)
-            if np.abs(q) >= np.pi / 2:
-                self.theta = np.pi - self.theta
-            print(self.theta)
-            self.theta_dot = -self.restitution * q_dot_val
-            self.simulator = self.simulate()
-        elif width - self.pivot_center[0] < self.l * np.sin(self.theta) + self.radius:
-            # bounce right
-            self.theta = np.arcsin((width - self.pivot_center[0] - self.radius) / self.l)
-            if np.abs(q) >= np.pi / 2:
-                self.theta = np.pi - self.theta
-            self.theta_dot = -self.restitution * q_dot_val
-            self.simulator = self.simulate()
-        elif self.pivot_center[1] + self.l * np.cos(self.theta) < self.radius:
-            # bounce up
-            self.theta = - sg * np.arccos((self.radius - self.pivot_center[1]) / self.l)
-            self.theta_dot = -self.restitution * q_dot_val
-            self.simulator = self.simulate()
-        elif height - self.pivot_center[1] < self.l * np.cos(self.theta) + self.radius:
-            # bounce down
-            self.theta = - sg * np.arccos((height - self.pivot_center[1] - self.radius) / self.l)
-            self.theta_dot = -self.restitution * q_dot_val
-            self.simulator = self.simulate()
-        else:
-            self.theta = q
-            self.theta_dot = q_dot_val
+        return self.physics.simulate()
 
-    def update(self):
-        q, q_dot = self.simulator.next()
-        self.bounce(q, q_dot)
+    def step(self):
+        """Advances the physics of one time step and records the position, without rendering"""
+        with stage('simulation'):
+            self.physics.step()
         X = int(self.l * np.sin(self.theta))
         Y = int(self.l * np.cos(self.theta))
 
         self.m_X = X + self.pivot_center[0]
         self.m_Y = Y + self.pivot_center[1]
-        self.m_pos_hist = np.vstack((self.m_pos_hist, (self.m_X, self.m_Y)))
-        self._render()
+        self.m_pos_buffer.append((self.m_X, self.m_Y))
+
+    def update(self):
+        self.step()
+        with stage('render'):
+            self._render()
 
     def update_held(self, mouse_pos):
         mouse_x, mouse_y = mouse_pos
@@ -203,4 +222,6 @@ class SimplePendulum(pygame.sprite.Sprite):
         # except SyntaxError:
         #     self.theta_dot = 0
         self.theta_dot = 0
+        # the pivot or the length may have moved
+        self.physics.walls = self.walls()
         self.simulator = self.simulate()
@@ -0,0 +1,76 @@
+"""
+desc: Offline, fast-forward rendering of the pendulum sprites to frame arrays or video files, used to build
+      synthetic videos. No window, clock nor event loop: frames are produced as fast as the CPU allows.
+"""
+from __future__ import division, print_function
+
+import argparse
+
+import numpy as np
+import pygame
+import pygame.surfarray
+
+from pendulum_sim.physics_engine import COLOR, SCREEN_CENTER, SCREEN_DIM, SimplePendulum
+
+
+def frame_stride(dt, fps):
+    """Number of physics steps between two frames to render at fps a simulation of time step dt: 1 / (dt fps)
+    rounded to the nearest integer, at least 1"""
+    return max(1, int(round(1.0 / (dt * fps))))
+
+
+def render_offline(sprites, n_frames, stride=1, size=SCREEN_DIM, background=COLOR['black'], video_path=None,
+                   fps=30, on_frame=None):
+    """Renders n_frames frames of the sprites, advancing their physics of stride steps between two frames.
+
+    The sprites are only rasterized once per frame, on_frame(i, sprites) is called after rendering frame i.
+    Returns an (n_frames, height, width, 3) RGB uint8 array, or writes the frames to video_path with OpenCV at
+    fps and returns None.
+    """
+    screen = pygame.Surface(size)
+    group = pygame.sprite.RenderPlain(sprites)
+    writer = None
+    frames = None
+    if video_path is None:
+        frames = np.empty((n_frames, size[1], size[0], 3), dtype=np.uint8)
+    else:
+        import cv2
+        writer = cv2.VideoWriter(video_path, cv2.VideoWriter_fourcc(*'MJPG'), fps, size)
+    try:
+        for i in range(n_frames):
+            for sprite in group:
+                for _ in range(stride):
+                    sprite.step()
+                sprite._render()
+            screen.fill(background)
+            group.draw(screen)
+            # surfarray is indexed (x, y)
+            frame = pygame.surfarray.pixels3d(screen).swapaxes(0, 1)
+            if writer is None:
+                frames[i] = frame
+            else:
+                writer.write(np.ascontiguousarray(frame[:, :, ::-1]))
+            del frame
+            if on_frame is not None:
+                on_frame(i, sprites)
+    finally:
+        if writer is not None:
+            writer.release()
+    return frames
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-n", "--frames", type=int, default=300, help="number of frames to render")
+    ap.add_argument("-f", "--fps", type=float, default=30, help="frame rate of the video")
+    ap.add_argument("-o", "--out", default="pendulum.avi", help="path of the video file")
+    args = ap.parse_args()
+
+    pendulum = SimplePendulum(m=1, l=300, theta0=np.pi / 5, theta_dot0=10, radius=50, restitution=.9,
+                              pivot_pos=SCREEN_CENTER)
+    render_offline([pendulum], args.frames, stride=frame_stride(pendulum.dt, args.fps), video_path=args.out,
+                   fps=args.fps)
+
+
+if __name__ == '__main__':
+    main()
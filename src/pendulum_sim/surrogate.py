@@ -0,0 +1,175 @@
+"""
+desc: Precomputed table of simple pendulum trajectories, replacing the RK4 integration by a table lookup.
+
+In the time tau = omega t, omega = sqrt(g / l), the pendulum obeys theta'' = -sin(theta) whatever its length and
+mass, and its swings only depend on their amplitude A: theta(tau) = A s(tau / P(A); A) with s a periodic shape of
+period 1 and P(A) = 4 K(sin(A / 2) ** 2) the period. The table holds the shapes on an (amplitude, phase) grid,
+computed from the exact Jacobi elliptic solution, and a trajectory is read by bilinear interpolation at the
+amplitude and the phases of its frames, the phase of the initial state being computed exactly. Pendula whose
+amplitude is beyond the table (close to or above the top) are simulated with RK4.
+
+USAGE (from the src directory)
+python -m pendulum_sim.surrogate --amplitudes 256 --phases 1024 --out ../data/pendulum_table.npz
+"""
+from __future__ import division, print_function
+
+import argparse
+import time
+
+import numpy as np
+from scipy.special import ellipj, ellipk, ellipkinc
+
+from pendulum_sim.batch import simulate_batch
+from pendulum_sim.core import LENGTH_SCALE
+
+
+class PendulumTable(object):
+    """Shapes (n_amplitudes, n_phases) of the swings of amplitudes evenly spaced from 0 to max_amplitude"""
+
+    def __init__(self, shapes, max_amplitude):
+        self.shapes = np.asarray(shapes, dtype=float)
+        self.max_amplitude = float(max_amplitude)
+        self.n_amplitudes, self.n_phases = self.shapes.shape
+        # flat rows closed by their first phase, and the slopes between consecutive phases, for the lookups
+        closed = np.concatenate((self.shapes, self.shapes[:, :1]), axis=1)
+        self._row_size = closed.shape[1]
+        self._values = closed.ravel()
+        self._slopes = np.diff(closed, axis=1, append=closed[:, 1:2]).ravel()
+
+    @classmethod
+    def build(cls, n_amplitudes=256, n_phases=1024, max_amplitude=0.95 * np.pi):
+        amplitudes = np.linspace(0, max_amplitude, n_amplitudes)
+        phases = np.arange(n_phases) / n_phases
+        m = np.sin(amplitudes / 2) ** 2
+        quarter = ellipk(m)
+        # released at rest from A: sin(theta / 2) = sin(A / 2) sn(K - tau)
+        sn = ellipj(quarter[:, np.newaxis] * (1 - 4 * phases), m[:, np.newaxis])[0]
+        thetas = 2 * np.arcsin(np.sqrt(m)[:, np.newaxis] * sn)
+        shapes = np.empty_like(thetas)
+        shapes[0] = np.cos(2 * np.pi * phases)
+        shapes[1:] = thetas[1:] / amplitudes[1:, np.newaxis]
+        return cls(shapes, max_amplitude)
+
+    def save(self, path):
+        np.savez(path, shapes=self.shapes, max_amplitude=self.max_amplitude)
+
+    @classmethod
+    def load(cls, path):
+        with np.load(path) as data:
+            return cls(data['shapes'], data['max_amplitude'])
+
+    @staticmethod
+    def swing(theta0, theta_dot0, omega):
+        """Amplitude, period (in tau) and initial phase of the swings from the initial states.
+        The amplitude is nan for pendula going over the top."""
+        # libration around the nearest stable equilibrium
+        turns = np.round(theta0 / (2 * np.pi)) * 2 * np.pi
+        theta0 = theta0 - turns
+        u0 = theta_dot0 / omega
+        cos_amplitude = np.cos(theta0) - u0 * u0 / 2
+        with np.errstate(invalid='ignore'):
+            amplitude = np.where(cos_amplitude > -1, np.arccos(np.clip(cos_amplitude, -1, 1)), np.nan)
+        m = np.sin(amplitude / 2) ** 2
+        quarter = ellipk(m)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            x = np.clip(np.sin(theta0 / 2) / np.sqrt(m), -1, 1)
+        incomplete = np.where(m > 0, ellipkinc(np.arcsin(x), m), 0)
+        # theta decreases on the first half period, after the release at A
+        tau0 = np.where(u0 <= 0, quarter - incomplete, 3 * quarter + incomplete)
+        return amplitude, 4 * quarter, tau0 / (4 * quarter), turns
+
+    def covers(self, l, theta0, theta_dot0, g=9.8):
+        """Whether the swings of the pendula are within the amplitudes of the table"""
+        amplitude = self.swing(theta0, theta_dot0, np.sqrt(g * LENGTH_SCALE / np.asarray(l, dtype=float)))[0]
+        return amplitude <= self.max_amplitude
+
+    def angles(self, l, theta0, theta_dot0, n_steps, dt=0.01, g=9.8):
+        """(n_candidates, n_steps) angles after each time step, as simulate_batch, of pendula within the table"""
+        l, theta0, theta_dot0 = np.broadcast_arrays(*(np.asarray(x, dtype=float).ravel()
+                                                      for x in (l, theta0, theta_dot0)))
+        omega = np.sqrt(g * LENGTH_SCALE / l)
+        amplitude, period, phase0, turns = self.swing(theta0, theta_dot0, omega)
+        a = amplitude / self.max_amplitude * (self.n_amplitudes - 1)
+        i = np.minimum(a.astype(int), self.n_amplitudes - 2)
+        wa = (a - i)[:, np.newaxis]
+        # bilinear interpolation, periodic in the phase, in place as the arrays are as large as the trajectories
+        p = np.outer(omega / period * self.n_phases * dt, np.arange(1, n_steps + 1))
+        p += (phase0 * self.n_phases)[:, np.newaxis]
+        j = p.astype(np.intp)
+        p -= j
+        j %= self.n_phases
+        j += (i * self._row_size)[:, np.newaxis]
+        lower = self._values.take(j)
+        lower += p * self._slopes.take(j)
+        j += self._row_size
+        upper = self._values.take(j)
+        upper += p * self._slopes.take(j)
+        upper -= lower
+        upper *= wa
+        lower += upper
+        lower *= amplitude[:, np.newaxis]
+        lower += turns[:, np.newaxis]
+        return lower
+
+    def simulate(self, m, l, theta0, theta_dot0, n_steps, dt=0.01, g=9.8):
+        """simulate_batch reading the angles in the table, the pendula beyond the table are simulated with RK4"""
+        m, l, theta0, theta_dot0 = np.broadcast_arrays(*(np.asarray(x, dtype=float).ravel()
+                                                         for x in (m, l, theta0, theta_dot0)))
+        covered = self.covers(l, theta0, theta_dot0, g)
+        if np.all(covered):
+            return self.angles(l, theta0, theta_dot0, n_steps, dt, g)
+        thetas = np.empty((l.shape[0], n_steps))
+        thetas[covered] = self.angles(l[covered], theta0[covered], theta_dot0[covered], n_steps, dt, g)
+        thetas[~covered] = simulate_batch(m[~covered], l[~covered], theta0[~covered], theta_dot0[~covered], n_steps,
+                                          dt, g)
+        return thetas
+
+
+def accuracy(table, n_candidates=1000, n_steps=500, dt=0.01, g=9.8, seed=0):
+    """Compares the table to simulate_batch on random pendula within the table, returns the max and rms angle
+    differences, the max position difference in pixels and the speedup"""
+    rng = np.random.RandomState(seed)
+    l = rng.uniform(100, 400, n_candidates)
+    theta0 = rng.uniform(-table.max_amplitude, table.max_amplitude, n_candidates) * 0.8
+    theta_dot0 = rng.uniform(-2, 2, n_candidates)
+    covered = table.covers(l, theta0, theta_dot0, g)
+    l, theta0, theta_dot0 = l[covered], theta0[covered], theta_dot0[covered]
+
+    start = time.time()
+    reference = simulate_batch(1, l, theta0, theta_dot0, n_steps, dt, g)
+    simulation_time = time.time() - start
+    start = time.time()
+    thetas = table.angles(l, theta0, theta_dot0, n_steps, dt, g)
+    table_time = time.time() - start
+
+    errors = thetas - reference
+    position_errors = l[:, np.newaxis] * 2 * np.abs(np.sin(errors / 2))
+    return {'n_candidates': len(l), 'max_error': np.abs(errors).max(), 'rms_error': np.sqrt(np.mean(errors ** 2)),
+            'max_position_error': position_errors.max(), 'speedup': simulation_time / table_time}
+
+
+def main():
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-a", "--amplitudes", type=int, default=256, help="number of amplitudes of the table")
+    ap.add_argument("-p", "--phases", type=int, default=1024, help="number of phases per swing")
+    ap.add_argument("-m", "--max-amplitude", type=float, default=0.95 * np.pi,
+                    help="largest amplitude of the table, in radians")
+    ap.add_argument("-o", "--out", help="path of the .npz table")
+    ap.add_argument("--steps", type=int, default=500, help="time steps of the accuracy check")
+    args = ap.parse_args()
+
+    start = time.time()
+    table = PendulumTable.build(args.amplitudes, args.phases, args.max_amplitude)
+    print("Table of {} amplitudes x {} phases built in {:.2f}s".format(args.amplitudes, args.phases,
+                                                                       time.time() - start))
+    report = accuracy(table, n_steps=args.steps)
+    print("Against RK4 on {} pendula, {} steps:".format(report['n_candidates'], args.steps))
+    print("Max angle error : {:.3g} rad, rms : {:.3g} rad".format(report['max_error'], report['rms_error']))
+    print("Max position error : {:.3g} px".format(report['max_position_error']))
+    print("Speedup : {:.1f}x".format(report['speedup']))
+    if args.out:
+        table.save(args.out)
+
+
+if __name__ == '__main__':
+    main()
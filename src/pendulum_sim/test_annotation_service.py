@@ -0,0 +1,61 @@
+import os
+import signal
+import threading
+
+import numpy as np
+
+from pendulum_sim.annotation_service import AnnotationService, make_server, submit
+from video_processing.synthetic import write_pendulum_video
+
+
+def test_service_annotates_videos_over_http(tmpdir):
+    video = str(tmpdir.join('pendulum.avi'))
+    write_pendulum_video(video, n_frames=90)
+    store = str(tmpdir.join('store'))
+    service = AnnotationService(store, processes=1)
+    server = make_server(service, port=0)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    url = 'http://127.0.0.1:{}'.format(server.server_port)
+    try:
+        options = {'width': 640, 'n_samples': 40, 'n_walkers': 4}
+        events = list(submit(url, video, options))
+        names = [event['event'] for event in events]
+        assert names[:3] == ['tracking', 'tracked', 'pivot'] and names[-1] == 'done'
+        assert names.count('sampling') == 10 and events[-2]['done'] == 40
+        result = events[-1]['result']
+        # the ball swings 300 pixels below the middle of the top of the frames
+        np.testing.assert_allclose(result['pivot'], (320, 100), atol=5)
+        assert result['n_centers'] == 90
+        assert np.load(os.path.join(store, events[0]['job'], 'samples.npy')).shape == (40, 4, 3)
+        # the same video and options are answered from the store, by a new service too
+        service.close()
+        service = server.service = AnnotationService(store, processes=1)
+        again = list(submit(url, video, options))
+        assert [event['event'] for event in again] == ['done'] and again[0]['stored']
+        assert service.status(again[0]['job'])['result'] == result
+        failed = list(submit(url, str(tmpdir.join('store', events[0]['job'], 'job.json')), options))
+        assert failed[-1]['event'] == 'failed'
+    finally:
+        server.shutdown()
+        server.server_close()
+        service.close()
+
+
+def test_job_fails_when_its_worker_dies(tmpdir):
+    video = str(tmpdir.join('pendulum.avi'))
+    write_pendulum_video(video, n_frames=90)
+    service = AnnotationService(str(tmpdir.join('store')), processes=1)
+    try:
+        # long enough to be killed while sampling
+        options = {'width': 640, 'n_samples': 100000, 'n_walkers': 4}
+        job = service.submit(video, options)['id']
+        for event in service.events(job, timeout=30):
+            if event['event'] == 'tracked':
+                os.kill(service.jobs[job]['pid'], signal.SIGKILL)
+        status = service.wait(job, timeout=30)
+        assert status['state'] == 'failed' and 'died' in status['last_event']['error']
+        # the pool replaced the worker, and the failed job can be submitted again
+        assert service.wait(service.submit(video, dict(options, n_samples=40))['id'], timeout=30)['state'] == 'done'
+    finally:
+        service.close()
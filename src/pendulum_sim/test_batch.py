@@ -0,0 +1,25 @@
+import numpy as np
+
+from pendulum_sim.batch import simulate_batch, simulate_batch_sensitivities, simulate_loop
+
+
+def test_simulate_batch_matches_generator():
+    m = np.array([1, 50, 0.5])
+    l = np.array([300, 120, 250])
+    theta0 = np.array([np.pi / 5, -1, 3])
+    theta_dot0 = np.array([10, 0, -2])
+    thetas = simulate_batch(m, l, theta0, theta_dot0, 200)
+    assert thetas.shape == (3, 200)
+    np.testing.assert_allclose(thetas, simulate_loop(m, l, theta0, theta_dot0, 200), rtol=0, atol=1e-12)
+
+
+def test_sensitivities_match_finite_differences():
+    params = np.array([[300, 0.6, 1.0], [250, 1.2, -2.0]])
+    thetas, dthetas = simulate_batch_sensitivities(1, *params.T, n_steps=300)
+    np.testing.assert_array_equal(thetas, simulate_batch(1, *params.T, n_steps=300))
+    for j, h in enumerate((1e-4, 1e-7, 1e-7)):
+        step = np.zeros(3)
+        step[j] = h
+        finite_difference = (simulate_batch(1, *(params + step).T, n_steps=300)
+                             - simulate_batch(1, *(params - step).T, n_steps=300)) / (2 * h)
+        np.testing.assert_allclose(dthetas[..., j], finite_difference, rtol=0, atol=1e-6)
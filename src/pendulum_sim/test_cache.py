@@ -0,0 +1,40 @@
+import numpy as np
+
+from pendulum_sim.cache import SimulationCache
+from pendulum_sim.inverse_physics_engine import metropolis_hastings, simulate_measures
+
+
+def test_cache_serves_repeated_runs(tmpdir):
+    pivot = (400, 400)
+    measures = simulate_measures((300, 0.6, 1.0), pivot, 100)[0]
+    cache = SimulationCache(maxsize=100, spill_dir=str(tmpdir))
+    run = lambda cache: metropolis_hastings(measures, pivot, (301, 0.6, 1.0), n_samples=50, n_walkers=8, seed=0,
+                                            cache=cache)
+    reference = run(None)
+    first = run(cache)
+    assert cache.misses > 0 and cache.evictions > 0
+    np.testing.assert_allclose(first.samples, reference.samples)
+    cache.flush()
+    # a new cache on the same directory reads the spilled simulations
+    later = SimulationCache(maxsize=100, spill_dir=str(tmpdir))
+    second = run(later)
+    assert later.misses == 0 and later.stats()['hit_rate'] == 1
+    np.testing.assert_array_equal(second.samples, first.samples)
+
+
+def test_lru_eviction_and_quantization():
+    cache = SimulationCache(maxsize=2, resolution=0.1)
+    calls = []
+
+    def simulate(params):
+        calls.append(len(params))
+        return params * 2
+
+    np.testing.assert_allclose(cache.lookup('m', [[1.0], [1.04], [2.0]], 0.01, 10, simulate), [[2], [2], [4]])
+    assert calls == [2] and cache.hits == 0 and cache.misses == 3
+    cache.lookup('m', [[1.0]], 0.01, 10, simulate)
+    cache.lookup('m', [[3.0]], 0.01, 10, simulate)
+    # 2.0 was the least recently used
+    assert cache.evictions == 1 and cache.hits == 1
+    cache.lookup('m', [[2.0]], 0.01, 10, simulate)
+    assert calls == [2, 1, 1]
@@ -0,0 +1,54 @@
+import numpy as np
+
+from pendulum_sim.core import DoublePendulumPhysics, SimplePendulumPhysics, gen_doublependulum_physics_RK4
+
+
+def test_wall_impacts_mirror_the_free_swing():
+    # a wall through the pivot reflects the swing: the bouncing angle is minus the absolute free angle
+    free = SimplePendulumPhysics(m=1, l=300, theta0=-0.5, dt=0.01).trajectory(500)
+    bouncing = SimplePendulumPhysics(m=1, l=300, theta0=-0.5, dt=0.01, walls=(-400, -400, 0, 400))
+    assert bouncing.can_collide()
+    np.testing.assert_allclose(bouncing.trajectory(500), -np.abs(free), atol=1e-6)
+
+
+def test_walls_out_of_reach_are_skipped():
+    physics = SimplePendulumPhysics(m=1, l=300, theta0=0.5, theta_dot0=1, dt=0.01, walls=(-400, -400, 400, 400))
+    assert not physics.can_collide()
+    free = SimplePendulumPhysics(m=1, l=300, theta0=0.5, theta_dot0=1, dt=0.01)
+    np.testing.assert_allclose(physics.trajectory(300), free.trajectory(300), atol=1e-12)
+
+
+def test_restitution_scales_the_rebound_speed():
+    physics = SimplePendulumPhysics(m=1, l=300, theta0=-0.5, dt=0.01, walls=(-400, -400, 0, 400), restitution=0.5)
+    speeds = np.array([physics.step()[1] for _ in range(200)])
+    impact = np.argmax(speeds < 0)
+    assert 0 < impact < 200
+    # the rebound amplitude is smaller than the initial one
+    assert np.min([physics.step()[0] for _ in range(200)]) > -0.5 * 0.6
+
+
+def test_double_pendulum_conserves_energy():
+    m1, m2, l1, l2, g, dt = 1.0, 0.5, 0.2, 0.1, 9.8, 1e-4
+    simulator = gen_doublependulum_physics_RK4(dt, 2.0, 2.5, 0, 0, m1, m2, l1, l2, g)
+    angles = np.array([next(simulator) for _ in range(5000)])
+    rates = np.gradient(angles, dt, axis=0)[1:-1]
+    angles = angles[1:-1]
+    energy = (0.5 * (m1 + m2) * l1 ** 2 * rates[:, 0] ** 2 + 0.5 * m2 * l2 ** 2 * rates[:, 1] ** 2
+              + m2 * l1 * l2 * rates[:, 0] * rates[:, 1] * np.cos(angles[:, 0] - angles[:, 1])
+              - (m1 + m2) * g * l1 * np.cos(angles[:, 0]) - m2 * g * l2 * np.cos(angles[:, 1]))
+    np.testing.assert_allclose(energy, energy[0], rtol=1e-4)
+
+
+def test_trajectories_start_from_the_current_state():
+    simple = SimplePendulumPhysics(m=1, l=300, theta0=1.0, dt=0.01)
+    doubles = [DoublePendulumPhysics(theta1_0=2.0, theta2_0=2.5, integrator=integrator)
+               for integrator in ('rk4', 'verlet')]
+    for _ in range(100):
+        simple.step()
+        for physics in doubles:
+            physics.step()
+    expected = simple.trajectory(50)
+    np.testing.assert_allclose(expected, [simple.step()[0] for _ in range(50)], atol=1e-12)
+    for physics in doubles:
+        expected = physics.trajectory(50)
+        np.testing.assert_allclose(expected, [physics.step() for _ in range(50)], atol=1e-9)
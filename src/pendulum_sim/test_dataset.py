@@ -0,0 +1,32 @@
+import os
+
+import pytest
+
+from pendulum_sim.dataset import clip_path, generate_dataset, sample_parameters
+
+
+def test_parameters_are_reproducible_and_positive():
+    distributions = {'l': ['normal', 10, 20], 'theta0': ['uniform', -1, 1]}
+    parameters = sample_parameters({'m': [1, 2]}, distributions, n_samples=50, seed=3)
+    assert parameters == sample_parameters({'m': [1, 2]}, distributions, n_samples=50, seed=3)
+    assert parameters != sample_parameters({'m': [1, 2]}, distributions, n_samples=50, seed=4)
+    # the i-th draws do not depend on the number of samples
+    assert parameters[:10] == sample_parameters({'m': [1]}, distributions, n_samples=10, seed=3)
+    assert min(params['l'] for params in parameters) > 0
+    with pytest.raises(ValueError):
+        sample_parameters(distributions={'l': ['uniform', -2, -1]})
+    with pytest.raises(ValueError):
+        sample_parameters({'l': [0, 100]})
+
+
+def test_dataset_generation_resumes(tmpdir):
+    out_dir = str(tmpdir)
+    options = dict(grid={'l': [50, 60]}, distributions={'theta0': ['uniform', -1, 1]}, n_frames=3,
+                   size=(200, 200), processes=1)
+    assert generate_dataset(out_dir, **options) == 2
+    assert os.path.exists(clip_path(out_dir, 1, '.avi'))
+    assert generate_dataset(out_dir, **options) == 0
+    os.remove(clip_path(out_dir, 1, '.traj'))
+    assert generate_dataset(out_dir, **options) == 1
+    with pytest.raises(ValueError):
+        generate_dataset(out_dir, **dict(options, n_frames=4))
@@ -0,0 +1,46 @@
+import numpy as np
+import pygame
+
+from pendulum_sim.display import FrameTimeReadout, Renderer
+from pendulum_sim.double_pendulum import DoublePendulum
+from pendulum_sim.physics_engine import COLOR, SimplePendulum
+
+
+def _pendula(model):
+    if model == 'simple':
+        return [SimplePendulum(1, 150, pivot_pos=(200 + 400 * i, 400), theta0=0.5 + i, radius=20, theta_dot0=5,
+                               restitution=.9) for i in range(2)]
+    return [DoublePendulum(pivot_vect=(200 + 400 * i, 400), length1=100, length2=50, init_angle1=3.0,
+                           init_angle2=3.0 + 0.1 * i) for i in range(2)]
+
+
+def test_dirty_rects_render_the_full_redraws():
+    pygame.font.init()
+    background = pygame.Surface((800, 800))
+    background.fill(COLOR['black'])
+    for model in ('simple', 'double'):
+        screens = [pygame.Surface((800, 800)), pygame.Surface((800, 800))]
+        readout = FrameTimeReadout(pygame.time.Clock(), every=5)
+        full = Renderer(screens[0], background, _pendula(model), dirty=False)
+        dirty = Renderer(screens[1], background, _pendula(model), readout=readout)
+        for i in range(40):
+            readout.start_frame()
+            for renderer in (full, dirty):
+                for sprite in renderer.group:
+                    if sprite is not readout:
+                        sprite.update()
+            full.draw()
+            rects = dirty.draw()
+            # the readout, top left, differs
+            frames = [pygame.surfarray.array3d(screen)[:, 100:] for screen in screens]
+            np.testing.assert_array_equal(frames[0], frames[1])
+            # the first draw of a LayeredDirty group updates the whole screen
+            assert i == 0 or sum(rect.width * rect.height for rect in rects) < 0.25 * 800 * 800
+            readout.end_frame()
+        assert readout.text.endswith(' fps') and 'ms mean' in readout.text
+        # the renders only erase what they drew, an image cleared and drawn again is the same
+        sprite = dirty.group.get_sprite(0)
+        image = pygame.surfarray.array3d(sprite.image)
+        sprite.drawn_rect = None
+        sprite._render()
+        np.testing.assert_array_equal(image, pygame.surfarray.array3d(sprite.image))
@@ -0,0 +1,29 @@
+import numpy as np
+
+from pendulum_sim.gradient_fitting import fit_lbfgs, gauss_newton, hamiltonian_monte_carlo
+from pendulum_sim.inverse_physics_engine import guess_state, simulate_measures
+
+
+def make_measures():
+    pivot = (400, 400)
+    rng = np.random.RandomState(0)
+    measures = simulate_measures((300, 0.6, 1.0), pivot, 200)[0] + rng.normal(0, 2, (200, 2))
+    guess = guess_state(measures, pivot, 305)
+    return measures, pivot, (guess.l, guess.theta, guess.theta_dot)
+
+
+def test_point_estimates_converge_in_few_simulations():
+    measures, pivot, start = make_measures()
+    for fit in (gauss_newton(measures, pivot, start), fit_lbfgs(measures, pivot, start)):
+        assert fit.converged
+        assert fit.n_simulations < 50
+        np.testing.assert_allclose(fit.params, (300, 0.6, 1.0), rtol=0.01)
+
+
+def test_hamiltonian_monte_carlo_samples_around_the_fit():
+    measures, pivot, start = make_measures()
+    fit = gauss_newton(measures, pivot, start)
+    result = hamiltonian_monte_carlo(measures, pivot, fit.params, n_samples=50, n_walkers=4, seed=0)
+    assert result.samples.shape == (50, 4, 3)
+    assert result.acceptance_rate > 0.5
+    np.testing.assert_allclose(result.samples[10:].mean(axis=(0, 1)), (300, 0.6, 1.0), rtol=0.01)
@@ -0,0 +1,37 @@
+import json
+import pstats
+
+import numpy as np
+
+from pendulum_sim import instrumentation
+from pendulum_sim.inverse_physics_engine import batch_log_likelihood, simulate_measures
+from pendulum_sim.trajectory import save_trajectory
+from video_processing.find_center import find_pivot
+
+
+def test_session_reports_stages(tmpdir):
+    pivot = (400, 400)
+    measures = simulate_measures((300, 0.6, 1.0), pivot, 100)[0]
+    path = str(tmpdir.join('centers.traj'))
+    save_trajectory(path, measures)
+    # nothing is recorded while disabled
+    batch_log_likelihood(measures, [(300, 0.6, 1.0)], pivot)
+    assert instrumentation.recorder() is None
+
+    paths = {name: str(tmpdir.join(name)) for name in ('report', 'trace', 'profile')}
+    with instrumentation.session(**paths):
+        find_pivot(path)
+        for _ in range(3):
+            batch_log_likelihood(measures, np.tile((300, 0.6, 1.0), (8, 1)), pivot)
+    assert instrumentation.recorder() is None
+
+    with open(paths['report']) as f:
+        report = json.load(f)
+    assert set(report['stages']) == {'read_positions', 'pivot_fit', 'simulation'}
+    assert report['stages']['simulation']['count'] == 3
+    assert report['counters'] == {'likelihood_evaluations': 24, 'simulations': 24}
+    assert report['histograms']['track_length']['max'] == 100
+    with open(paths['trace']) as f:
+        events = json.load(f)['traceEvents']
+    assert len(events) == 5 and all(event['dur'] >= 0 for event in events)
+    assert any('batch_log_likelihood' in function[2] for function in pstats.Stats(paths['profile']).stats)
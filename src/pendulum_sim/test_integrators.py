@@ -0,0 +1,49 @@
+import itertools
+
+import numpy as np
+
+from pendulum_sim.integrators import integrate, integrate_rk45
+
+
+def pendulum(q, p):
+    return p, -np.sin(q)
+
+
+def energy(q, p):
+    return p ** 2 / 2 - np.cos(q)
+
+
+def test_symplectic_integrators_do_not_drift():
+    errors = {}
+    for method in ('verlet', 'symplectic_euler', 'rk4'):
+        states = np.array(list(itertools.islice(integrate(pendulum, 2.5, 0.0, 0.3, method), 20000)))
+        errors[method] = energy(*states.T) - energy(2.5, 0.0)
+    # the energy error of the symplectic schemes oscillates, the one of RK4 grows steadily
+    assert np.abs(errors['verlet']).max() < 0.05
+    assert np.abs(errors['symplectic_euler']).max() < 0.25
+    assert abs(errors['rk4'][-1]) > 0.1
+
+
+def test_rk45_takes_larger_steps():
+    stats = {}
+    states = np.array(list(itertools.islice(integrate_rk45(pendulum, 0.5, 0.0, 0.01, rtol=1e-8, stats=stats),
+                                            2000)))
+    reference = np.array(list(itertools.islice(integrate(pendulum, 0.5, 0.0, 0.001, 'rk4'), 20000)))[9::10]
+    np.testing.assert_allclose(states, reference, atol=1e-6)
+    assert stats['accepted'] < 1000
+
+
+def test_separable_schemes_are_explicit():
+    calls = []
+
+    def counted(q, p):
+        calls.append(1)
+        return pendulum(q, p)
+
+    for method in ('verlet', 'symplectic_euler'):
+        implicit = np.array(list(itertools.islice(integrate(pendulum, 2.5, 0.0, 0.1, method), 500)))
+        del calls[:]
+        explicit = np.array(list(itertools.islice(integrate(counted, 2.5, 0.0, 0.1, method, separable=True), 500)))
+        # the implicit stages are solved up to rounding errors
+        np.testing.assert_allclose(explicit, implicit, atol=1e-9)
+        assert len(calls) <= 2 * 500 + 1
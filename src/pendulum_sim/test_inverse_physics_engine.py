@@ -0,0 +1,46 @@
+import numpy as np
+
+from pendulum_sim.inverse_physics_engine import estimate_state, guess_double_state, guess_state, \
+    metropolis_hastings, simulate_angles, simulate_double_measures, simulate_measures
+
+
+def test_metropolis_hastings_recovers_parameters():
+    pivot = (400, 400)
+    rng = np.random.RandomState(0)
+    measures = simulate_measures((300, 0.6, 1.0), pivot, 200)[0] + rng.normal(0, 2, (200, 2))
+    guess = guess_state(measures, pivot, 305)
+    result = metropolis_hastings(measures, pivot, (guess.l, guess.theta, guess.theta_dot), n_samples=1000,
+                                 n_walkers=16, seed=1)
+    assert result.samples.shape == (1000, 16, 3)
+    assert 0 < result.acceptance_rate < 1
+    np.testing.assert_allclose(result.samples[500:].mean(axis=(0, 1)), (300, 0.6, 1.0), rtol=0.02)
+
+
+def test_state_estimation_reads_rates_and_length():
+    pivot = (400, 100)
+    rng = np.random.RandomState(0)
+    for l, theta0, theta_dot0 in ((300, 0.5, 1.5), (150, 1.5, 0.0)):
+        measures = simulate_measures((l, theta0, theta_dot0), pivot, 300)[0] + rng.normal(0, 2, (300, 2))
+        state = estimate_state(measures, pivot)
+        # reference speeds by finite differences of a finer simulation
+        thetas = simulate_angles((l, theta0, theta_dot0), 3001, dt=0.001)[0]
+        rates = np.gradient(thetas, 0.001)[:3000:10]
+        assert np.max(np.abs(state.angles - thetas[:3000:10])) < 0.02
+        assert np.sqrt(np.mean((state.rates - rates) ** 2)) < 0.2
+        # large swings are slower than the small angle period
+        assert abs(state.length - l) < 2 * state.length_std and state.length_std < 0.05 * l
+    # less than a period
+    assert np.isnan(estimate_state(measures[:60], pivot).length)
+
+
+def test_double_pendulum_inference_recovers_lengths_and_mass_ratio():
+    pivot = (600, 400)
+    rng = np.random.RandomState(0)
+    true_params = (1.0, 0.5, 200, 100, 2.0, 2.5, 0.0, 0.0)
+    measures = simulate_double_measures(true_params, pivot, 200)[0] + rng.normal(0, 2, (200, 2, 2))
+    start = guess_double_state(measures, pivot)
+    result = metropolis_hastings(measures, pivot, start, n_samples=1000, n_walkers=8, seed=1, model='double')
+    assert result.samples.shape == (1000, 8, 8)
+    burnt = result.samples[500:].reshape(-1, 8)
+    np.testing.assert_allclose(burnt[:, 2:4].mean(axis=0), (200, 100), rtol=0.01)
+    np.testing.assert_allclose(burnt[:, 1].mean() / burnt[:, 0].mean(), 0.5, rtol=0.1)
@@ -0,0 +1,22 @@
+import numpy as np
+
+from pendulum_sim.batch import simulate_double_batch, simulate_double_loop
+from pendulum_sim.core import DoublePendulumPhysics
+from pendulum_sim.kernels import BACKENDS, _KERNELS
+
+
+def test_kernels_match_the_reference_generator():
+    rng = np.random.RandomState(0)
+    args = (rng.uniform(0.5, 2, 20), rng.uniform(0.5, 2, 20), rng.uniform(150, 300, 20), rng.uniform(150, 300, 20),
+            rng.uniform(np.pi / 2, np.pi, 20), rng.uniform(np.pi / 2, np.pi, 20), rng.uniform(-2, 2, 20),
+            rng.uniform(-2, 2, 20), 300)
+    reference = simulate_double_loop(*args)
+    for backend in BACKENDS:
+        if backend in _KERNELS:
+            np.testing.assert_allclose(simulate_double_batch(*args, backend=backend), reference, rtol=0, atol=1e-9)
+
+
+def test_rk4_trajectory_uses_the_kernels():
+    physics = DoublePendulumPhysics(theta1_0=2.0, theta2_0=3.0, integrator='rk4')
+    simulator = physics.simulate()
+    np.testing.assert_array_equal(physics.trajectory(500), [next(simulator) for _ in range(500)])
@@ -0,0 +1,21 @@
+import numpy as np
+
+from pendulum_sim.inverse_physics_engine import simulate_measures
+from pendulum_sim.parallel_tempering import gelman_rubin, parallel_tempering, temperature_ladder
+
+
+def test_gelman_rubin():
+    samples = np.random.RandomState(0).normal(size=(2000, 4, 3))
+    np.testing.assert_allclose(gelman_rubin(samples), 1, atol=0.01)
+    samples[:, 0] += 10
+    assert np.all(gelman_rubin(samples) > 2)
+
+
+def test_parallel_tempering_keeps_cold_chains():
+    pivot = (400, 400)
+    measures = simulate_measures((300, 0.6, 1.0), pivot, 100)[0]
+    result = parallel_tempering(measures, pivot, (300, 0.6, 1.0), n_samples=100, n_walkers=4,
+                                temperatures=temperature_ladder(3, 10), swap_every=20, processes=2, seed=0)
+    assert result.samples.shape == (100, 4, 3)
+    assert result.r_hat.shape == (3,)
+    assert 0 < result.acceptance_rate < 1
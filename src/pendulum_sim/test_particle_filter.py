@@ -0,0 +1,39 @@
+import numpy as np
+
+from pendulum_sim.inverse_physics_engine import simulate_measures
+from pendulum_sim.particle_filter import ParticleFilter, online_estimates
+
+
+def test_filter_tracks_the_state_online():
+    pivot = (400, 100)
+    positions = simulate_measures((300, 0.6, 1.0), pivot, 300)[0]
+    centers = list(positions + np.random.RandomState(0).normal(0, 2, positions.shape))
+    # the ball is lost for a few frames
+    centers[100:105] = [None] * 5
+    estimates = list(online_estimates(centers, pivot, seed=0))
+    assert len(estimates) == len(centers)
+    mean, std = estimates[-1].mean, estimates[-1].std
+    assert abs(mean[0] - 300) < 1 and std[0] < 1
+    theta = np.arctan2(*(positions[-1] - pivot))
+    assert abs(mean[1] - theta) < 0.01
+
+
+def test_latency_budget_reduces_the_particles():
+    pivot = (400, 100)
+    positions = simulate_measures((300, 0.6, 1.0), pivot, 50)[0]
+    particle_filter = ParticleFilter(pivot, positions[0], n_particles=5000, max_latency=1e-9, min_particles=200,
+                                     seed=0)
+    for center in positions[1:]:
+        estimate = particle_filter.update(center)
+    assert particle_filter.n_particles == 200 and estimate.latency > 0
+
+
+def test_filter_starts_on_the_first_center():
+    pivot = (400, 100)
+    positions = list(simulate_measures((300, 0.6, 1.0), pivot, 20)[0])
+    # the camera starts before the ball is in view, with and without a pivot
+    estimates = list(online_estimates([None, None] + positions, pivot, seed=0))
+    assert len(estimates) == 22 and estimates[:2] == [None, None] and estimates[2] is not None
+    estimates = list(online_estimates([None] + positions, warmup=10, seed=0))
+    assert len(estimates) == 21 and estimates[0] is None and all(e is not None for e in estimates[1:])
+    assert list(online_estimates([None, None], pivot)) == [None, None]
@@ -0,0 +1,39 @@
+import numpy as np
+import pygame
+
+from pendulum_sim.physics_engine import SimplePendulum
+from pendulum_sim.render import frame_stride, render_offline
+
+
+def test_frame_stride_rounds_to_the_nearest_step():
+    assert frame_stride(0.01, 30) == 3
+    assert frame_stride(0.01, 15) == 7
+    assert frame_stride(0.01, 100) == 1
+    # faster than the physics, every step is a frame
+    assert frame_stride(0.01, 1000) == 1
+
+
+def test_offline_rendering_advances_stride_steps_per_frame(monkeypatch):
+    monkeypatch.setenv('SDL_VIDEODRIVER', 'dummy')
+    pygame.display.init()
+    try:
+        # sprites converted to the display format by new_surface
+        pygame.display.set_mode((1, 1))
+        rendered = SimplePendulum(1, 100, pivot_pos=(150, 150), theta0=1.0, radius=10)
+        stepped = SimplePendulum(1, 100, pivot_pos=(150, 150), theta0=1.0, radius=10)
+        thetas = []
+        frames = render_offline([rendered], 5, stride=3, size=(300, 300),
+                                on_frame=lambda i, sprites: thetas.append(sprites[0].theta))
+        expected = []
+        for _ in range(5):
+            for _ in range(3):
+                stepped.step()
+            expected.append(stepped.theta)
+    finally:
+        pygame.display.quit()
+    assert frames.shape == (5, 300, 300, 3) and frames.dtype == np.uint8
+    np.testing.assert_array_equal(thetas, expected)
+    assert len(rendered.m_pos_hist) == 15
+    # the blue bob is drawn on the white box of the swing
+    assert np.any(np.all(frames[-1] == (0, 0, 255), axis=-1))
+    assert np.any(np.all(frames[-1] == (255, 255, 255), axis=-1))
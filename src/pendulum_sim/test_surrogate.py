@@ -0,0 +1,32 @@
+import numpy as np
+
+from pendulum_sim.batch import simulate_batch
+from pendulum_sim.inverse_physics_engine import batch_log_likelihood, simulate_measures
+from pendulum_sim.surrogate import PendulumTable
+
+
+def test_table_matches_simulation(tmpdir):
+    path = str(tmpdir.join('table.npz'))
+    PendulumTable.build(128, 512).save(path)
+    table = PendulumTable.load(path)
+    # small and large swings, both directions, and an angle beyond a full turn
+    l = np.array([300, 120, 250, 200])
+    theta0 = np.array([0.01, -1.0, 2.5, 2 * np.pi + 0.3])
+    theta_dot0 = np.array([0.5, 3.0, -1.0, 0.0])
+    assert np.all(table.covers(l, theta0, theta_dot0))
+    thetas = table.simulate(1, l, theta0, theta_dot0, 400)
+    reference = simulate_batch(1, l, theta0, theta_dot0, 400)
+    # well below a pixel on the positions
+    assert np.max(np.abs(thetas - reference) * l[:, np.newaxis]) < 0.1
+
+
+def test_table_falls_back_beyond_its_amplitudes():
+    table = PendulumTable.build(32, 128, max_amplitude=np.pi / 2)
+    params = np.array([[300, 0.3, 0.0], [300, 2.0, 0.0], [300, 0.0, 20.0]])
+    assert list(table.covers(*params.T)) == [True, False, False]
+    thetas = table.simulate(1, *params.T, n_steps=200)
+    np.testing.assert_array_equal(thetas[1:], simulate_batch(1, *params[1:].T, n_steps=200))
+    pivot = (400, 400)
+    measures = simulate_measures(params[0], pivot, 100)[0]
+    np.testing.assert_allclose(batch_log_likelihood(measures, params, pivot, table=table),
+                               batch_log_likelihood(measures, params, pivot), rtol=1e-3, atol=0.01)
@@ -0,0 +1,38 @@
+import numpy as np
+import pytest
+
+from pendulum_sim.trajectory import TrajectoryBuffer, load_trajectory, read_positions, save_trajectory, \
+    trajectory_to_csv
+
+
+def test_trajectory_buffer_grows_and_wraps():
+    growing = TrajectoryBuffer(2, capacity=1)
+    ring = TrajectoryBuffer(2, maxlen=4)
+    for i in range(10):
+        growing.append((i, -i))
+        ring.append((i, -i))
+    np.testing.assert_array_equal(growing.view()[:, 0], np.arange(10))
+    np.testing.assert_array_equal(ring.view(), [[6, -6], [7, -7], [8, -8], [9, -9]])
+    assert np.shares_memory(ring.view(), ring._data)
+    with pytest.raises(ValueError):
+        TrajectoryBuffer(2, maxlen=0)
+
+
+def test_trajectory_file_roundtrip(tmpdir):
+    positions = np.random.RandomState(0).uniform(0, 600, (500, 2))
+    path = str(tmpdir.join('m_hist.traj'))
+    save_trajectory(path, positions, arrays={'theta': positions[:, 0] / 600}, fps=30.0, units='px',
+                    source_video='clip.avi', pivot=(300.5, 60))
+    trajectory = load_trajectory(path)
+    assert isinstance(trajectory.positions, np.memmap)
+    np.testing.assert_array_equal(trajectory.positions, positions)
+    np.testing.assert_array_equal(trajectory.arrays['theta'], positions[:, 0] / 600)
+    assert trajectory.metadata == {'fps': 30.0, 'units': 'px', 'source_video': 'clip.avi', 'pivot': [300.5, 60]}
+    csv_path = str(tmpdir.join('m_hist.csv'))
+    trajectory_to_csv(path, csv_path)
+    np.testing.assert_allclose(read_positions(csv_path), read_positions(path))
+    # numpy metadata is converted, other types json does not know are refused
+    save_trajectory(path, positions, fps=np.float32(30), pivot=np.array([300, 60]))
+    assert load_trajectory(path).metadata == {'fps': 30.0, 'pivot': [300, 60]}
+    with pytest.raises(TypeError):
+        save_trajectory(path, positions, tags={'swing'})
@@ -0,0 +1,165 @@
+"""
+desc: Array-backed recording of trajectories (simulated bob positions, tracked ball centers) and their binary
+      file format
+"""
+from __future__ import division, print_function
+
+import json
+import struct
+from collections import namedtuple
+
+import numpy as np
+
+
+class TrajectoryBuffer(object):
+    """Growable (n, dim) array with amortized O(1) append.
+
+    Points are stored in one preallocated array whose capacity doubles when full, so that view() returns the
+    recorded points without copying them. With maxlen, only the last maxlen points are kept: every point is
+    written twice, maxlen rows apart, in an array of 2 * maxlen rows, so the window of the last maxlen points is
+    always contiguous and view() stays zero-copy.
+    """
+
+    def __init__(self, dim=2, maxlen=None, capacity=1024, dtype=float):
+        if maxlen is not None and maxlen < 1:
+            raise ValueError("maxlen must be at least 1, got {}".format(maxlen))
+        self.dim = dim
+        self.maxlen = maxlen
+        if maxlen is not None:
+            capacity = 2 * maxlen
+        self._data = np.empty((capacity, dim), dtype=dtype)
+        self._start = 0
+        self._len = 0
+
+    def __len__(self):
+        return self._len
+
+    def append(self, point):
+        if self.maxlen is None:
+            if self._len == self._data.shape[0]:
+                self._grow(2 * self._len)
+            self._data[self._len] = point
+            self._len += 1
+            return
+        end = self._start + self._len
+        if end >= self.maxlen:
+            end -= self.maxlen
+        self._data[end] = point
+        self._data[end + self.maxlen] = point
+        if self._len < self.maxlen:
+            self._len += 1
+        else:
+            self._start = (self._start + 1) % self.maxlen
+
+    def extend(self, points):
+        points = np.asarray(points).reshape(-1, self.dim)
+        if self.maxlen is None:
+            if self._len + len(points) > self._data.shape[0]:
+                self._grow(max(2 * self._data.shape[0], self._len + len(points)))
+            self._data[self._len:self._len + len(points)] = points
+            self._len += len(points)
+        else:
+            for point in points[-self.maxlen:]:
+                self.append(point)
+
+    def _grow(self, capacity):
+        data = np.empty((max(capacity, 1), self.dim), dtype=self._data.dtype)
+        data[:self._len] = self._data[:self._len]
+        self._data = data
+
+    def view(self):
+        """Read-only (n, dim) view of the recorded points, oldest first.
+
+        The view shares memory with the buffer and does not see further appends. Without maxlen the points it
+        shows are never modified, with maxlen the ring overwrites them as new points come in: copy the view if it
+        has to outlive later appends.
+        """
+        view = self._data[self._start:self._start + self._len]
+        view.flags.writeable = False
+        return view
+
+    def __array__(self, dtype=None, copy=None):
+        if copy:
+            return np.array(self.view(), dtype=dtype)
+        return np.asarray(self.view(), dtype=dtype)
+
+    def clear(self):
+        self._start = 0
+        self._len = 0
+
+
+# Binary trajectory files: magic, little endian uint64 header length, JSON header padded with spaces so that the
+# arrays start on a 64 bytes boundary, then the raw C ordered arrays. The JSON header holds the metadata (fps,
+# units, source video, pivot guess...) and the dtype, shape and offset of each array, so that they can be mapped
+# in memory without any parsing.
+TRAJECTORY_MAGIC = b'PPTRAJ\x01\x00'
+TRAJECTORY_EXTENSION = '.traj'
+_ALIGNMENT = 64
+
+Trajectory = namedtuple('Trajectory', ['positions', 'arrays', 'metadata'])
+
+
+def _to_json(obj):
+    # numpy scalars and arrays in the metadata
+    if isinstance(obj, (np.generic, np.ndarray)):
+        return obj.tolist()
+    raise TypeError("{} is not JSON serializable".format(type(obj).__name__))
+
+
+def save_trajectory(path, positions, arrays=None, **metadata):
+    """Writes the (n, 2) positions, the optional dict of named arrays and the metadata keywords to path"""
+    arrays = dict(arrays or {}, positions=positions)
+    arrays = dict((name, np.ascontiguousarray(array)) for name, array in arrays.items())
+    layout = {}
+    offset = 0
+    for name in sorted(arrays):
+        layout[name] = {'dtype': arrays[name].dtype.str, 'shape': list(arrays[name].shape), 'offset': offset}
+        offset += -(-arrays[name].nbytes // _ALIGNMENT) * _ALIGNMENT
+    header = json.dumps({'arrays': layout, 'metadata': metadata}, default=_to_json).encode('utf-8')
+    data_start = -(-(len(TRAJECTORY_MAGIC) + 8 + len(header)) // _ALIGNMENT) * _ALIGNMENT
+    header += b' ' * (data_start - len(TRAJECTORY_MAGIC) - 8 - len(header))
+    with open(path, 'wb') as f:
+        f.write(TRAJECTORY_MAGIC)
+        f.write(struct.pack('<Q', len(header)))
+        f.write(header)
+        for name in sorted(arrays):
+            f.seek(data_start + layout[name]['offset'])
+            f.write(arrays[name].tobytes())
+
+
+def load_trajectory(path, mmap=True):
+    """Reads a file written by save_trajectory. With mmap, the arrays are read-only memory maps of the file."""
+    with open(path, 'rb') as f:
+        if f.read(len(TRAJECTORY_MAGIC)) != TRAJECTORY_MAGIC:
+            raise ValueError("{} is not a trajectory file".format(path))
+        header_len, = struct.unpack('<Q', f.read(8))
+        header = json.loads(f.read(header_len).decode('utf-8'))
+        data_start = f.tell()
+        arrays = {}
+        for name, layout in header['arrays'].items():
+            dtype, shape = np.dtype(layout['dtype']), tuple(layout['shape'])
+            if mmap and int(np.prod(shape)) > 0:
+                arrays[name] = np.memmap(path, dtype=dtype, mode='r', offset=data_start + layout['offset'],
+                                         shape=shape)
+            else:
+                f.seek(data_start + layout['offset'])
+                arrays[name] = np.fromfile(f, dtype=dtype, count=int(np.prod(shape))).reshape(shape)
+    positions = arrays.pop('positions')
+    return Trajectory(positions, arrays, header['metadata'])
+
+
+def read_positions(path, mmap=True):
+    """(n, 2) positions stored in path, a trajectory file or, for compatibility, a text file read by np.loadtxt"""
+    with open(path, 'rb') as f:
+        binary = f.read(len(TRAJECTORY_MAGIC)) == TRAJECTORY_MAGIC
+    if binary:
+        return load_trajectory(path, mmap=mmap).positions
+    return np.loadtxt(path)
+
+
+def csv_to_trajectory(csv_path, path, **metadata):
+    save_trajectory(path, np.loadtxt(csv_path), **metadata)
+
+
+def trajectory_to_csv(path, csv_path):
+    np.savetxt(csv_path, load_trajectory(path).positions)
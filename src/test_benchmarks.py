@@ -0,0 +1,18 @@
+import io
+
+from benchmarks import BENCHMARKS, compare, load_baselines, run_suite, save_baselines
+
+
+def test_suite_reports_regressions(tmpdir):
+    names = ['likelihood', 'find_pivot_100', 'tracking']
+    out = io.StringIO()
+    results, regressions = run_suite(names, scale=0.1, repeats=1, baselines={'likelihood': 1e12}, out=out)
+    assert list(results) == names and all(rate > 0 for rate in results.values())
+    assert regressions == ['likelihood'] and 'REGRESSION' in out.getvalue()
+    assert compare(results, {name: rate / 2 for name, rate in results.items()}) == []
+    path = str(tmpdir.join('baselines.json'))
+    save_baselines({'likelihood': 1.0}, path)
+    save_baselines({'tracking': 2.0}, path)
+    assert load_baselines(path) == {'likelihood': 1.0, 'tracking': 2.0}
+    # every benchmark has a stored baseline
+    assert set(load_baselines()) == set(BENCHMARKS)
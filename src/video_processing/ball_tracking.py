@@ -1,118 +1,479 @@
-# USAGE
-# python ball_tracking.py --video ball_tracking_example.mp4
-# python ball_tracking.py
+# USAGE (from the src directory)
+# python -m video_processing.ball_tracking --video ball_tracking_example.mp4
+# python -m video_processing.ball_tracking
+# python -m video_processing.ball_tracking --directory videos --processes 8
+# python -m video_processing.ball_tracking --video ball_tracking_example.mp4 --no-display --chunk-size 16
 
 # import the necessary packages
 import argparse
+import os
+import threading
 from collections import deque
+from multiprocessing import Pool
+
+try:
+    from queue import Queue
+except ImportError:
+    from Queue import Queue
 
 import cv2
 import imutils
 import numpy as np
 
-# construct the argument parse and parse the arguments
-ap = argparse.ArgumentParser()
-ap.add_argument("-v", "--video",
-                help="path to the (optional) video file")
-ap.add_argument("-b", "--buffer", type=int, default=64,
-                help="max buffer size")
-args = vars(ap.parse_args())
+from pendulum_sim import instrumentation
+from pendulum_sim.instrumentation import stage
+from pendulum_sim.trajectory import TRAJECTORY_EXTENSION, TrajectoryBuffer, save_trajectory
 
 # define the lower and upper boundaries of the "green"
-# ball in the HSV color space, then initialize the
-# list of tracked points
+# ball in the HSV color space
 greenLower = (100, 0, 0)# (29, 86, 6)
 greenUpper = (255, 255, 255)# (64, 255, 255)
-pts = deque(maxlen=args["buffer"])
 
-list_of_centers = np.zeros((0, 2))
+VIDEO_EXTENSIONS = ('.avi', '.mp4', '.mov', '.mkv')
+
+# Fraction of the area of a disc of the same spread below which a mask is not taken for the ball alone
+_COMPACTNESS = 0.8
+
 
-# if a video path was not supplied, grab the reference
-# to the webcam
-if not args.get("video", False):
-    camera = cv2.VideoCapture(0)
+def read_frames(camera, queue_size=64):
+    """Generator of the frames of camera, decoded by a background thread while the caller processes them"""
+    frames = Queue(maxsize=queue_size)
+    stop = threading.Event()
 
-# otherwise, grab a reference to the video file
-else:
-    camera = cv2.VideoCapture(args["video"])
+    def reader():
+        while not stop.is_set():
+            with stage('decode'):
+                (grabbed, frame) = camera.read()
+            frames.put(frame if grabbed else None)
+            if not grabbed:
+                return
 
-# keep looping
-while True:
-    # grab the current frame
-    (grabbed, frame) = camera.read()
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            frame = frames.get()
+            if frame is None:
+                return
+            yield frame
+    finally:
+        # unblock the reader if the caller stopped early
+        stop.set()
+        while thread.is_alive():
+            while not frames.empty():
+                frames.get()
+            thread.join(0.01)
 
-    # if we are viewing a video and we did not grab a frame,
-    # then we have reached the end of the video
-    if args.get("video") and not grabbed:
-        break
 
-    # resize the frame, blur it, and convert it to the HSV
-    # color space
-    frame = imutils.resize(frame, width=600)
+def find_ball(frame, lower=greenLower, upper=greenUpper):
+    """Returns the centroid, the center and the radius of the minimum enclosing circle of the largest blob of
+    frame in the [lower, upper] HSV range, or (None, None, None) if there is no such blob"""
     # blurred = cv2.GaussianBlur(frame, (11, 11), 0)
-    hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
+    with stage('hsv_mask'):
+        hsv = cv2.cvtColor(frame, cv2.COLOR_BGR2HSV)
 
-    # construct a mask for the color "green", then perform
-    # a series of dilations and erosions to remove any small
-    # blobs left in the mask
-    mask = cv2.inRange(hsv, greenLower, greenUpper)
-    mask = cv2.erode(mask, None, iterations=2)
-    mask = cv2.dilate(mask, None, iterations=2)
+        # construct a mask for the color "green", then perform
+        # a series of dilations and erosions to remove any small
+        # blobs left in the mask
+        mask = cv2.inRange(hsv, lower, upper)
+    with stage('morphology'):
+        mask = cv2.erode(mask, None, iterations=2)
+        mask = cv2.dilate(mask, None, iterations=2)
 
-    # find contours in the mask and initialize the current
-    # (x, y) center of the ball
-    cnts = cv2.findContours(mask.copy(), cv2.RETR_EXTERNAL,
-                            cv2.CHAIN_APPROX_SIMPLE)[-2]
-    center = None
+    return _largest_blob(mask)
+
+
+def _largest_blob(mask):
+    """find_ball on the cleaned mask"""
+    # find contours in the mask, which findContours leaves untouched
+    with stage('contours'):
+        cnts = cv2.findContours(mask, cv2.RETR_EXTERNAL,
+                                cv2.CHAIN_APPROX_SIMPLE)[-2]
 
     # only proceed if at least one contour was found
-    if len(cnts) > 0:
-        # find the largest contour in the mask, then use
-        # it to compute the minimum enclosing circle and
-        # centroid
+    if len(cnts) == 0:
+        return None, None, None
+    # find the largest contour in the mask, then use
+    # it to compute the minimum enclosing circle and
+    # centroid
+    with stage('ball_fit'):
         c = max(cnts, key=cv2.contourArea)
         ((x, y), radius) = cv2.minEnclosingCircle(c)
         M = cv2.moments(c)
-        center = (int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"]))
-
-        list_of_centers = np.vstack((list_of_centers, center))
-        print(str(center[0]) + ", " + str(center[1]))
-        # only proceed if the radius meets a minimum size
-        if radius > 10:
-            # draw the circle and centroid on the frame,
-            # then update the list of tracked points
-            cv2.circle(frame, (int(x), int(y)), int(radius),
-                       (0, 255, 255), 2)
-            cv2.circle(frame, center, 5, (0, 0, 255), -1)
-
-    # update the points queue
-    pts.appendleft(center)
-
-    # loop over the set of tracked points
-    for i in xrange(1, len(pts)):
-        # if either of the tracked points are None, ignore
-        # them
-        if pts[i - 1] is None or pts[i] is None:
-            continue
-
-        # otherwise, compute the thickness of the line and
-        # draw the connecting lines
-        thickness = int(np.sqrt(args["buffer"] / float(i + 1)) * 2.5)
-        cv2.line(frame, pts[i - 1], pts[i], (0, 0, 255), thickness)
-
-    # show the frame to our screen
-    cv2.imshow("Frame", frame)
-    key = cv2.waitKey(1) & 0xFF
-
-    # if the 'q' key is pressed, stop the loop
-    if key == ord("q"):
-        break
-
-# print list_of_centers.shape
-# print list_of_centers
-list_of_centers = np.asarray(list_of_centers)
-np.savetxt("centers.csv", list_of_centers)
-
-# cleanup the camera and close any open windows
-camera.release()
-cv2.destroyAllWindows()
+    if M["m00"] == 0:
+        return None, None, None
+    center = (int(M["m10"] / M["m00"]), int(M["m01"] / M["m00"]))
+    return center, (x, y), radius
+
+
+def chunk_centers(frames, lower=greenLower, upper=greenUpper, out=None):
+    """(n, 2) centroids of the blobs in the [lower, upper] HSV range of the (n, h, w, 3) frames, and the (n,) mask
+    of the frames where a ball was found, as find_ball on each frame.
+
+    The frames are converted, masked and cleaned in a few OpenCV calls on the whole stack, into the (n * h, w, 3)
+    and (n * h, w) arrays out, if given, and the centroids are the moments of the masks, computed by NumPy
+    reductions. Only the frames whose mask is not a single compact blob go through the contours of find_ball.
+    """
+    n, h, w = frames.shape[:3]
+    hsv, mask = (None, None) if out is None else out
+    stacked = frames.reshape(n * h, w, 3)
+    with stage('hsv_mask'):
+        hsv = cv2.cvtColor(stacked, cv2.COLOR_BGR2HSV, dst=hsv)
+        mask = cv2.inRange(hsv, lower, upper, dst=mask)
+    # the morphology sees the adjacent frames past the top and bottom rows of a frame, which only matters for a
+    # ball touching these borders
+    with stage('morphology'):
+        cv2.erode(mask, None, dst=mask, iterations=2)
+        cv2.dilate(mask, None, dst=mask, iterations=2)
+    masks = mask.reshape(n, h, w)
+    with stage('moments'):
+        rows = masks.sum(axis=2, dtype=np.uint32) // 255
+        cols = masks.sum(axis=1, dtype=np.uint32) // 255
+        area = rows.sum(axis=1)
+        y, x = np.arange(h), np.arange(w)
+        with np.errstate(invalid='ignore', divide='ignore'):
+            cx, cy = cols.dot(x) / area, rows.dot(y) / area
+            spread = cols.dot(x * x) / area - cx * cx + rows.dot(y * y) / area - cy * cy
+    found = area > 0
+    centers = np.zeros((n, 2), dtype=int)
+    centers[found] = np.stack((cx[found], cy[found]), axis=1).astype(int)
+    # a disc of area A has a spread (sum of the variances of x and y) of A / (2 pi), several blobs or an
+    # elongated one a larger spread
+    for i in np.flatnonzero(found & (area < _COMPACTNESS * 2 * np.pi * spread)):
+        center = _largest_blob(masks[i])[0]
+        found[i] = center is not None
+        if found[i]:
+            centers[i] = center
+    return centers, found
+
+
+def read_chunks(camera, chunk_size=16, width=None):
+    """Generator of chunks of at most chunk_size consecutive frames of camera, resized to width if given.
+
+    A background thread decodes and resizes the next chunk while the caller processes the current one, into two
+    preallocated (chunk_size, h, w, 3) arrays. The chunks are views of these arrays: a chunk is overwritten once
+    the caller asks for the next one.
+    """
+    with stage('decode'):
+        grabbed, first = camera.read()
+    if not grabbed:
+        return
+    height = first.shape[0]
+    if width is not None and width != first.shape[1]:
+        # as imutils.resize
+        height = int(first.shape[0] * width / float(first.shape[1]))
+    frames = [np.empty((chunk_size,) + first.shape, dtype=first.dtype) for _ in range(2)]
+    resized = frames if height == first.shape[0] else [np.empty((chunk_size, height, width, 3), dtype=first.dtype)
+                                                       for _ in range(2)]
+    frames[0][0] = first
+    free, ready = Queue(), Queue()
+    free.put(0)
+    free.put(1)
+    stop = threading.Event()
+
+    def reader():
+        n, ended = 1, False
+        while not ended and not stop.is_set():
+            k = free.get()
+            if k is None:
+                return
+            with stage('decode'):
+                while n < chunk_size:
+                    if not camera.read(frames[k][n])[0]:
+                        ended = True
+                        break
+                    n += 1
+            if resized is not frames:
+                with stage('resize'):
+                    for i in range(n):
+                        cv2.resize(frames[k][i], (width, height), dst=resized[k][i], interpolation=cv2.INTER_AREA)
+            ready.put((k, n))
+            n = 0
+        ready.put(None)
+
+    thread = threading.Thread(target=reader)
+    thread.daemon = True
+    thread.start()
+    try:
+        while True:
+            chunk = ready.get()
+            if chunk is None:
+                return
+            k, n = chunk
+            if n:
+                yield resized[k][:n]
+            free.put(k)
+    finally:
+        # unblock the reader if the caller stopped early
+        stop.set()
+        free.put(None)
+        thread.join()
+
+
+class BallTracker(object):
+    """Incremental tracker: searches the ball in a window around its predicted position, in the full resolution
+    frame, and falls back to a search over the whole resized frame when the ball is lost.
+
+    The prediction is a constant velocity extrapolation of the last centers or, if the pivot of the pendulum is
+    given (in the coordinates of the frames resized to width), a quadratic extrapolation of the angle of the bob
+    around the pivot at constant length. Centers are returned in the coordinates of the frames resized to width,
+    like the full frame search.
+    """
+
+    def __init__(self, lower=greenLower, upper=greenUpper, width=600, pivot=None, min_window=20):
+        self.lower = lower
+        self.upper = upper
+        self.width = width
+        self.pivot = pivot
+        self.min_window = min_window
+        # last centers and radius, in full resolution coordinates
+        self.history = deque(maxlen=3)
+        self.radius = None
+
+    def predict(self):
+        """Predicted center of the ball in the next frame, in full resolution coordinates"""
+        if len(self.history) < 2:
+            return self.history[-1]
+        if self.pivot is None or len(self.history) < 3:
+            (x1, y1), (x2, y2) = self.history[-2], self.history[-1]
+            return 2 * x2 - x1, 2 * y2 - y1
+        px, py = self.pivot[0] / self.scale, self.pivot[1] / self.scale
+        angles = [np.arctan2(x - px, y - py) for x, y in self.history]
+        angles = np.unwrap(angles)
+        angle = 3 * angles[2] - 3 * angles[1] + angles[0]
+        length = np.hypot(self.history[-1][0] - px, self.history[-1][1] - py)
+        return px + length * np.sin(angle), py + length * np.cos(angle)
+
+    def _search_window(self, frame):
+        x, y = self.predict()
+        speed = np.hypot(*np.subtract(self.history[-1], self.history[-2])) if len(self.history) > 1 else 0
+        half = int(max(2 * self.radius + speed, self.min_window / self.scale))
+        x0, y0 = max(int(x) - half, 0), max(int(y) - half, 0)
+        x1, y1 = min(int(x) + half, frame.shape[1]), min(int(y) + half, frame.shape[0])
+        if x1 - x0 < 2 or y1 - y0 < 2:
+            return None, None
+        center, (cx, cy), radius = find_ball(frame[y0:y1, x0:x1], self.lower, self.upper)
+        if center is None:
+            return None, None
+        # a blob cut by the window border has a biased centroid
+        if cx - radius <= 0 or cy - radius <= 0 or cx + radius >= x1 - x0 - 1 or cy + radius >= y1 - y0 - 1:
+            return None, None
+        return (center[0] + x0, center[1] + y0), radius
+
+    def _search_frame(self, frame):
+        instrumentation.count('full_frame_searches')
+        with stage('resize'):
+            frame = imutils.resize(frame, width=self.width)
+        center, _, radius = find_ball(frame, self.lower, self.upper)
+        if center is None:
+            return None, None
+        return (center[0] / self.scale, center[1] / self.scale), radius / self.scale
+
+    def track(self, frame):
+        """Center of the ball in frame, in the coordinates of the frame resized to width, or None if it is lost"""
+        self.scale = self.width / float(frame.shape[1])
+        center = None
+        if self.history:
+            instrumentation.count('window_searches')
+            center, radius = self._search_window(frame)
+        if center is None:
+            center, radius = self._search_frame(frame)
+        if center is None:
+            self.history.clear()
+            return None
+        self.history.append(center)
+        self.radius = radius
+        return int(center[0] * self.scale), int(center[1] * self.scale)
+
+
+def track_video(path, lower=greenLower, upper=greenUpper, width=600, incremental=False, pivot=None,
+                chunk_size=None):
+    """(n, 2) array of the ball centers in the frames of the video at path (frames without ball are skipped),
+    in the coordinates of the frames resized to width. Nothing is displayed.
+
+    With incremental, the ball is searched with a BallTracker in a window around its predicted position.
+    Otherwise, with a chunk_size, the frames are processed chunk_size at a time by chunk_centers.
+    """
+    camera = cv2.VideoCapture(path)
+    list_of_centers = TrajectoryBuffer(2)
+    tracker = BallTracker(lower, upper, width, pivot) if incremental else None
+    try:
+        if tracker is None and chunk_size:
+            out = None
+            for frames in read_chunks(camera, chunk_size, width):
+                instrumentation.count('frames', len(frames))
+                if out is None:
+                    # the masking buffers of a full chunk, sliced for the last one
+                    out = (np.empty((chunk_size * frames.shape[1], frames.shape[2], 3), np.uint8),
+                           np.empty((chunk_size * frames.shape[1], frames.shape[2]), np.uint8))
+                rows = len(frames) * frames.shape[1]
+                centers, found = chunk_centers(frames, lower, upper, (out[0][:rows], out[1][:rows]))
+                instrumentation.count('frames_without_ball', len(found) - np.count_nonzero(found))
+                list_of_centers.extend(centers[found])
+            return np.array(list_of_centers)
+        for frame in read_frames(camera):
+            instrumentation.count('frames')
+            if tracker is not None:
+                center = tracker.track(frame)
+            else:
+                with stage('resize'):
+                    frame = imutils.resize(frame, width=width)
+                center, _, _ = find_ball(frame, lower, upper)
+            if center is not None:
+                list_of_centers.append(center)
+            else:
+                instrumentation.count('frames_without_ball')
+    finally:
+        camera.release()
+    return np.array(list_of_centers)
+
+
+def save_centers(out_path, centers, video=None, width=600):
+    """Writes the centers to a trajectory file, or to a text file if out_path ends with .csv"""
+    if out_path.endswith('.csv'):
+        np.savetxt(out_path, centers)
+        return
+    fps = None
+    if video is not None:
+        camera = cv2.VideoCapture(video)
+        fps = camera.get(cv2.CAP_PROP_FPS) or None
+        camera.release()
+    save_trajectory(out_path, centers, fps=fps, units='px', source_video=video, frame_width=width, pivot=None)
+
+
+def _track_to_file(args):
+    path, out_path, incremental, chunk_size = args
+    centers = track_video(path, incremental=incremental, chunk_size=chunk_size)
+    save_centers(out_path, centers, video=path)
+    return path, out_path, len(centers)
+
+
+def track_directory(directory, out_dir=None, processes=None, incremental=False, extension=TRAJECTORY_EXTENSION,
+                    chunk_size=None):
+    """Tracks every video of directory on a pool of processes, writing <video name>_centers<extension> files to
+    out_dir (directory by default). Returns the list of (video path, centers path, number of centers)"""
+    out_dir = directory if out_dir is None else out_dir
+    if not os.path.isdir(out_dir):
+        os.makedirs(out_dir)
+    tasks = [(os.path.join(directory, name), os.path.join(out_dir, os.path.splitext(name)[0] + '_centers' + extension),
+              incremental, chunk_size)
+             for name in sorted(os.listdir(directory)) if name.lower().endswith(VIDEO_EXTENSIONS)]
+    pool = Pool(processes)
+    try:
+        return list(pool.imap_unordered(_track_to_file, tasks))
+    finally:
+        pool.close()
+        pool.join()
+
+
+def show_tracking(camera, buffer=64, width=600):
+    """Displays the tracked ball and its recent path until the video ends or 'q' is pressed, returns the centers"""
+    pts = deque(maxlen=buffer)
+    list_of_centers = TrajectoryBuffer(2)
+
+    for frame in read_frames(camera):
+        # resize the frame and find the ball in it
+        frame = imutils.resize(frame, width=width)
+        center, xy, radius = find_ball(frame)
+
+        if center is not None:
+            list_of_centers.append(center)
+            print(str(center[0]) + ", " + str(center[1]))
+            # only proceed if the radius meets a minimum size
+            if radius > 10:
+                # draw the circle and centroid on the frame,
+                # then update the list of tracked points
+                cv2.circle(frame, (int(xy[0]), int(xy[1])), int(radius),
+                           (0, 255, 255), 2)
+                cv2.circle(frame, center, 5, (0, 0, 255), -1)
+
+        # update the points queue
+        pts.appendleft(center)
+
+        # loop over the set of tracked points
+        for i in range(1, len(pts)):
+            # if either of the tracked points are None, ignore
+            # them
+            if pts[i - 1] is None or pts[i] is None:
+                continue
+
+            # otherwise, compute the thickness of the line and
+            # draw the connecting lines
+            thickness = int(np.sqrt(buffer / float(i + 1)) * 2.5)
+            cv2.line(frame, pts[i - 1], pts[i], (0, 0, 255), thickness)
+
+        # show the frame to our screen
+        cv2.imshow("Frame", frame)
+        key = cv2.waitKey(1) & 0xFF
+
+        # if the 'q' key is pressed, stop the loop
+        if key == ord("q"):
+            break
+
+    cv2.destroyAllWindows()
+    return np.array(list_of_centers)
+
+
+def _run(args):
+    """Tracks as asked by the command line arguments args"""
+    extension = '.csv' if args["csv"] else TRAJECTORY_EXTENSION
+
+    if args["directory"]:
+        for path, out_path, n_centers in track_directory(args["directory"], processes=args["processes"],
+                                                         incremental=args["incremental"], extension=extension,
+                                                         chunk_size=args["chunk_size"]):
+            print("{} : {} centers -> {}".format(path, n_centers, out_path))
+        return
+    if args["video"] and args["no_display"]:
+        centers = track_video(args["video"], incremental=args["incremental"], chunk_size=args["chunk_size"])
+        save_centers("centers" + extension, centers, args["video"])
+        return
+
+    # if a video path was not supplied, grab the reference
+    # to the webcam, otherwise grab a reference to the video file
+    camera = cv2.VideoCapture(args["video"] if args["video"] else 0)
+    try:
+        list_of_centers = show_tracking(camera, args["buffer"])
+    finally:
+        # cleanup the camera
+        camera.release()
+    save_centers("centers" + extension, list_of_centers, args["video"])
+
+
+def main():
+    # construct the argument parse and parse the arguments
+    ap = argparse.ArgumentParser()
+    ap.add_argument("-v", "--video",
+                    help="path to the (optional) video file")
+    ap.add_argument("-b", "--buffer", type=int, default=64,
+                    help="max buffer size")
+    ap.add_argument("-d", "--directory",
+                    help="track every video of this directory, without display")
+    ap.add_argument("-p", "--processes", type=int,
+                    help="number of tracking processes for --directory")
+    ap.add_argument("--no-display", action="store_true",
+                    help="track --video without showing the frames")
+    ap.add_argument("-i", "--incremental", action="store_true",
+                    help="search the ball around its predicted position when tracking without display")
+    ap.add_argument("-c", "--chunk-size", type=int,
+                    help="mask the frames this many at a time when tracking without display, not incremental")
+    ap.add_argument("--csv", action="store_true",
+                    help="write the centers as text instead of trajectory files")
+    ap.add_argument("--report",
+                    help="write a JSON report of the time spent in each stage to this path")
+    ap.add_argument("--trace",
+                    help="write the stages to this path in the Chrome trace format, for chrome://tracing")
+    ap.add_argument("--profile",
+                    help="run under cProfile and write the statistics to this path")
+    args = vars(ap.parse_args())
+    if args["report"] or args["trace"] or args["profile"]:
+        # the tracking processes of --directory are not recorded, only the main one
+        with instrumentation.session(args["report"], args["trace"], args["profile"]):
+            _run(args)
+    else:
+        _run(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -1,28 +1,87 @@
+from __future__ import division, print_function
+
 import numpy as np
 
+from pendulum_sim.instrumentation import observe, stage
+from pendulum_sim.trajectory import read_positions
+
+
+def fit_circle(points, method='taubin'):
+    """Algebraic least-squares fit of a circle to the (N, 2) points, returns (xc, yc, r).
+
+    'kasa' solves the linear system x^2 + y^2 = 2 xc x + 2 yc y + c, it is biased towards small circles when the
+    points only cover a short arc, which is the case of a pendulum swing. 'taubin' (default) removes most of this
+    bias by normalizing the algebraic distances with their gradient, and is solved with one SVD of an (N, 3) matrix.
+    """
+    points = np.asarray(points, dtype=float)
+    mean = points.mean(axis=0)
+    x, y = (points - mean).T
+    z = x * x + y * y
+    if method == 'kasa':
+        A = np.stack((x, y, np.ones_like(x)), axis=1)
+        (a, b, c), _, _, _ = np.linalg.lstsq(A, z, rcond=None)
+        xc, yc = a / 2, b / 2
+        return xc + mean[0], yc + mean[1], np.sqrt(c + xc * xc + yc * yc)
+    if method != 'taubin':
+        raise ValueError("Unknown circle fit method {}".format(method))
+    z_mean = z.mean()
+    z0 = (z - z_mean) / (2 * np.sqrt(z_mean))
+    _, _, vt = np.linalg.svd(np.stack((z0, x, y), axis=1), full_matrices=False)
+    a0, a1, a2 = vt[2]
+    a0 = a0 / (2 * np.sqrt(z_mean))
+    a3 = -z_mean * a0
+    xc, yc = -a1 / (2 * a0), -a2 / (2 * a0)
+    return xc + mean[0], yc + mean[1], np.sqrt(a1 * a1 + a2 * a2 - 4 * a0 * a3) / (2 * abs(a0))
 
-def find_pivot(f='../../data/m_hist.csv'):
-    centers = np.loadtxt(f)
 
-    xA = min(centers[:, 0])
-    xB = max(centers[:, 0])
+def _circumcircles(a, b, c):
+    """Circles through the points of each row of the (n, 2) arrays a, b, c, as (xc, yc, r) arrays"""
+    d = 2 * (a[:, 0] * (b[:, 1] - c[:, 1]) + b[:, 0] * (c[:, 1] - a[:, 1]) + c[:, 0] * (a[:, 1] - b[:, 1]))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        sa, sb, sc = (a * a).sum(axis=1), (b * b).sum(axis=1), (c * c).sum(axis=1)
+        xc = (sa * (b[:, 1] - c[:, 1]) + sb * (c[:, 1] - a[:, 1]) + sc * (a[:, 1] - b[:, 1])) / d
+        yc = (sa * (c[:, 0] - b[:, 0]) + sb * (a[:, 0] - c[:, 0]) + sc * (b[:, 0] - a[:, 0])) / d
+    return xc, yc, np.hypot(a[:, 0] - xc, a[:, 1] - yc)
 
-    xC = (xB - xA) / 2
-    idx = np.argmin(np.abs(centers[:, 0] - xC))
-    yC = centers[idx, 1]
-    yA = np.mean(centers[np.where(centers[:, 0] == xA)[0], 1])
-    yB = np.mean(centers[np.where(centers[:, 0] == xB)[0], 1])
 
-    # Chercher Pivot P tel que xP = xC et PC = PB
-    xP = xC
-    yP = ((xC - xB) ** 2 + yB ** 2 - yC ** 2) / (2 * (yB - yC))
+def ransac_circle(points, n_iter=200, threshold=3.0, method='taubin', seed=None):
+    """Circle fit robust to outliers: the circle through 3 random points with the most points within threshold
+    pixels selects the inliers, which are then fitted with fit_circle. Returns (xc, yc, r, inliers mask)."""
+    points = np.asarray(points, dtype=float)
+    rng = np.random.RandomState(seed)
+    triplets = points[rng.randint(len(points), size=(3, n_iter))]
+    xc, yc, r = _circumcircles(*triplets)
+    valid = np.flatnonzero(np.isfinite(r))
+    best, best_count = None, -1
+    # score the hypotheses by chunks to bound the memory of the (hypotheses, points) distance matrix
+    chunk = max(1, 2 ** 22 // len(points))
+    for start in range(0, len(valid), chunk):
+        idx = valid[start:start + chunk]
+        dist = np.hypot(points[:, 0] - xc[idx, None], points[:, 1] - yc[idx, None])
+        counts = np.count_nonzero(np.abs(dist - r[idx, None]) < threshold, axis=1)
+        if counts.max() > best_count:
+            best, best_count = idx[np.argmax(counts)], counts.max()
+    if best is None:
+        return fit_circle(points, method) + (np.ones(len(points), dtype=bool),)
+    inliers = np.abs(np.hypot(points[:, 0] - xc[best], points[:, 1] - yc[best]) - r[best]) < threshold
+    return fit_circle(points[inliers], method) + (inliers,)
 
-    L = abs(yP - yC)
+
+def find_pivot(f='../../data/m_hist.traj', method='taubin', ransac=False):
+    # trajectory files are memory mapped, CSV files are still accepted
+    with stage('read_positions'):
+        centers = read_positions(f)
+    observe('track_length', len(centers))
+
+    # The bob moves on a circle around the pivot
+    with stage('pivot_fit'):
+        if ransac:
+            xP, yP, L, _ = ransac_circle(centers, method=method)
+        else:
+            xP, yP, L = fit_circle(centers, method)
     print("Length of the string :")
     print(L)
     print ("Coordinates of the pivot :")
     print([xP, yP])
 
-    estimateLength = np.mean(np.sqrt((centers[:, 0] - xP) ** 2 + (centers[:, 1] - yP) ** 2))
-
-    return estimateLength, (xP, yP), centers
+    return L, (xP, yP), centers
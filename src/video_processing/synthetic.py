@@ -0,0 +1,22 @@
+"""
+desc: Synthetic pendulum videos, drawn with OpenCV, for the tests and the benchmarks.
+"""
+from __future__ import division, print_function
+
+import cv2
+import numpy as np
+
+
+def write_pendulum_video(path, n_frames=60, size=(640, 480)):
+    """Writes a blue ball swinging on a black background, returns the drawn centers"""
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, size)
+    centers = []
+    for t in range(n_frames):
+        frame = np.zeros((size[1], size[0], 3), np.uint8)
+        theta = 0.6 * np.cos(0.1 * t)
+        center = (int(size[0] / 2 + 300 * np.sin(theta)), int(100 + 300 * np.cos(theta)))
+        cv2.circle(frame, center, 20, (255, 0, 0), -1)
+        writer.write(frame)
+        centers.append(center)
+    writer.release()
+    return np.array(centers)
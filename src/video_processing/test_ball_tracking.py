@@ -0,0 +1,63 @@
+import cv2
+import numpy as np
+
+from video_processing import ball_tracking
+from video_processing.ball_tracking import chunk_centers, find_ball, show_tracking, track_video
+from video_processing.synthetic import write_pendulum_video
+
+
+def test_track_video(tmpdir):
+    path = str(tmpdir.join('pendulum.avi'))
+    drawn = write_pendulum_video(path)
+    centers = track_video(path, width=640)
+    assert centers.shape == drawn.shape
+    np.testing.assert_allclose(centers, drawn, atol=2)
+
+
+def test_incremental_tracking_matches_full_frame(tmpdir):
+    path = str(tmpdir.join('pendulum.avi'))
+    write_pendulum_video(path)
+    np.testing.assert_allclose(track_video(path, incremental=True), track_video(path), atol=2)
+
+
+def test_chunked_tracking_matches_full_frame(tmpdir):
+    path = str(tmpdir.join('pendulum.avi'))
+    drawn = write_pendulum_video(path)
+    # chunks not dividing the number of frames, and frames resized
+    np.testing.assert_allclose(track_video(path, width=640, chunk_size=16), drawn, atol=2)
+    np.testing.assert_allclose(track_video(path, width=320, chunk_size=7), track_video(path, width=320), atol=2)
+
+
+def test_chunk_centers_pick_the_largest_blob():
+    frames = np.zeros((3, 120, 160, 3), np.uint8)
+    cv2.circle(frames[0], (40, 60), 15, (255, 0, 0), -1)
+    cv2.circle(frames[1], (100, 50), 15, (255, 0, 0), -1)
+    # a smaller distractor, whose pixels would bias the moments of the whole mask
+    cv2.rectangle(frames[1], (10, 10), (20, 20), (255, 0, 0), -1)
+    centers, found = chunk_centers(frames)
+    assert list(found) == [True, True, False]
+    np.testing.assert_allclose(centers[:2], [(40, 60), (100, 50)], atol=1)
+    for frame, center in zip(frames[:2], centers):
+        np.testing.assert_allclose(find_ball(frame)[0], center, atol=1)
+
+
+def test_tracking_frames_without_ball(tmpdir, monkeypatch):
+    assert find_ball(np.zeros((100, 100, 3), np.uint8)) == (None, None, None)
+    # the ball leaves the frames half of the time, the display is not needed
+    path = str(tmpdir.join('blinking.avi'))
+    writer = cv2.VideoWriter(path, cv2.VideoWriter_fourcc(*'MJPG'), 30, (640, 480))
+    for t in range(20):
+        frame = np.zeros((480, 640, 3), np.uint8)
+        if t % 2:
+            cv2.circle(frame, (320 + 5 * t, 300), 20, (255, 0, 0), -1)
+        writer.write(frame)
+    writer.release()
+    for name, function in (('imshow', lambda *args: None), ('waitKey', lambda *args: -1),
+                           ('destroyAllWindows', lambda: None)):
+        monkeypatch.setattr(ball_tracking.cv2, name, function)
+    camera = cv2.VideoCapture(path)
+    try:
+        centers = show_tracking(camera, width=640)
+    finally:
+        camera.release()
+    assert centers.shape == (10, 2)
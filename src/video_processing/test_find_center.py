@@ -0,0 +1,15 @@
+import numpy as np
+
+from video_processing.find_center import fit_circle, ransac_circle
+
+
+def test_circle_fits_recover_pendulum_arc():
+    rng = np.random.RandomState(0)
+    theta = rng.uniform(-0.5, 0.5, 2000)
+    points = np.stack((300 + 250 * np.sin(theta), 60 + 250 * np.cos(theta)), axis=1) + rng.normal(0, 1, (2000, 2))
+    np.testing.assert_allclose(fit_circle(points), (300, 60, 250), atol=2)
+    points[:200] = rng.uniform(0, 600, (200, 2))
+    xc, yc, r, inliers = ransac_circle(points, seed=0)
+    np.testing.assert_allclose((xc, yc, r), (300, 60, 250), atol=2)
+    # most outliers rejected, a few fall near the arc by chance, and most arc points kept
+    assert inliers[:200].mean() < 0.1 and inliers[200:].mean() > 0.9